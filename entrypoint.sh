@@ -5,4 +5,6 @@ echo Starting migrations...
 python manage.py migrate
 
 echo Starting server...
-exec gunicorn scpdev.wsgi -w 32 -t 300 -b 0.0.0.0:8000 --preload
+# also read by the startup report of expected database connections
+export GUNICORN_WORKERS="${GUNICORN_WORKERS:-32}"
+exec gunicorn -c scpdev/gunicorn.conf.py
@@ -24,9 +24,11 @@ mod backlinks;
 mod page_callbacks;
 mod page_info;
 mod page_ref;
+mod user_ref;
 
 pub use self::backlinks::Backlinks;
 pub use self::page_callbacks::{ExpressionResult, NullPageCallbacks, PageCallbacks};
 pub use self::page_info::PageInfo;
 pub use self::page_info::PartialPageInfo;
 pub use self::page_ref::{PageRef, PageRefParseError};
+pub use self::user_ref::{FetchedUser, UserRef};
@@ -4,7 +4,7 @@ use std::fmt::{Debug, Formatter, Result};
 use wikidot_normalize::normalize;
 
 use super::page_info::PartialPageInfo;
-use super::PageRef;
+use super::{FetchedUser, PageRef, UserRef};
 
 #[derive(Debug)]
 pub enum ExpressionResult<'t> {
@@ -36,6 +36,14 @@ pub trait PageCallbacks: Debug {
         body: Cow<str>,
     ) -> Cow<'static, str>;
     fn render_user<'a>(&self, user: Cow<str>, avatar: bool) -> Cow<'static, str>;
+
+    /// Renders all users referenced by the page at once.
+    ///
+    /// Users missing from the result are rendered one by one using `render_user`.
+    fn fetch_users<'a>(&self, _users: &Vec<UserRef<'a>>) -> Vec<FetchedUser<'static>> {
+        vec![]
+    }
+
     fn get_i18n_message<'a>(&self, message_id: Cow<str>) -> Cow<'static, str>;
     fn get_html_injected_code<'a>(&self, html_id: Cow<str>) -> Cow<'static, str>;
     fn get_page_info<'a>(
@@ -0,0 +1,55 @@
+/*
+ * data/user_ref.rs
+ *
+ * ftml - Library to parse Wikidot text
+ * Copyright (C) 2019-2022 Wikijump Team
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ */
+
+use std::borrow::Cow;
+
+/// A reference to a user, as used by `[[user]]` and `[[*user]]`.
+#[derive(Serialize, Deserialize, Debug, Clone, Hash, PartialEq, Eq)]
+#[serde(rename_all = "kebab-case")]
+pub struct UserRef<'t> {
+    pub name: Cow<'t, str>,
+    pub show_avatar: bool,
+}
+
+impl UserRef<'_> {
+    pub fn to_owned(&self) -> UserRef<'static> {
+        UserRef {
+            name: Cow::Owned(self.name.as_ref().to_owned()),
+            show_avatar: self.show_avatar,
+        }
+    }
+}
+
+/// A user block that was rendered in bulk before the HTML render.
+#[derive(Serialize, Deserialize, Debug, Clone, PartialEq)]
+#[serde(rename_all = "kebab-case")]
+pub struct FetchedUser<'a> {
+    pub user_ref: UserRef<'a>,
+    pub html: Cow<'a, str>,
+}
+
+impl FetchedUser<'_> {
+    pub fn to_owned(&self) -> FetchedUser<'static> {
+        FetchedUser {
+            user_ref: self.user_ref.to_owned(),
+            html: Cow::Owned(self.html.as_ref().to_owned()),
+        }
+    }
+}
@@ -55,7 +55,7 @@ use self::parser::Parser;
 use self::rule::impls::RULE_PAGE;
 use self::string::parse_string;
 use self::strip::{strip_newlines, strip_whitespace};
-use crate::data::{PageCallbacks, PageInfo, PageRef};
+use crate::data::{PageCallbacks, PageInfo, PageRef, UserRef};
 use crate::next_index::{NextIndex, TableOfContentsIndex};
 use crate::settings::WikitextSettings;
 use crate::tokenizer::Tokenization;
@@ -97,6 +97,7 @@ where
         has_footnote_block,
         has_toc_block,
         internal_links,
+        users,
     } = parse_internal(page_info, page_callbacks, settings, tokenization);
 
     // For producing table of contents indexes
@@ -147,6 +148,7 @@ where
                 code,
                 html,
                 internal_links,
+                users,
             )
         }
         Err(warning) => {
@@ -162,6 +164,7 @@ where
             let table_of_contents = vec![];
             let footnotes = vec![];
             let internal_links = vec![];
+            let users = vec![];
 
             SyntaxTree::from_element_result(
                 elements,
@@ -172,6 +175,7 @@ where
                 code,
                 html,
                 internal_links,
+                users,
             )
         }
     }
@@ -199,6 +203,7 @@ where
     let code = parser.remove_code();
     let html = parser.remove_html();
     let internal_links = parser.remove_internal_links();
+    let users = parser.remove_users();
     let has_footnote_block = parser.has_footnote_block();
     let has_toc_block = parser.has_toc_block();
 
@@ -211,6 +216,7 @@ where
         has_footnote_block,
         has_toc_block,
         internal_links,
+        users,
     }
 }
 
@@ -315,4 +321,7 @@ pub struct UnstructuredParseResult<'r, 't> {
 
     // The list of internal links.
     pub internal_links: Vec<PageRef<'t>>,
+
+    // The list of [[user]] references.
+    pub users: Vec<UserRef<'t>>,
 }
@@ -24,7 +24,7 @@ use super::condition::ParseCondition;
 use super::rule::Rule;
 use super::RULE_PAGE;
 use super::{parse_internal, prelude::*, UnstructuredParseResult, WikiScriptScope};
-use crate::data::{PageCallbacks, PageInfo, PageRef};
+use crate::data::{PageCallbacks, PageInfo, PageRef, UserRef};
 use crate::render::text::TextRender;
 use crate::tokenizer::Tokenization;
 use crate::tree::{AcceptsPartial, AttributeMap, Container, ContainerType, HeadingLevel};
@@ -55,6 +55,7 @@ bitflags! {
         const Scopes = 1 << 6;
         const Code = 1 << 7;
         const HTML = 1 << 8;
+        const Users = 1 << 9;
     }
 }
 
@@ -87,6 +88,9 @@ struct ParserState<'t> {
     // Internal links
     internal_links: Rc<RefCell<Vec<PageRef<'t>>>>,
 
+    // List of [[user]]
+    users: Rc<RefCell<Vec<UserRef<'t>>>>,
+
     // Flags
     has_footnote_block: bool, // Whether a [[footnoteblock]] was created.
     has_toc_block: bool,      // Whether a [[toc]] was created.
@@ -189,6 +193,7 @@ impl<'r, 't> Parser<'r, 't> {
             code: make_shared_vec(),
             html: make_shared_vec(),
             internal_links: make_shared_vec(),
+            users: make_shared_vec(),
             has_footnote_block: false,
             has_toc_block: false,
             in_footnote: false,
@@ -248,6 +253,12 @@ impl<'r, 't> Parser<'r, 't> {
                 current.internal_links
             };
 
+        let cloned_users = if flags.contains(ParserTransactionFlags::Users) {
+            Rc::new(RefCell::new(current.users.borrow().to_vec()))
+        } else {
+            current.users
+        };
+
         self.state.push(ParserState {
             accepts_partial: current.accepts_partial,
             table_of_contents: cloned_toc,
@@ -255,6 +266,7 @@ impl<'r, 't> Parser<'r, 't> {
             code: cloned_code,
             html: cloned_html,
             internal_links: cloned_internal_links,
+            users: cloned_users,
             has_footnote_block: current.has_footnote_block,
             has_toc_block: current.has_toc_block,
             in_footnote: current.in_footnote,
@@ -305,6 +317,10 @@ impl<'r, 't> Parser<'r, 't> {
             current.internal_links = last_known.internal_links;
         }
 
+        if flags.contains(ParserTransactionFlags::Users) {
+            current.users = last_known.users;
+        }
+
         if flags.contains(ParserTransactionFlags::Scopes) {
             current.scopes = last_known.scopes;
         }
@@ -374,6 +390,7 @@ impl<'r, 't> Parser<'r, 't> {
             has_footnote_block,
             has_toc_block,
             internal_links,
+            users,
         } = parse_internal(
             self.page_info,
             self.page_callbacks.clone(),
@@ -413,6 +430,10 @@ impl<'r, 't> Parser<'r, 't> {
                     state.internal_links.borrow_mut().push(internal.to_owned());
                 }
 
+                for user in users {
+                    state.users.borrow_mut().push(user.to_owned());
+                }
+
                 state.has_footnote_block |= has_footnote_block;
                 state.has_toc_block |= has_toc_block;
 
@@ -725,6 +746,16 @@ impl<'r, 't> Parser<'r, 't> {
         mem::take(&mut self.state_mut().internal_links.borrow_mut())
     }
 
+    // Users
+    pub fn push_user(&mut self, user_ref: UserRef<'t>) {
+        self.state_mut().users.borrow_mut().push(user_ref);
+    }
+
+    #[cold]
+    pub fn remove_users(&mut self) -> Vec<UserRef<'t>> {
+        mem::take(&mut self.state_mut().users.borrow_mut())
+    }
+
     // Special for [[include]], appending a SyntaxTree
     pub fn append_toc_and_footnotes(
         &mut self,
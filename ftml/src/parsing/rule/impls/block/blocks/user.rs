@@ -19,6 +19,7 @@
  */
 
 use super::prelude::*;
+use crate::data::UserRef;
 
 pub const BLOCK_USER: BlockRule = BlockRule {
     name: "block-user",
@@ -51,6 +52,11 @@ fn parse_fn<'r, 't>(
 
     parser.replace_variables(name_with_vars.to_mut());
 
+    parser.push_user(UserRef {
+        name: name_with_vars.clone(),
+        show_avatar: flag_star,
+    });
+
     let element = Element::User {
         name: name_with_vars,
         show_avatar: flag_star,
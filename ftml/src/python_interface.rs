@@ -7,7 +7,7 @@ use pyo3::prelude::*;
 use pyo3::types::{PyBool, PyFloat, PyInt, PyString};
 use wikidot_normalize::normalize;
 
-use crate::data::{ExpressionResult, PageRef, PartialPageInfo};
+use crate::data::{ExpressionResult, FetchedUser, PageRef, PartialPageInfo, UserRef};
 use crate::includes::{FetchedPage, IncludeRef, NullIncluder};
 use crate::info::VERSION;
 use crate::prelude::*;
@@ -22,19 +22,22 @@ fn page_refs_to_owned(refs: &Vec<PageRef>) -> Vec<PageRef<'static>> {
     refs.iter().map(|x| x.to_owned()).collect()
 }
 
-fn render<R: Render>(
+fn parse_and_then<T, F>(
     input: &mut String,
-    renderer: &R,
     page_info: PageInfo,
     callbacks: Py<PyAny>,
     mode: WikitextMode,
+    f: F,
 ) -> (
-    R::Output,
+    T,
     Vec<String>,
     Vec<String>,
     Vec<(String, String)>,
     Vec<String>,
-) {
+)
+where
+    F: FnOnce(&SyntaxTree, &PageInfo, Rc<PythonCallbacks>, &WikitextSettings) -> T,
+{
     let mut settings = WikitextSettings::from_mode(mode);
     settings.use_include_compatibility = true;
 
@@ -69,7 +72,7 @@ fn render<R: Render>(
     let tokens = tokenize(text);
     let (tree, _warnings) =
         parse(&tokens, &page_info, page_callbacks.clone(), &settings).into();
-    let output = renderer.render(&tree, &page_info, page_callbacks, &settings);
+    let output = f(&tree, &page_info, page_callbacks, &settings);
 
     (
         output,
@@ -80,6 +83,56 @@ fn render<R: Render>(
     )
 }
 
+fn render<R: Render>(
+    input: &mut String,
+    renderer: &R,
+    page_info: PageInfo,
+    callbacks: Py<PyAny>,
+    mode: WikitextMode,
+) -> (
+    R::Output,
+    Vec<String>,
+    Vec<String>,
+    Vec<(String, String)>,
+    Vec<String>,
+) {
+    parse_and_then(
+        input,
+        page_info,
+        callbacks,
+        mode,
+        |tree, page_info, page_callbacks, settings| {
+            renderer.render(tree, page_info, page_callbacks, settings)
+        },
+    )
+}
+
+// Same as the text post-processing that used to be done in Python:
+// strip every line and collapse consecutive line breaks.
+fn normalize_text(text: &str) -> String {
+    let mut result = String::with_capacity(text.len());
+    let mut last_was_newline = false;
+    for (i, line) in text.split('\n').enumerate() {
+        if i > 0 && !last_was_newline {
+            result.push('\n');
+            last_was_newline = true;
+        }
+        let line = line.trim();
+        if !line.is_empty() {
+            result.push_str(line);
+            last_was_newline = false;
+        }
+    }
+    result
+}
+
+fn make_excerpt(text: &str, max_chars: usize) -> String {
+    match text.char_indices().nth(max_chars) {
+        Some((end, _)) => format!("{}...", &text[..end]),
+        None => text.to_owned(),
+    }
+}
+
 #[pyclass(name = "RenderResult")]
 struct PyRenderResult {
     #[pyo3(get)]
@@ -94,6 +147,24 @@ struct PyRenderResult {
     pub html: Vec<String>,
 }
 
+#[pyclass(name = "HtmlAndTextResult")]
+struct PyHtmlAndTextResult {
+    #[pyo3(get)]
+    pub body: String,
+    #[pyo3(get)]
+    pub text: String,
+    #[pyo3(get)]
+    pub excerpt: String,
+    #[pyo3(get)]
+    pub included_pages: Vec<String>,
+    #[pyo3(get)]
+    pub linked_pages: Vec<String>,
+    #[pyo3(get)]
+    pub code: Vec<(String, String)>,
+    #[pyo3(get)]
+    pub html: Vec<String>,
+}
+
 #[pyclass(name = "Parts")]
 struct PyParts {
     #[pyo3(get)]
@@ -193,6 +264,54 @@ impl PyPartialPageInfo {
     }
 }
 
+#[pyclass(name = "UserRef")]
+struct PyUserRef {
+    #[pyo3(get)]
+    pub name: String,
+    #[pyo3(get)]
+    pub show_avatar: bool,
+}
+
+impl<'t> From<&UserRef<'t>> for PyUserRef {
+    fn from(r: &UserRef<'t>) -> Self {
+        Self {
+            name: r.name.to_string(),
+            show_avatar: r.show_avatar,
+        }
+    }
+}
+
+#[pyclass(name = "FetchedUser")]
+struct PyFetchedUser {
+    name: String,
+    show_avatar: bool,
+    html: String,
+}
+
+#[pymethods]
+impl PyFetchedUser {
+    #[new]
+    fn new(name: String, show_avatar: bool, html: String) -> Self {
+        Self {
+            name,
+            show_avatar,
+            html,
+        }
+    }
+}
+
+impl PyFetchedUser {
+    fn to_fetched_user(&self) -> FetchedUser<'static> {
+        FetchedUser {
+            user_ref: UserRef {
+                name: Cow::from(self.name.to_owned()),
+                show_avatar: self.show_avatar,
+            },
+            html: Cow::from(self.html.to_owned()),
+        }
+    }
+}
+
 #[pyclass(name = "PageInfo")]
 struct PyPageInfo {
     page: String,
@@ -348,6 +467,25 @@ impl PageCallbacks for PythonCallbacks {
         }
     }
 
+    fn fetch_users<'a>(&self, users: &Vec<UserRef<'a>>) -> Vec<FetchedUser<'static>> {
+        let py_users: Vec<PyUserRef> = users.iter().map(|x| PyUserRef::from(x)).collect();
+        let result: PyResult<Vec<FetchedUser<'static>>> = Python::with_gil(|py| {
+            Ok(self
+                .callbacks
+                .getattr(py, "fetch_users")?
+                .call(py, (py_users,), None)?
+                .extract::<Vec<PyRef<PyFetchedUser>>>(py)?
+                .iter()
+                .map(|x| x.to_fetched_user())
+                .collect())
+        });
+        log_python_error(&result);
+        match result {
+            Ok(users) => users,
+            Err(_) => vec![],
+        }
+    }
+
     fn get_i18n_message<'a>(&self, message_id: Cow<str>) -> Cow<'static, str> {
         let result: PyResult<String> = Python::with_gil(|py| {
             return self
@@ -514,6 +652,13 @@ impl Callbacks {
         return Ok(format!("UnimplementedUser[{user}]").to_string());
     }
 
+    pub fn fetch_users(
+        &self,
+        _users: Vec<PyRef<PyUserRef>>,
+    ) -> PyResult<Vec<PyFetchedUser>> {
+        return Ok(vec![]);
+    }
+
     pub fn get_i18n_message(&self, _message_id: String) -> PyResult<String> {
         return Ok(String::from("?"));
     }
@@ -571,20 +716,43 @@ fn mode_to_wikitext_mode(mode: String) -> WikitextMode {
     }
 }
 
+// With release_gil, all functions below run tokenizing, parsing and rendering with the GIL released,
+// so that renders in different Python threads can run in parallel.
+// PythonCallbacks re-acquires the GIL with Python::with_gil for every call into Python, and the closure
+// has to be Send, so nothing that needs the GIL can be used in it without taking it first.
+fn maybe_allow_threads<T, F>(py: Python, release_gil: Option<bool>, f: F) -> T
+where
+    F: Send + FnOnce() -> T,
+    T: Send,
+{
+    if release_gil.unwrap_or(false) {
+        py.allow_threads(f)
+    } else {
+        f()
+    }
+}
+
 #[pyfunction]
 fn render_html(
+    py: Python,
     source: String,
     callbacks: Py<PyAny>,
     page_info: &PyPageInfo,
     mode: String,
+    release_gil: Option<bool>,
 ) -> PyResult<PyRenderResult> {
-    let (html_output, included_pages, linked_pages, code, html) = render(
-        &mut source.to_string(),
-        &HtmlRender,
-        page_info.to_page_info(),
-        callbacks,
-        mode_to_wikitext_mode(mode),
-    );
+    let page_info = page_info.to_page_info();
+    let mode = mode_to_wikitext_mode(mode);
+    let (html_output, included_pages, linked_pages, code, html) =
+        maybe_allow_threads(py, release_gil, move || {
+            render(
+                &mut source.to_string(),
+                &HtmlRender,
+                page_info,
+                callbacks,
+                mode,
+            )
+        });
 
     Ok(PyRenderResult {
         body: html_output.body,
@@ -597,18 +765,25 @@ fn render_html(
 
 #[pyfunction]
 fn render_text(
+    py: Python,
     source: String,
     callbacks: Py<PyAny>,
     page_info: &PyPageInfo,
     mode: String,
+    release_gil: Option<bool>,
 ) -> PyResult<PyRenderResult> {
-    let (text_output, included_pages, linked_pages, code, html) = render(
-        &mut source.to_string(),
-        &TextRender,
-        page_info.to_page_info(),
-        callbacks,
-        mode_to_wikitext_mode(mode),
-    );
+    let page_info = page_info.to_page_info();
+    let mode = mode_to_wikitext_mode(mode);
+    let (text_output, included_pages, linked_pages, code, html) =
+        maybe_allow_threads(py, release_gil, move || {
+            render(
+                &mut source.to_string(),
+                &TextRender,
+                page_info,
+                callbacks,
+                mode,
+            )
+        });
 
     Ok(PyRenderResult {
         body: text_output,
@@ -620,17 +795,64 @@ fn render_text(
 }
 
 #[pyfunction]
-fn collect_backlinks(
+fn render_html_and_text(
+    py: Python,
     source: String,
     callbacks: Py<PyAny>,
     page_info: &PyPageInfo,
     mode: String,
-) -> PyResult<PyRenderResult> {
-    let mut settings = WikitextSettings::from_mode(mode_to_wikitext_mode(mode));
+    excerpt_length: Option<usize>,
+    release_gil: Option<bool>,
+) -> PyResult<PyHtmlAndTextResult> {
+    let page_info = page_info.to_page_info();
+    let mode = mode_to_wikitext_mode(mode);
+    let excerpt_length = excerpt_length.unwrap_or(384);
+    maybe_allow_threads(py, release_gil, move || {
+        let ((html_output, text_output), included_pages, linked_pages, code, html) =
+            parse_and_then(
+                &mut source.to_string(),
+                page_info,
+                callbacks,
+                mode,
+                |tree, page_info, page_callbacks, settings| {
+                    let html_output = HtmlRender.render(
+                        tree,
+                        page_info,
+                        page_callbacks.clone(),
+                        settings,
+                    );
+                    let text_output =
+                        TextRender.render(tree, page_info, page_callbacks, settings);
+                    (html_output, text_output)
+                },
+            );
+
+        let text = normalize_text(&text_output);
+        let excerpt = make_excerpt(&text, excerpt_length);
+
+        Ok(PyHtmlAndTextResult {
+            body: html_output.body,
+            text,
+            excerpt,
+            included_pages,
+            linked_pages,
+            code,
+            html,
+        })
+    })
+}
+
+fn parse_without_includes(
+    source: String,
+    callbacks: Py<PyAny>,
+    page_info: PageInfo,
+    mode: WikitextMode,
+) -> (Vec<String>, Vec<String>, Vec<(String, String)>, Vec<String>) {
+    let mut settings = WikitextSettings::from_mode(mode);
     settings.use_include_compatibility = true;
 
     let page_callbacks = Rc::new(PythonCallbacks {
-        callbacks: Box::new(callbacks.clone()),
+        callbacks: Box::new(callbacks),
     });
 
     let includer = NullIncluder {};
@@ -644,52 +866,59 @@ fn collect_backlinks(
 
     let text = &mut included_text.clone();
     let tokens = tokenize(text);
-    let page_info = page_info.to_page_info();
     let (tree, _warnings) =
         parse(&tokens, &page_info, page_callbacks.clone(), &settings).into();
 
+    (
+        page_refs_to_string(&included_pages),
+        page_refs_to_string(&tree.internal_links),
+        tree.code,
+        tree.html,
+    )
+}
+
+#[pyfunction]
+fn collect_backlinks(
+    py: Python,
+    source: String,
+    callbacks: Py<PyAny>,
+    page_info: &PyPageInfo,
+    mode: String,
+    release_gil: Option<bool>,
+) -> PyResult<PyRenderResult> {
+    let page_info = page_info.to_page_info();
+    let mode = mode_to_wikitext_mode(mode);
+    let (included_pages, linked_pages, code, html) =
+        maybe_allow_threads(py, release_gil, move || {
+            parse_without_includes(source, callbacks, page_info, mode)
+        });
+
     Ok(PyRenderResult {
         body: String::from(""),
-        included_pages: page_refs_to_string(&included_pages),
-        linked_pages: page_refs_to_string(&tree.internal_links),
-        code: tree.code,
-        html: tree.html,
+        included_pages,
+        linked_pages,
+        code,
+        html,
     })
 }
 
 #[pyfunction]
 fn collect_code_and_html(
+    py: Python,
     source: String,
     callbacks: Py<PyAny>,
     page_info: &PyPageInfo,
     mode: String,
+    release_gil: Option<bool>,
 ) -> PyResult<PyParts> {
-    let mut settings = WikitextSettings::from_mode(mode_to_wikitext_mode(mode));
-    settings.use_include_compatibility = true;
-
-    let page_callbacks = Rc::new(PythonCallbacks {
-        callbacks: Box::new(callbacks.clone()),
-    });
-
-    let includer = NullIncluder {};
-
-    let text = &mut source.clone();
-    preprocess(text);
-    let (included_text, _included_pages) = include(&text, &settings, includer, || {
-        panic!("Mismatched includer page count")
-    })
-    .unwrap_or((source.to_owned(), vec![]));
-
-    let text = &mut included_text.clone();
-    let tokens = tokenize(text);
     let page_info = page_info.to_page_info();
-    let (tree, _warnings) =
-        parse(&tokens, &page_info, page_callbacks.clone(), &settings).into();
+    let mode = mode_to_wikitext_mode(mode);
+    let (_included_pages, _linked_pages, code, html) =
+        maybe_allow_threads(py, release_gil, move || {
+            parse_without_includes(source, callbacks, page_info, mode)
+        });
 
-    Ok(PyParts {
-        code: tree.code,
-        html: tree.html,
-    })
+    Ok(PyParts { code, html })
 }
 
 #[pymodule]
@@ -697,6 +926,7 @@ fn ftml(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add("ftml_version", VERSION.to_string())?;
     m.add_function(wrap_pyfunction!(render_html, m)?)?;
     m.add_function(wrap_pyfunction!(render_text, m)?)?;
+    m.add_function(wrap_pyfunction!(render_html_and_text, m)?)?;
     m.add_function(wrap_pyfunction!(collect_backlinks, m)?)?;
     m.add_function(wrap_pyfunction!(collect_code_and_html, m)?)?;
     m.add_class::<Callbacks>()?;
@@ -704,6 +934,8 @@ fn ftml(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_class::<PyIncludeRef>()?;
     m.add_class::<PyFetchedPage>()?;
     m.add_class::<PyPartialPageInfo>()?;
+    m.add_class::<PyUserRef>()?;
+    m.add_class::<PyFetchedUser>()?;
 
     Ok(())
 }
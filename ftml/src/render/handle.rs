@@ -18,7 +18,7 @@
  * along with this program. If not, see <http://www.gnu.org/licenses/>.
  */
 
-use crate::data::{PageInfo, PageRef, PartialPageInfo};
+use crate::data::{FetchedUser, PageInfo, PageRef, PartialPageInfo, UserRef};
 use crate::prelude::PageCallbacks;
 use crate::settings::WikitextSettings;
 use crate::tree::{ImageSource, LinkLabel, LinkLocation};
@@ -31,24 +31,38 @@ use strum_macros::IntoStaticStr;
 pub struct Handle<'t> {
     callbacks: Rc<dyn PageCallbacks>,
     internal_links: HashMap<PageRef<'t>, PartialPageInfo<'t>>,
+    users: HashMap<UserRef<'t>, Cow<'t, str>>,
 }
 
 impl<'t> Handle<'t> {
     pub fn new(
         callbacks: Rc<dyn PageCallbacks>,
         raw_internal_links: &Vec<PartialPageInfo<'t>>,
+        raw_users: &Vec<FetchedUser<'t>>,
     ) -> Self {
         let mut internal_links = HashMap::new();
         for info in raw_internal_links {
             internal_links.insert(info.page_ref.to_owned(), info.to_owned());
         }
 
+        let mut users = HashMap::new();
+        for user in raw_users {
+            users.insert(user.user_ref.to_owned(), user.html.clone());
+        }
+
         Handle {
             callbacks,
             internal_links,
+            users,
         }
     }
 
+    pub fn get_rendered_user(&self, user_ref: &UserRef) -> Option<&str> {
+        info!("Looking up prefetched user");
+
+        self.users.get(user_ref).map(|html| html.as_ref())
+    }
+
     pub fn get_page_title(&self, page_ref: &PageRef) -> Option<String> {
         info!("Fetching page title");
 
@@ -21,13 +21,19 @@
 use std::borrow::Cow;
 
 use super::prelude::*;
+use crate::data::UserRef;
 
 pub fn render_user(ctx: &mut HtmlContext, name: &str, show_avatar: bool) {
     info!("Rendering user block (name '{name}', show-avatar {show_avatar})");
 
-    let rendered: Cow<str> = {
-        let v = ctx.callbacks().render_user(Cow::from(name), show_avatar);
-        v
+    let user_ref = UserRef {
+        name: Cow::from(name),
+        show_avatar,
+    };
+
+    let rendered: Cow<str> = match ctx.handle().get_rendered_user(&user_ref) {
+        Some(html) => Cow::Borrowed(html),
+        None => ctx.callbacks().render_user(Cow::from(name), show_avatar),
     };
     str_write!(ctx.buffer(), "{}", rendered);
 }
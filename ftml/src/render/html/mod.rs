@@ -65,7 +65,20 @@ impl Render for HtmlRender {
 
         // fetch page details
         let internal_links = page_callbacks.get_page_info(&tree.internal_links);
-        let handle = Handle::new(page_callbacks.clone(), &internal_links);
+
+        // render all users at once instead of one callback per [[user]]
+        let users = if tree.users.is_empty() {
+            vec![]
+        } else {
+            let mut user_refs = tree.users.clone();
+            user_refs.sort_by(|a, b| {
+                (a.name.as_ref(), a.show_avatar).cmp(&(b.name.as_ref(), b.show_avatar))
+            });
+            user_refs.dedup();
+            page_callbacks.fetch_users(&user_refs)
+        };
+
+        let handle = Handle::new(page_callbacks.clone(), &internal_links, &users);
 
         let mut ctx = HtmlContext::new(
             page_info,
@@ -70,7 +70,7 @@ impl TextRender {
             },
         );
 
-        let handle = Handle::new(page_callbacks.clone(), &vec![]);
+        let handle = Handle::new(page_callbacks.clone(), &vec![], &vec![]);
 
         let mut ctx = TextContext::new(
             page_info,
@@ -29,7 +29,7 @@
 //!
 //! This module has helpers to make this process easier.
 
-use crate::data::PageRef;
+use crate::data::{PageRef, UserRef};
 
 use super::element::Element;
 use super::list::ListItem;
@@ -76,6 +76,13 @@ pub fn page_refs_to_owned(page_refs: &[PageRef<'_>]) -> Vec<PageRef<'static>> {
         .collect()
 }
 
+pub fn user_refs_to_owned(user_refs: &[UserRef<'_>]) -> Vec<UserRef<'static>> {
+    user_refs
+        .iter()
+        .map(|user_ref| user_ref.to_owned())
+        .collect()
+}
+
 pub fn string_map_to_owned(
     map: &HashMap<Cow<'_, str>, Cow<'_, str>>,
 ) -> HashMap<Cow<'static, str>, Cow<'static, str>> {
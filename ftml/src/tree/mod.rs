@@ -45,7 +45,7 @@ pub use self::align::*;
 pub use self::anchor::*;
 pub use self::attribute::AttributeMap;
 pub use self::clear_float::*;
-use self::clone::page_refs_to_owned;
+use self::clone::{page_refs_to_owned, user_refs_to_owned};
 pub use self::container::*;
 pub use self::date::Date;
 pub use self::definition_list::*;
@@ -64,7 +64,7 @@ pub use self::tag::*;
 pub use self::variables::*;
 
 use self::clone::{elements_lists_to_owned, elements_to_owned};
-use crate::data::PageRef;
+use crate::data::{PageRef, UserRef};
 use crate::parsing::{ParseOutcome, ParseWarning};
 
 #[derive(Serialize, Deserialize, Debug, Default, Clone, PartialEq, Eq)]
@@ -97,6 +97,11 @@ pub struct SyntaxTree<'t> {
     ///
     /// This is used for bulk querying the database for page titles and existence.
     pub internal_links: Vec<PageRef<'t>>,
+
+    /// The list of users referenced in the tree.
+    ///
+    /// This is used for bulk querying the database for users and their roles.
+    pub users: Vec<UserRef<'t>>,
 }
 
 impl<'t> SyntaxTree<'t> {
@@ -109,6 +114,7 @@ impl<'t> SyntaxTree<'t> {
         code: Vec<(String, String)>,
         html: Vec<String>,
         internal_links: Vec<PageRef<'t>>,
+        users: Vec<UserRef<'t>>,
     ) -> ParseOutcome<Self> {
         let tree = SyntaxTree {
             elements,
@@ -118,6 +124,7 @@ impl<'t> SyntaxTree<'t> {
             code,
             html,
             internal_links,
+            users,
         };
         ParseOutcome::new(tree, warnings)
     }
@@ -131,6 +138,7 @@ impl<'t> SyntaxTree<'t> {
             code: self.code.to_owned(),
             html: self.html.to_owned(),
             internal_links: page_refs_to_owned(&self.internal_links),
+            users: user_refs_to_owned(&self.users),
         }
     }
 }
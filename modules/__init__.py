@@ -71,6 +71,17 @@ def module_allows_api(name_or_module):
     return m.__dict__['allow_api']()
 
 
+# Modules opt into render caching by defining is_cacheable(context, params).
+# This should only return True if the output depends on nothing but params, body, current page and path params.
+def module_is_cacheable(name_or_module, context, params):
+    m = get_module(name_or_module)
+    if m is None:
+        return False
+    if 'is_cacheable' not in m.__dict__ or not callable(m.__dict__['is_cacheable']):
+        return False
+    return m.__dict__['is_cacheable'](context, params)
+
+
 @transaction.atomic
 def render_module(name, context, params, content=None):
     if context and context.path_params.get('nomodule', 'false') == 'true':
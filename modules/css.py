@@ -8,6 +8,10 @@ def has_content():
     return True
 
 
+def is_cacheable(_context, _params):
+    return True
+
+
 def render(context: RenderContext, params, content=''):
     params = {**(context.path_params if context else {}), **params}
     head = get_boolean_param(params, 'head')
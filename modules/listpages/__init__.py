@@ -3,19 +3,22 @@ import urllib.parse
 import math
 import re
 
+from typing import Optional
+
+from django.utils.html import escape
 from django.utils.safestring import SafeString
 
 import renderer
-from renderer.templates import apply_template
+from renderer.templates import apply_template, compile_template
 from renderer.utils import render_user_to_text, render_template_from_string, get_boolean_param
 from renderer.parser import RenderContext
 from web.controllers import articles
 from web.models.users import User
-from web.models.articles import Article, ArticleLogEntry
+from web.models.articles import Article, ArticleLogEntry, ArticleRating, Tag, Vote
 from web.models.settings import Settings
-from django.db.models import Q, Value as V, F, Count, Sum, Avg, Case, When, IntegerField, FloatField
-from django.db.models.functions import Random, Coalesce, Round, Cast 
-from web import threadvars
+from django.db.models import Q, Value as V, F, Count, Case, When, IntegerField, OuterRef, Subquery, Prefetch, prefetch_related_objects
+from django.db.models.functions import Random, Coalesce
+from web import identity_map, threadvars
 from web.types import _ArticleType
 
 from .._csrf_protection import csrf_safe_method
@@ -40,7 +43,7 @@ def api_get(context, _params):
 def render_date(date, format='%H:%M %d.%m.%Y'):
     if not date:
         return 'n/a'
-    return render_template_from_string('<span class="odate w-date" style="display: inline" data-timestamp="{{ timestamp }}" data-format="{{ format }}">{{ serverside }}</span>', timestamp=int(date.timestamp()*1000), format=format, serverside=date.strftime(format))
+    return SafeString('<span class="odate w-date" style="display: inline" data-timestamp="%d" data-format="%s">%s</span>' % (int(date.timestamp()*1000), escape(format), escape(date.strftime(format))))
 
 
 def render_var(var, page_vars, page):
@@ -61,40 +64,147 @@ def render_var(var, page_vars, page):
             return page_vars['updated_at']
     return None
 
-def get_page_vars(page: _ArticleType)-> dict[str, str] | LazyDict:
+def _get_current_user():
+    current_user = threadvars.get('current_user', None)
+    if not isinstance(current_user, User):
+        return None
+    return current_user
+
+
+class PageVarsBatch:
+    # Data behind page variables for a whole list of pages. Each kind of data is loaded for all pages at once
+    # the first time any page needs it, so templates that don't use e.g. authors don't query them.
+    def __init__(self, pages: list[_ArticleType], viewer=None):
+        self.pages = [page for page in pages if page is not None]
+        self.viewer = viewer
+        self._loaded = dict()
+
+    def _load(self, kind, loader):
+        if kind not in self._loaded:
+            self._loaded[kind] = loader()
+        return self._loaded[kind]
+
+    def _page_ids(self):
+        return [page.id for page in self.pages]
+
+    # query_pages annotates pages with what their template needs (see annotate_page_vars)
+    def _annotated(self, name):
+        return all(hasattr(page, name) for page in self.pages)
+
+    def _load_ratings(self):
+        if self._annotated('pv_count_rate'):
+            votes_map = {page.id: {k: getattr(page, 'pv_%s' % k) for k in articles.RATING_STATS} for page in self.pages}
+        else:
+            stats = ArticleRating.objects.filter(article_id__in=self._page_ids()).values('article_id', *articles.RATING_STATS.keys())
+            votes_map = {v['article_id']: v for v in stats}
+        return articles.get_ratings_from_stats(self.pages, votes_map)
+
+    def get_rating(self, page: Article):
+        ratings = self._load('ratings', self._load_ratings)
+        return ratings.get(page.id, (0, 0, 0, Settings.RatingMode.Disabled))
+
+    def get_authors(self, page: Article):
+        self._load('authors', lambda: prefetch_related_objects(self.pages, 'authors'))
+        return list(page.authors.all())
+
+    def _load_latest_log_entries(self):
+        entries = ArticleLogEntry.objects \
+            .filter(article_id__in=self._page_ids()) \
+            .order_by('article_id', '-rev_number') \
+            .distinct('article_id') \
+            .select_related('user')
+        return {entry.article_id: entry for entry in entries}
+
+    def get_latest_log_entry(self, page: Article):
+        entries = self._load('latest_log_entries', self._load_latest_log_entries)
+        return entries.get(page.id)
+
+    def get_updated_by(self, page: Article):
+        # pages that have any history know their last editor without looking at it
+        if page.latest_rev_number is not None:
+            return page.last_editor
+        log_entry = self.get_latest_log_entry(page)
+        return log_entry.user if log_entry else None
+
+    def _load_revisions(self):
+        if self._annotated('pv_revisions'):
+            return {page.id: page.pv_revisions for page in self.pages}
+        return dict(
+            ArticleLogEntry.objects
+                .filter(article_id__in=self._page_ids())
+                .values('article_id')
+                .annotate(count=Count('id'))
+                .values_list('article_id', 'count')
+        )
+
+    def get_revisions(self, page: Article):
+        counts = self._load('revisions', self._load_revisions)
+        return counts.get(page.id, 0)
+
+    def get_tags(self, page: Article):
+        self._load('tags', lambda: prefetch_related_objects(self.pages, Prefetch('tags', queryset=Tag.objects.select_related('category'))))
+        return sorted(tag.full_name.lower() for tag in page.tags.all())
+
+    def has_voted(self, page: Article):
+        voted = self._load('voted', lambda: set(Vote.objects.filter(article_id__in=self._page_ids(), user=self.viewer).values_list('article_id', flat=True)))
+        return page.id in voted
+
+
+# Page variables grouped by the data they need
+_AUTHORS_VARS = {'created_by', 'created_by_linked', 'created_by_linked_plain', 'authors_count'}
+_TAGS_VARS = {'tags', 'tags_linked'}
+_UPDATED_BY_VARS = {'updated_by', 'updated_by_linked', 'updated_by_linked_plain'}
+_RATING_VARS = {'rating', 'rating_votes', 'popularity'}
+_REVISIONS_VARS = {'revisions'}
+
+
+def get_template_page_vars(template: str) -> set[str]:
+    return compile_template(template).variables
+
+
+# Adds what the page variables used by a template need to the pages query, so that PageVarsBatch
+# doesn't have to query for it separately.
+def annotate_page_vars(q, page_vars: set[str]):
+    if page_vars & _AUTHORS_VARS:
+        q = q.prefetch_related('authors')
+    if page_vars & _UPDATED_BY_VARS:
+        q = q.select_related('last_editor')
+    if page_vars & _REVISIONS_VARS:
+        revisions = ArticleLogEntry.objects.filter(article=OuterRef('pk')).order_by().values('article').annotate(count=Count('id')).values('count')
+        q = q.annotate(pv_revisions=Coalesce(Subquery(revisions), 0))
+    if page_vars & _RATING_VARS:
+        for name in articles.RATING_STATS:
+            q = q.annotate(**{'pv_%s' % name: Coalesce(F('rating_stats__%s' % name), 0.0 if name in ('sum_rate', 'avg_rate') else 0)})
+    return q
+
+
+def get_page_vars(page: _ArticleType, batch: Optional[PageVarsBatch]=None) -> dict[str, str] | LazyDict:
     if page is None:
         return dict()
 
-    current_user = threadvars.get('current_user', None)
-    if not isinstance(current_user, User):
-        current_user = None
-    
-    updated_by = None
+    current_user = _get_current_user()
+    if page.pk is None:
+        return _build_page_vars(page, batch, current_user).overlay()
+
+    # page variables are requested for the same page by the ListPages row, by this| variables and by includes;
+    # they are built once per page and viewer in a request, and callers get an overlay they are free to modify.
+    # They are kept in the identity map, so that changes to the page during the request drop them (see web/events/identity_map.py)
+    page_vars = identity_map.get_or_load('page_vars', (page.pk, getattr(current_user, 'pk', None)), lambda: _build_page_vars(page, batch, current_user))
+    return page_vars.overlay()
+
+
+def _build_page_vars(page: _ArticleType, batch: Optional[PageVarsBatch], current_user) -> LazyDict:
+    if batch is None:
+        batch = PageVarsBatch([page], current_user)
 
     def get_updated_by():
-        nonlocal updated_by
-        if not updated_by:
-            updated_by = articles.get_latest_log_entry(page).user
+        return batch.get_updated_by(page)
 
-        return updated_by
-    
-    rating_cache = {}
-    def get_rating(key: str):
-        nonlocal rating_cache
-        if not rating_cache:
-            _, votes, popularity, _ = articles.get_rating(page)
-            rating_cache['votes'] = votes
-            rating_cache['popularity'] = popularity
-        return rating_cache[key]
-    
-    authors = []
-    def get_authors():
-        nonlocal authors
-        if not authors:
-            authors = [author for author in page.authors.all()]
-        return authors
-    
-    get_created_by_linked = lambda plain: lambda: ' '.join((f'[[{'*'*(not plain)}user %s]]' % author.username) if author and 'username' in author.__dict__ else render_user_to_text(author) for author in get_authors())
+    def get_formatted_rating():
+        rating, votes, _, mode = batch.get_rating(page)
+        return articles.format_rating(rating, votes, mode)
+
+    get_created_by_linked = lambda plain: lambda: ' '.join((f'[[{'*'*(not plain)}user %s]]' % author.username) if author and 'username' in author.__dict__ else render_user_to_text(author) for author in batch.get_authors(page))
     get_updated_by_linked = lambda plain: lambda: (f'[[{'*'*(not plain)}user %s]]' % get_updated_by().username) if get_updated_by() and 'username' in get_updated_by().__dict__ else render_user_to_text(get_updated_by())
 
     page_vars = LazyDict({
@@ -108,23 +218,23 @@ def get_page_vars(page: _ArticleType)-> dict[str, str] | LazyDict:
         'parent_linked': lambda: ('[[[%s|]]]' % (articles.get_full_name(page.parent))) if page.parent else None,
         'link': lambda: '/%s' % page.title,  # temporary, must be full page URL based on hostname
         'content': lambda: articles.get_latest_source(page),
-        'rating': lambda: articles.get_formatted_rating(page),
-        'rating_votes': lambda: str(get_rating('votes')),
-        'current_user_voted': lambda: 'True' if page.votes.filter(user=current_user).exists() else 'False',
-        'popularity': lambda: str(get_rating('popularity')),
-        'revisions': lambda: str(len(ArticleLogEntry.objects.filter(article=page))),
-        'created_by': lambda: ' '.join([f'[[span]]{render_user_to_text(author)}[[/span]]' for author in get_authors()]),
+        'rating': get_formatted_rating,
+        'rating_votes': lambda: str(batch.get_rating(page)[1]),
+        'current_user_voted': lambda: 'True' if batch.has_voted(page) else 'False',
+        'popularity': lambda: str(batch.get_rating(page)[2]),
+        'revisions': lambda: str(batch.get_revisions(page)),
+        'created_by': lambda: ' '.join([f'[[span]]{render_user_to_text(author)}[[/span]]' for author in batch.get_authors(page)]),
         'created_by_linked': get_created_by_linked(False),
         'created_by_linked_plain': get_created_by_linked(True),
         'updated_by': lambda: render_user_to_text(get_updated_by()),
         'updated_by_linked': get_updated_by_linked(False),
         'updated_by_linked_plain': get_updated_by_linked(True),
-        'authors_count': lambda: str(len(get_authors())),
+        'authors_count': lambda: str(len(batch.get_authors(page))),
         # content{n} = content sections are not supported yet
         # preview and preview(n) = first characters of the page are not supported yet
         # summary = wtf is this?
-        'tags': lambda: ', '.join(articles.get_tags(page)),
-        'tags_linked': lambda: ', '.join(('[/system:page-tags/tag/%s %s]' % (urllib.parse.quote(tag, safe=''), tag)) for tag in articles.get_tags(page)),
+        'tags': lambda: ', '.join(batch.get_tags(page)),
+        'tags_linked': lambda: ', '.join(('[/system:page-tags/tag/%s %s]' % (urllib.parse.quote(tag, safe=''), tag)) for tag in batch.get_tags(page)),
         # _tags, _tags_linked, _tags_linked|link_prefix = not yet
         # form_data{name}, form_raw{name}, form_label{name}, form_hint{name} = never ever
         'created_at': lambda: '[[date %d]]' % int(page.created_at.timestamp()),
@@ -152,7 +262,8 @@ def page_to_listpages_vars(page: Article, template, index, total, page_vars=None
     return template
 
 
-def query_pages(article: Article, params: dict[str, str], viewer=None, path_params=None, allow_pagination=True, always_query=False):
+# page_vars are names of page variables the results will be rendered with, see annotate_page_vars
+def query_pages(article: Article, params: dict[str, str], viewer=None, path_params=None, allow_pagination=True, always_query=False, page_vars: Optional[set[str]]=None):
     if path_params is None:
         path_params = {}
 
@@ -217,22 +328,23 @@ def query_pages(article: Article, params: dict[str, str], viewer=None, path_para
     has_tags = parsed_params.has_type(param.Tags)
     has_parent = parsed_params.has_type(param.Parent) or parsed_params.has_type(param.NotParent)
 
-    if has_rating or has_votes or has_popularity:
-        prefetch_related.append('votes')
-
-    if has_tags:
-        prefetch_related.append('tags')
+    if has_tags or (page_vars and page_vars & _TAGS_VARS):
+        prefetch_related.append(Prefetch('tags', queryset=Tag.objects.select_related('category')))
 
     if has_parent:
         select_related.append('parent')
 
     q = Article.objects.select_related(*select_related)
-    q = q.prefetch_related(*prefetch_related).distinct()
+    q = q.prefetch_related(*prefetch_related)
     q = q.exclude(category__in=hidden_categories)
 
-    # detect required annotations and annotate if needed
+    # detect required annotations and annotate if needed.
+    # every article has an ArticleRating row (see web/events/article_rating.py), so it's an inner join, and sorting or filtering by these uses its indexes
+    if has_rating or has_votes or has_popularity:
+        q = q.filter(rating_stats__isnull=False)
+
     if has_votes:
-        q = q.annotate(num_votes=Count('votes', distinct=True))
+        q = q.annotate(num_votes=F('rating_stats__count_rate'))
 
     if has_rating or has_popularity:
         requested_category = '_default'
@@ -243,23 +355,22 @@ def query_pages(article: Article, params: dict[str, str], viewer=None, path_para
         rating_func = F('id')
 
         obj_settings = Article(name='_tmp', category=requested_category or '_default').settings
-        popularity_filter = V(True)
+        popularity_func = Case(When(Q(rating_stats__count_rate__gt=0), then=V(100)), default=V(0), output_field=IntegerField())
         if obj_settings.rating_mode == Settings.RatingMode.UpDown:
-            rating_func = Coalesce(Sum('votes__rate'), 0)
-            popularity_filter = Q(votes__rate__gt=0)
+            rating_func = F('rating_stats__sum_rate')
+            popularity_func = F('rating_stats__popularity_updown')
         elif obj_settings.rating_mode == Settings.RatingMode.Stars:
-            rating_func = Coalesce(Avg('votes__rate'), 0.0)
-            popularity_filter = Q(votes__rate__gte=3.0)
-
+            rating_func = F('rating_stats__avg_rate')
+            popularity_func = F('rating_stats__popularity_stars')
 
         if has_rating:
             q = q.annotate(rating=rating_func)
         if has_popularity:
-            q = q.annotate(num_votes_above_popularity=Count('votes', filter=popularity_filter, distinct=True))
-            q = q.annotate(popularity=Case(
-                When(Q(num_votes__gt=0), then=Round((Cast(F('num_votes_above_popularity'), FloatField()) / Cast(F('num_votes'), FloatField())) * 100, output_field=IntegerField())),
-                When(Q(num_votes=0), then=0))
-            )
+            q = q.annotate(popularity=popularity_func)
+
+    # joins that may repeat an article; without them there is nothing to deduplicate, and DISTINCT would
+    # make the database sort the whole result instead of reading it in index order
+    needs_distinct = False
 
     requested_offset = 0
     requested_limit = None
@@ -288,6 +399,7 @@ def query_pages(article: Article, params: dict[str, str], viewer=None, path_para
                     q = q.filter(tags__in=required).annotate(num_required_tags=Count('tags', distinct=True, filter=Q(tags__in=required))).filter(num_required_tags=len(required))
                 if present:
                     q = q.filter(tags__in=present)
+                    needs_distinct = True
                 if absent:
                     q = q.filter(~Q(tags__in=absent))
             case param.Category(allowed=allowed, not_allowed=not_allowed):
@@ -373,6 +485,8 @@ def query_pages(article: Article, params: dict[str, str], viewer=None, path_para
                 if column not in allowed_sort_columns:
                     column = 'created_at'
                     direction = 'desc'
+                if column == 'created_by':
+                    needs_distinct = True
                 # asc/desc is a function call on DB val, e.g. F('popularity').asc(), so we use getattr here
                 q = q.order_by(getattr(allowed_sort_columns[column], direction)())
             case param.Offset(offset=offset):
@@ -383,12 +497,21 @@ def query_pages(article: Article, params: dict[str, str], viewer=None, path_para
                 requested_page = page
                 requested_per_page = min(per_page, 250)
 
+    if needs_distinct:
+        q = q.distinct()
+
+    # subqueries for page variables are only needed for the rows that are returned, and not for the count
+    annotated_q = annotate_page_vars(q, page_vars) if page_vars else q
+
     if requested_limit is not None:
         q = q[requested_offset:requested_offset + requested_limit]
+        annotated_q = annotated_q[requested_offset:requested_offset + requested_limit]
     else:
         q = q[requested_offset:]
+        annotated_q = annotated_q[requested_offset:]
 
     total_pages = q.count()
+    q = annotated_q
 
     if allow_pagination:
         q = q[(requested_page - 1) * requested_per_page:requested_page * requested_per_page]
@@ -416,58 +539,27 @@ def render_pagination(base_path, pagination_page, pagination_total_pages):
             right_from = max(left_to + 1, pagination_total_pages - (around_pages + 1))
         center_from = max(left_to + 1, pagination_page - around_pages)
         center_to = min(right_from - 1, pagination_page + around_pages)
-        return render_template_from_string(
-            """
-            <div class="pager">
-                <span class="pager-no">страница&nbsp;{{page}}&nbsp;из&nbsp;{{total_pages}}</span>
-                {% if show_prev_page %}
-                    <span class="target"><a href="{%if base_path%}{{base_path}}/p/{{prev_page}}{% else %}#{%endif%}" data-pagination-target="{{prev_page}}">&laquo;&nbsp;предыдущая</a></span>
-                {% endif %}
-                {% for p in left_pages %}
-                    {% if page == p %}
-                        <span class="1 target current">{{p}}</span>
-                    {% else %}
-                        <span class="1 target"><a href="{%if base_path%}{{base_path}}/p/{{p}}{% else %}#{%endif%}" data-pagination-target="{{p}}">{{p}}</a></span>
-                    {% endif %}
-                {% endfor %}
-                {% if show_left_dots %}
-                    <span class="dots">...</span>
-                {% endif %}
-                {% for p in center_pages %}
-                    {% if page == p %}
-                        <span class="2 target current">{{p}}</span>
-                    {% else %}
-                        <span class="2 target"><a href="{%if base_path%}{{base_path}}/p/{{p}}{% else %}#{%endif%}" data-pagination-target="{{p}}">{{p}}</a></span>
-                    {% endif %}
-                {% endfor %}
-                {% if show_right_dots %}
-                    <span class="dots">...</span>
-                {% endif %}
-                {% for p in right_pages %}
-                    {% if page == p %}
-                        <span class="3 target current">{{p}}</span>
-                    {% else %}
-                        <span class="3 target"><a href="{%if base_path%}{{base_path}}/p/{{p}}{% else %}#{%endif%}" data-pagination-target="{{p}}">{{p}}</a></span>
-                    {% endif %}
-                {% endfor %}
-                {% if show_next_page %}
-                    <span class="target"><a href="{%if base_path%}{{base_path}}/p/{{next_page}}{% else %}#{%endif%}" data-pagination-target="{{next_page}}">следующая&nbsp;&raquo;</a></span>
-                {% endif %}
-            </div>
-            """,
-            left_pages=range(left_from, left_to+1),
-            center_pages=range(center_from, center_to+1),
-            right_pages=range(right_from, right_to+1),
-            show_left_dots=(center_from > left_to + 1),
-            show_right_dots=(center_to < right_from - 1),
-            show_prev_page=pagination_page > 1,
-            prev_page=pagination_page-1,
-            show_next_page=pagination_page < pagination_total_pages,
-            next_page=pagination_page+1,
-            base_path=base_path,
-            page=pagination_page,
-            total_pages=pagination_total_pages
-        )
+        def page_link(p, text):
+            href = '%s/p/%d' % (escape(base_path), p) if base_path else '#'
+            return '<a href="%s" data-pagination-target="%d">%s</a>' % (href, p, text)
+
+        def page_range(cls, pages_from, pages_to):
+            return ['<span class="%d target current">%d</span>' % (cls, p) if p == pagination_page else '<span class="%d target">%s</span>' % (cls, page_link(p, p)) for p in range(pages_from, pages_to+1)]
+
+        # built directly instead of with a template, since this is rendered by every paginated module
+        parts = ['<span class="pager-no">страница&nbsp;%d&nbsp;из&nbsp;%d</span>' % (pagination_page, pagination_total_pages)]
+        if pagination_page > 1:
+            parts.append('<span class="target">%s</span>' % page_link(pagination_page-1, '&laquo;&nbsp;предыдущая'))
+        parts += page_range(1, left_from, left_to)
+        if center_from > left_to + 1:
+            parts.append('<span class="dots">...</span>')
+        parts += page_range(2, center_from, center_to)
+        if center_to < right_from - 1:
+            parts.append('<span class="dots">...</span>')
+        parts += page_range(3, right_from, right_to)
+        if pagination_page < pagination_total_pages:
+            parts.append('<span class="target">%s</span>' % page_link(pagination_page+1, 'следующая&nbsp;&raquo;'))
+        return SafeString('<div class="pager"> %s </div>' % ' '.join(parts))
     return ''
 
 
@@ -499,11 +591,12 @@ def render(context: RenderContext, params, content=None):
                 if selection.group("foot"):
                     append = selection.group("foot")
 
-        pages, page_index, pagination_page, pagination_total_pages, total_pages = query_pages(context.article, params, context.user, context.path_params)
+        pages, page_index, pagination_page, pagination_total_pages, total_pages = query_pages(context.article, params, context.user, context.path_params, page_vars=get_template_page_vars(content))
 
         pages = list(pages)
         if get_boolean_param(params, 'reverse', False):
-            pages = reversed(pages)
+            pages = list(reversed(pages))
+        batch = PageVarsBatch(pages, _get_current_user())
 
         output = SafeString()
         common_context = context.clone_with(source_article=context.article)
@@ -513,7 +606,7 @@ def render(context: RenderContext, params, content=None):
                 output += renderer.single_pass_render(prepend+'\n', common_context)
             for page in pages:
                 page_index += 1
-                page_content = page_to_listpages_vars(page, content, page_index, total_pages)
+                page_content = page_to_listpages_vars(page, content, page_index, total_pages, page_vars=get_page_vars(page, batch))
                 cc = common_context.clone_with(article=page, source_article=page)
                 output += renderer.single_pass_render(page_content+'\n', cc)
                 common_context.merge(cc)
@@ -525,7 +618,7 @@ def render(context: RenderContext, params, content=None):
                 source += prepend+'\n'
             for page in pages:
                 page_index += 1
-                page_content = page_to_listpages_vars(page, content, page_index, total_pages)
+                page_content = page_to_listpages_vars(page, content, page_index, total_pages, page_vars=get_page_vars(page, batch))
                 source += page_content+'\n'
             source += append
             output += renderer.single_pass_render(source, common_context)
@@ -2,6 +2,10 @@ def has_content():
     return True
 
 
+def is_cacheable(_context, _params):
+    return True
+
+
 def render(context, _params, content=''):
     content = content.replace('\u00a0', ' ').replace('<', '\\u003c')
     if content:
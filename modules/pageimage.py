@@ -5,6 +5,10 @@ def has_content():
     return False
 
 
+def is_cacheable(_context, _params):
+    return True
+
+
 def render(context, _params):
     if 'src' in _params:
         context.og_image = get_resource(_params['src'], context, True)
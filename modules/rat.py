@@ -1,5 +1,10 @@
 from renderer.utils import render_template_from_string
 
+
+def is_cacheable(_context, _params):
+    return True
+
+
 def render(context, params):
     rat = 'vertical-rat.gif' if params.get('direction') == 'vertical' else 'horizontal-rat.gif'
     return render_template_from_string(
@@ -15,6 +15,13 @@ def allow_api():
     return True
 
 
+# Cached renders are invalidated on vote. Stars mode shows whether the current user has voted.
+def is_cacheable(context, _params):
+    if _params.get('page') or not context.article:
+        return False
+    return context.article.settings.rating_mode != Settings.RatingMode.Stars or not context.user or context.user.is_anonymous
+
+
 def render(context, _params):
     pageid = _params.get('page')
     if pageid:
@@ -1,6 +1,10 @@
 from renderer.utils import validate_url, get_boolean_param
 
 
+def is_cacheable(_context, _params):
+    return True
+
+
 def render(context, params):
     params = {**(context.path_params if context else {}), **params}
     if get_boolean_param(params, 'noredirect'):
@@ -2,6 +2,8 @@ import re
 from typing import Optional
 import logging
 
+from django.conf import settings
+from django.db.models import Q
 from django.utils.safestring import SafeString
 
 import modules
@@ -10,7 +12,7 @@ from web import threadvars
 from web.models.articles import ArticleVersion, Article
 from web.models.site import get_current_site
 from web.util.lazy_dict import LazyDict
-from . import expression, html
+from . import expression, html, cache, executor
 from .parser import RenderContext
 from .utils import render_user_to_html, render_template_from_string, render_external_user_to_html
 
@@ -20,6 +22,7 @@ from renderer.templates import apply_template
 # FTML is not imported globally to prevent loading DLL for commands that don't require it
 
 MAX_INCLUDE_LEVEL = 25
+EXCERPT_LENGTH = 384
 
 
 def callbacks_with_context(context):
@@ -30,14 +33,32 @@ def callbacks_with_context(context):
             super().__init__()
             self.context = context
 
+        # Called before doing any work that may take long; see renderer.executor
+        def _out_of_time(self) -> bool:
+            if not executor.time_exceeded():
+                return False
+            if self.context:
+                self.context.cacheable = False
+                self.context.status = 503
+            return True
+
         def module_has_body(self, module_name: str) -> bool:
             return modules.module_has_content(module_name.lower())
 
         def render_module(self, module_name: str, params: dict[str, str], body: str) -> str:
             params_for_module = {key.lower(): value for (key, value) in params.items()}
+            if self._out_of_time():
+                return render_template_from_string('<div class="error-block"><p>{{error}}</p></div>', error=executor.RenderTimeoutError.message)
             try:
-                return modules.render_module(module_name, self.context, params_for_module, content=body)
+                result = modules.render_module(module_name, self.context, params_for_module, content=body)
+                if self.context:
+                    if not modules.module_is_cacheable(module_name, self.context, params_for_module):
+                        self.context.cacheable = False
+                    self.context.cache_vary.update(('article', 'path_params'))
+                return result
             except modules.ModuleError as e:
+                if self.context:
+                    self.context.cacheable = False
                 return render_template_from_string('<div class="error-block"><p>{{error}}</p></div>', error=e.message)
 
         def render_user(self, username: str, avatar: bool) -> str:
@@ -56,6 +77,49 @@ def callbacks_with_context(context):
                     username=username
                 )
 
+        def fetch_users(self, user_refs: list[ftml.UserRef]) -> list[ftml.FetchedUser]: # type: ignore
+            usernames = set()
+            wikidot_usernames = set()
+            for ref in user_refs:
+                if ref.name.lower().startswith('external:'):
+                    continue
+                if ref.name.lower().startswith('wd:'):
+                    wikidot_usernames.add(ref.name[3:])
+                else:
+                    usernames.add(ref.name)
+
+            users = {}
+            wikidot_users = {}
+            if usernames or wikidot_usernames:
+                # roles are prefetched so that name tails of all users come from a single query
+                found = User.objects\
+                    .filter(Q(username__in=usernames) | Q(type=User.UserType.Wikidot, wikidot_username__in=wikidot_usernames))\
+                    .prefetch_related('roles')
+                for user in found:
+                    if user.username in usernames:
+                        users[user.username] = user
+                    if user.type == User.UserType.Wikidot and user.wikidot_username in wikidot_usernames:
+                        wikidot_users[user.wikidot_username] = user
+
+            result = []
+            for ref in user_refs:
+                if ref.name.lower().startswith('external:'):
+                    html = render_external_user_to_html(ref.name[len('external:'):], avatar=ref.show_avatar)
+                else:
+                    if ref.name.lower().startswith('wd:'):
+                        user = wikidot_users.get(ref.name[3:])
+                    else:
+                        user = users.get(ref.name)
+                    if user is None:
+                        html = render_template_from_string(
+                            '<span class="error-inline">Пользователь \'{{username}}\' не существует</span>',
+                            username=ref.name
+                        )
+                    else:
+                        html = render_user_to_html(user, avatar=ref.show_avatar)
+                result.append(ftml.FetchedUser(name=ref.name, show_avatar=ref.show_avatar, html=html))
+            return result
+
         def get_i18n_message(self, message_id: str) -> str:
             messages = {
                 "button-copy-clipboard": "Скопировать",
@@ -94,6 +158,10 @@ def callbacks_with_context(context):
             if not self.context:
                 return []
 
+            if self._out_of_time():
+                content = '[[div class="error-block"]]%s[[/div]]' % executor.RenderTimeoutError.message
+                return [ftml.FetchedPage(full_name=x.full_name, content=content) for x in include_refs]
+
             from web.controllers import articles
 
             page_vars = get_page_vars(self.context.article)
@@ -108,6 +176,7 @@ def callbacks_with_context(context):
                 .distinct('article__id')
             included_map = {}
             for item in included:
+                cache.inspect_source(self.context, item.source, is_included=True)
                 included_map[item.article.complete_full_name] = apply_template(item.source, lambda param: get_this_page_params(page_vars, param))
             result = []
             new_includes = []
@@ -197,6 +266,18 @@ def _format_error(context: RenderContext, mode) -> str:
     return f"Ошибка отображения страницы '{context.article.full_name}'"
 
 
+# Render that didn't finish in time or didn't get to run at all: the page is still served, with an error
+# instead of the content, and with a status that tells it's temporary
+def _render_executor_error(context: RenderContext, mode, e: 'executor.RenderError') -> str:
+    logging.warning('%s: %s', _format_internal_error(context, mode), type(e).__name__)
+    if context is not None:
+        context.status = 503
+    return render_template_from_string(
+        '<div class="error-block"><p>{{error}}</p></div>',
+        error=e.message
+    )
+
+
 def _format_internal_error(context: RenderContext, mode) -> str:
     if mode == 'system':
         action = 'process'
@@ -207,17 +288,24 @@ def _format_internal_error(context: RenderContext, mode) -> str:
     return f"Failed to {action} page '{context.article.full_name}'"
 
 
-def single_pass_render(source, context: RenderContext, mode='article') -> str:
+# cache_deps has the same meaning as in single_pass_render_with_excerpt
+def single_pass_render(source, context: RenderContext, mode='article', cache_deps: Optional[list[str]]=None) -> str:
     try:
         from ftml import ftml
 
         with threadvars.context():
             page_vars = get_page_vars(context.article) if context else {}
             source = apply_template(source, lambda param: get_this_page_params(page_vars, param))
-            html = ftml.render_html(source, callbacks_with_context(context), page_info_from_context(context), mode)
-            return SafeString(html.body)
+
+            def render():
+                callbacks = callbacks_with_context(context)
+                return executor.run(lambda: ftml.render_html(source, callbacks, page_info_from_context(context), mode, settings.FTML_RELEASE_GIL).body)
+
+            return SafeString(cache.render_with_cache(source, context, mode, cache_deps, render))
     except (GeneratorExit, KeyboardInterrupt, SystemExit):
         raise
+    except executor.RenderError as e:
+        return _render_executor_error(context, mode, e)
     except BaseException as e:
         logging.error(_format_internal_error(context, mode), exc_info=True)
         return render_template_from_string(
@@ -226,26 +314,30 @@ def single_pass_render(source, context: RenderContext, mode='article') -> str:
         )
 
 
-def single_pass_render_with_excerpt(source, context: RenderContext, mode='article') -> tuple[str, str, Optional[str]]:
+# cache_deps is a list of page names whose changes should invalidate the cached result.
+# If it's not specified, the result is not cached.
+def single_pass_render_with_excerpt(source, context: RenderContext, mode='article', cache_deps: Optional[list[str]]=None) -> tuple[str, str, Optional[str]]:
     try:
         from ftml import ftml
 
         page_vars = get_page_vars(context.article)
         source = apply_template(source, lambda param: get_this_page_params(page_vars, param))
 
-        with threadvars.context():
-            html = ftml.render_html(source, callbacks_with_context(context), page_info_from_context(context), mode)
-        with threadvars.context():
-            text = ftml.render_text(source, callbacks_with_context(context), page_info_from_context(context), mode).body
+        def render_in_executor():
+            # HTML and text are rendered from the same parse, so includes are only fetched once
+            with threadvars.context():
+                return ftml.render_html_and_text(source, callbacks_with_context(context), page_info_from_context(context), mode, EXCERPT_LENGTH, settings.FTML_RELEASE_GIL)
 
-        text = '\n'.join([x.strip() for x in text.split('\n')])
-        text = re.sub(r'\n+', '\n', text)
-        if len(text) > 384:
-            text = text[:384] + '...'
+        def render():
+            result = executor.run(render_in_executor)
+            return result.body, result.excerpt
 
-        return SafeString(html.body), text, None
+        body, text = cache.render_with_cache(source, context, mode, cache_deps, render)
+        return SafeString(body), text, None
     except (GeneratorExit, KeyboardInterrupt, SystemExit):
         raise
+    except executor.RenderError as e:
+        return _render_executor_error(context, mode, e), '', None
     except BaseException as e:
         logging.error(_format_internal_error(context, mode), exc_info=True)
         html = render_template_from_string(
@@ -261,7 +353,7 @@ def single_pass_render_text(source, context: RenderContext, mode='article') -> s
         page_vars = get_page_vars(context.article)
         source = apply_template(source, lambda param: get_this_page_params(page_vars, param))
 
-        text = ftml.render_text(source, callbacks_with_context(context), page_info_from_context(context), mode).body
+        text = ftml.render_text(source, callbacks_with_context(context), page_info_from_context(context), mode, settings.FTML_RELEASE_GIL).body
 
         text = '\n'.join([x.strip() for x in text.split('\n')])
         text = re.sub(r'\n+', '\n', text)
@@ -277,7 +369,7 @@ def single_pass_fetch_backlinks(source, context: RenderContext, mode='system') -
     try:
         from ftml import ftml
 
-        text = ftml.collect_backlinks(source, callbacks_with_context(context), page_info_from_context(context), mode)
+        text = ftml.collect_backlinks(source, callbacks_with_context(context), page_info_from_context(context), mode, settings.FTML_RELEASE_GIL)
         return text.included_pages, text.linked_pages
     except (GeneratorExit, KeyboardInterrupt, SystemExit):
         raise
@@ -292,10 +384,10 @@ def single_pass_fetch_code_and_html(source, context: RenderContext, mode='system
 
         with threadvars.context():
             if not includes:
-                res = ftml.collect_code_and_html(source, callbacks_with_context(context), page_info_from_context(context), mode)
+                res = ftml.collect_code_and_html(source, callbacks_with_context(context), page_info_from_context(context), mode, settings.FTML_RELEASE_GIL)
                 return res.code, res.html
             else:
-                res = ftml.render_text(source, callbacks_with_context(context), page_info_from_context(context), mode)
+                res = ftml.render_text(source, callbacks_with_context(context), page_info_from_context(context), mode, settings.FTML_RELEASE_GIL)
                 return res.code, res.html
     except (GeneratorExit, KeyboardInterrupt, SystemExit):
         raise
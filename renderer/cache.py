@@ -0,0 +1,211 @@
+# Persistent cache of rendered HTML.
+#
+# Entries are keyed by the final source (after all template substitutions), the render mode, the page the
+# source belongs to, the permission class of the viewer, and a "generation" token for every page the result
+# depends on. Generations are bumped when a page (or anything it includes) changes, which makes all entries
+# that depend on it unreachable without having to enumerate them.
+#
+# Some renders depend on things that are only known after rendering (modules that look at the current page
+# or path params, iftags inside included pages). In this case the entry under the base key only describes
+# what the result varies on, and the actual result is stored under a secondary key, similar to HTTP Vary.
+#
+# Renders read from wherever the request reads, which is a replica for anonymous page views. A replica may lag
+# behind, and a stale result stored under a fresh generation would be served until the next change. So with a
+# replica every generation carries the primary's WAL position at the time it was made, and a result is only
+# stored if the database it was rendered from has replayed up to all of its generations.
+import hashlib
+import json
+import logging
+import re
+import uuid
+from typing import Callable, Iterable, Optional, Sequence
+
+from django.conf import settings
+from django.core.cache import caches
+
+from web import read_only
+from web.models.site import get_current_site
+from web.permissions.backends import get_permissions_fingerprint
+from .parser import RenderContext
+
+
+GLOBAL_GENERATION = '*'
+
+_RESTORED_FIELDS = ['title', 'status', 'redirect_to', 'add_css', 'computed_style', 'og_description', 'og_image']
+
+_IFTAGS_RE = re.compile(r'\[\[\s*iftags', re.IGNORECASE)
+_THIS_VAR_RE = re.compile(r'%%this\|', re.IGNORECASE)
+
+
+def is_enabled() -> bool:
+    return settings.RENDER_CACHE_ENABLED
+
+
+def get_cache():
+    return caches['render']
+
+
+def normalize_dependency_name(full_name: str) -> str:
+    full_name = full_name.lower()
+    if full_name.startswith('_default:'):
+        return full_name[len('_default:'):]
+    return full_name
+
+
+def _generation_key(full_name: str) -> str:
+    return 'render-gen:%s' % hashlib.sha1(normalize_dependency_name(full_name).encode('utf-8')).hexdigest()
+
+
+def _new_generation() -> str:
+    try:
+        position = read_only.get_primary_position()
+    except Exception:
+        logging.warning('Failed to read the primary database position, cache may get renders from a lagging replica', exc_info=True)
+        position = None
+    if position is None:
+        return uuid.uuid4().hex
+    return '%s@%s' % (uuid.uuid4().hex, position)
+
+
+def _get_positions(generations: Iterable[str]) -> list[str]:
+    return [x.partition('@')[2] for x in generations if '@' in x]
+
+
+def get_generations(full_names: Sequence[str]) -> list[str]:
+    cache = get_cache()
+    keys = [_generation_key(x) for x in full_names]
+    found = cache.get_many(keys)
+    result = []
+    for key in keys:
+        generation = found.get(key)
+        if generation is None:
+            # generation that was never set or got evicted must not fall back to a value that may match old entries
+            cache.add(key, _new_generation(), None)
+            generation = cache.get(key) or _new_generation()
+        result.append(generation)
+    return result
+
+
+def invalidate(full_names: Iterable[str]):
+    if not is_enabled():
+        return
+    full_names = list(full_names)
+    if not full_names:
+        return
+    generation = _new_generation()
+    new_generations = {_generation_key(x): generation for x in full_names}
+    if new_generations:
+        get_cache().set_many(new_generations, None)
+
+
+def invalidate_all():
+    invalidate([GLOBAL_GENERATION])
+
+
+# Called for every piece of source that takes part in the render (including pages pulled by [[include]]),
+# so that the context knows what the result depends on.
+def inspect_source(context: Optional[RenderContext], source: str, is_included: bool = False):
+    if context is None or not source:
+        return
+    if _IFTAGS_RE.search(source):
+        context.cache_vary.add('tags')
+    # included pages get this| variables of the page that includes them, which are not a part of the key
+    if is_included and _THIS_VAR_RE.search(source):
+        context.cacheable = False
+
+
+def _get_vary_value(context: RenderContext, vary: str):
+    if vary == 'tags':
+        if not context.article:
+            return []
+        return sorted(tag.full_name for tag in context.article.tags.all())
+    if vary == 'path_params':
+        return sorted((k, v) for k, v in context.path_params.items())
+    if vary == 'article':
+        if not context.article:
+            return None
+        return [context.article.pk, get_generations([context.article.full_name])[0]]
+    raise ValueError('Unknown cache vary: %s' % vary)
+
+
+def _make_key(*parts) -> str:
+    return 'render:%s' % hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def _make_base_key(source: str, context: RenderContext, mode: str, generations: Sequence[str]) -> str:
+    site = get_current_site(required=False)
+    source_article = context.source_article
+    return _make_key(
+        'v1',
+        mode,
+        site.slug if site else None,
+        source_article.full_name if source_article else None,
+        get_permissions_fingerprint(context.user),
+        generations,
+        hashlib.sha256(source.encode('utf-8')).hexdigest()
+    )
+
+
+def _make_vary_key(base_key: str, context: RenderContext, vary: Sequence[str]) -> str:
+    return _make_key(base_key, [[v, _get_vary_value(context, v)] for v in vary])
+
+
+def _snapshot_context(context: RenderContext) -> dict:
+    return {field: getattr(context, field) for field in _RESTORED_FIELDS}
+
+
+def _restore_context(context: RenderContext, entry: dict):
+    for field, value in entry['context'].items():
+        setattr(context, field, value)
+
+
+# Returns render result from cache, or calls render() and stores the result if the render can be cached.
+# render() is expected to raise on failure; errors are never cached.
+def render_with_cache(source: str, context: Optional[RenderContext], mode: str, dependencies: Optional[Sequence[str]], render: Callable[[], any]):
+    if not is_enabled() or context is None or not dependencies:
+        return render()
+
+    cache = get_cache()
+
+    try:
+        generations = get_generations([GLOBAL_GENERATION] + list(dependencies))
+        base_key = _make_base_key(source, context, mode, generations)
+        entry = cache.get(base_key)
+        if entry is not None and 'vary' in entry:
+            entry = cache.get(_make_vary_key(base_key, context, entry['vary']))
+        if entry is not None:
+            _restore_context(context, entry)
+            return entry['result']
+    except Exception:
+        logging.warning('Failed to read render cache', exc_info=True)
+        return render()
+
+    context.cacheable = True
+    context.cache_vary = set()
+    inspect_source(context, source)
+    # only what the render has changed is stored, the rest depends on the context it was called with
+    initial_state = _snapshot_context(context)
+
+    result = render()
+
+    if not context.cacheable:
+        return result
+
+    try:
+        if not read_only.has_replayed(read_only.get_read_database(), _get_positions(generations)):
+            return result
+        entry = {
+            'result': result,
+            'context': {field: value for field, value in _snapshot_context(context).items() if value != initial_state[field]}
+        }
+        timeout = settings.RENDER_CACHE_TIMEOUT
+        if context.cache_vary:
+            vary = sorted(context.cache_vary)
+            cache.set(base_key, {'vary': vary}, timeout)
+            cache.set(_make_vary_key(base_key, context, vary), entry, timeout)
+        else:
+            cache.set(base_key, entry, timeout)
+    except Exception:
+        logging.warning('Failed to write render cache', exc_info=True)
+
+    return result
@@ -0,0 +1,144 @@
+# Time budget and optional worker pool for page renders.
+#
+# Every top-level render gets a deadline. A render can't be interrupted from the outside once FTML is running,
+# so the budget is cooperative: after the deadline the callbacks stop fetching includes and running modules,
+# which is what makes pathological pages (deep include chains, huge ListPages) slow in the first place.
+#
+# With RENDER_EXECUTOR=threads renders also run in a pool instead of the request thread. This needs
+# FTML_RELEASE_GIL (enforced in settings): otherwise a render holds the GIL for as long as FTML runs and the
+# pool only adds overhead. The request waits for its render only until the deadline and gets an error
+# block after that, and renders that don't fit into the bounded queue are rejected right away, so a single bad
+# page can't take all web workers with it.
+#
+# A thread can't be killed, so a render that ran out of time keeps its worker and its slot until FTML returns.
+# With the callbacks refusing to do anything past the deadline, what is left is FTML's own work on the text
+# fetched so far, which doesn't call into Python and runs without the GIL. Such renders are logged with
+# their overrun when they finish, so pages that hold the pool past their budget can be found.
+#
+# Workers use their own database connections, outside of the request's transaction, and can't see what the
+# request has written but not committed yet. Renders started inside a transaction (any request that doesn't
+# opt out of ATOMIC_REQUESTS) therefore run inline in the request thread.
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from web import read_only, threadvars
+
+
+_DEADLINE_KEY = 'render_deadline'
+
+
+class RenderError(Exception):
+    message = 'Ошибка отображения страницы'
+
+
+class RenderTimeoutError(RenderError):
+    message = 'Превышено время отображения страницы'
+
+
+class RenderOverloadedError(RenderError):
+    message = 'Сервер перегружен, попробуйте обновить страницу позже'
+
+
+class Deadline(object):
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+        self.cancelled = False
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def exceeded(self) -> bool:
+        return self.cancelled or time.monotonic() >= self.expires_at
+
+    def overrun(self) -> float:
+        return max(0.0, time.monotonic() - self.expires_at)
+
+
+def is_pool_enabled() -> bool:
+    return settings.RENDER_EXECUTOR == 'threads'
+
+
+def get_deadline() -> Optional[Deadline]:
+    return threadvars.get(_DEADLINE_KEY)
+
+
+# Whether the render running in this thread is out of time and should not do any more work
+def time_exceeded() -> bool:
+    deadline = get_deadline()
+    return deadline is not None and deadline.exceeded()
+
+
+class RenderExecutor(object):
+    def __init__(self, workers: int, queue_size: int):
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+        # renders that are running plus renders waiting for a worker
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def run(self, func: Callable[[], any], deadline: Deadline):
+        if not self._slots.acquire(blocking=False):
+            raise RenderOverloadedError()
+        try:
+            future = self._pool.submit(self._run_in_worker, func, threadvars.snapshot(), deadline)
+        except BaseException:
+            self._slots.release()
+            raise
+        # also called for renders cancelled before they started
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=deadline.remaining())
+        except concurrent.futures.TimeoutError:
+            deadline.cancelled = True
+            future.cancel()
+            raise RenderTimeoutError()
+
+    @staticmethod
+    def _run_in_worker(func: Callable[[], any], values: dict, deadline: Deadline):
+        try:
+            with threadvars.context():
+                for k, v in values.items():
+                    threadvars.put(k, v)
+                threadvars.put(_DEADLINE_KEY, deadline)
+                # the request's write guard is installed on its own connections, this thread has others
+                with read_only.guard_writes():
+                    if deadline.exceeded():
+                        raise RenderTimeoutError()
+                    return func()
+        finally:
+            if deadline.cancelled:
+                logging.warning('Render finished %.1fs after its deadline, the worker was busy all this time', deadline.overrun())
+            # worker threads are not a part of any request, so nothing else closes their connections
+            close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> RenderExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = RenderExecutor(settings.RENDER_WORKERS, settings.RENDER_QUEUE_SIZE)
+    return _executor
+
+
+# Runs a top-level render with a time budget, in the pool if it's enabled.
+# Raises RenderTimeoutError or RenderOverloadedError if the result can't be obtained in time.
+def run(func: Callable[[], any]):
+    # renders started from inside another render (modules, includes) share its budget and its thread
+    if get_deadline() is not None:
+        return func()
+    deadline = Deadline(settings.RENDER_TIMEOUT)
+    # the request's uncommitted writes are only visible on its own connection
+    if is_pool_enabled() and not connection.in_atomic_block:
+        return _get_executor().run(func, deadline)
+    with threadvars.context():
+        threadvars.put(_DEADLINE_KEY, deadline)
+        return func()
@@ -18,6 +18,9 @@ class RenderContext(object):
         self.computed_style = ''
         self.og_description = None
         self.og_image = None
+        # these are maintained by the render cache: whether the result can be reused and what it depends on
+        self.cacheable = True
+        self.cache_vary = set()
 
     def clone_with(self, **kwargs):
         article = kwargs.get('article', self.article)
@@ -36,3 +39,5 @@ class RenderContext(object):
         self.redirect_to = other_rc.redirect_to
         self.computed_style += other_rc.computed_style
         self.title = other_rc.title
+        self.cacheable = self.cacheable and other_rc.cacheable
+        self.cache_vary |= other_rc.cache_vary
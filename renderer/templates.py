@@ -1,7 +1,45 @@
+from functools import lru_cache
 from typing import Callable
 import re
 
 
+_VARIABLE_RE = re.compile(r'%%(.*?)%%')
+
+# ListPages rows, includes and _template pages are applied over and over; whole article sources are not worth keeping
+_MAX_CACHED_TEMPLATE_LENGTH = 16384
+
+
+class CompiledTemplate:
+    # Source split into segments once: even indexes are literal text, odd indexes are variable names.
+    def __init__(self, source: str):
+        self.segments = _VARIABLE_RE.split(source)
+
+    @property
+    def variables(self) -> set[str]:
+        return set(self.segments[1::2])
+
+    def render(self, resolver: Callable[[str], str | None]) -> str:
+        if len(self.segments) == 1:
+            return self.segments[0]
+        result = self.segments[:]
+        for i in range(1, len(result), 2):
+            name = result[i]
+            value = resolver(name)
+            result[i] = '%%' + name + '%%' if value is None else value
+        return ''.join(result)
+
+
+@lru_cache(maxsize=1024)
+def _compile_template_cached(template: str) -> CompiledTemplate:
+    return CompiledTemplate(template)
+
+
+def compile_template(template: str) -> CompiledTemplate:
+    if len(template) > _MAX_CACHED_TEMPLATE_LENGTH:
+        return CompiledTemplate(template)
+    return _compile_template_cached(template)
+
+
 def apply_template(template: str, vars_or_resolver: dict | Callable[[str], str | None]):
     if not callable(vars_or_resolver):
         lower_vars = {k.lower(): v for (k, v) in vars_or_resolver.items()}
@@ -12,10 +50,4 @@ def apply_template(template: str, vars_or_resolver: dict | Callable[[str], str |
     else:
         resolver = vars_or_resolver
 
-    def call_resolver(var) -> str:
-        r = resolver(var[2])
-        if r is None:
-            return '%%' + var[2] + '%%'
-        return r
-
-    return re.sub(r'(%%(.*?)%%)', lambda var: call_resolver(var), template)
+    return compile_template(template).render(resolver)
@@ -1,4 +1,3 @@
-import threading
 import urllib.parse
 
 from enum import Enum
@@ -7,6 +6,7 @@ from typing import Literal, Optional, Union
 from django.contrib.auth.models import AnonymousUser
 from django.conf import settings
 from django.template import Context, Template
+from django.utils.html import conditional_escape, escape
 from django.utils.safestring import SafeString
 
 from web.models.articles import Vote
@@ -19,17 +19,20 @@ from web.util.pydantic import JSONInterface
 from web.types import _UserType
 
 
-_templates = dict()
-_templates_lock = threading.RLock()
+_templates: dict[str, Template] = dict()
+
+
+def get_compiled_template(template: str) -> Template:
+    # dict operations are atomic, so no lock is needed. If two threads compile the same template at once,
+    # both results are equivalent and the first one stored wins.
+    tpl = _templates.get(template)
+    if tpl is None:
+        tpl = _templates.setdefault(template, Template(template.strip()))
+    return tpl
 
 
 def render_template_from_string(template: str, **context: object) -> SafeString:
-    with _templates_lock:
-        if template in _templates:
-            tpl = _templates[template]
-        else:
-            tpl = _templates[template] = Template(template.strip())
-    return tpl.render(Context(context))
+    return get_compiled_template(template).render(Context(context))
 
 
 def format_ru_plural(number, one, few, many):
@@ -87,36 +90,42 @@ def render_user_to_text(user: _UserType):
     return user.username
 
 
+# printuser is rendered for every author, post and [[user]] block, so it is built directly instead of going through
+# Django templates. Whitespace between the parts matches what the templates used to produce.
+def _render_name_tails(tails) -> str:
+    parts = []
+    for icon in tails['icons']:
+        if icon.tooltip:
+            parts.append('<span class="icon printuser-role-tail" tabindex="0" data-tooltip="%s"><img src="data:image/svg+xml,%s"/></span>' % (escape(icon.tooltip), escape(icon.icon)))
+        else:
+            parts.append('<span class="icon"><img src="data:image/svg+xml,%s"/></span>' % escape(icon.icon))
+    for badge in tails['badges']:
+        style = 'background: %s; color: %s; ' % (badge.bg, badge.text_color)
+        if badge.show_border:
+            style += 'border: solid 1px %s' % badge.text_color
+        if badge.tooltip:
+            parts.append('<span class="badge printuser-role-tail" tabindex="0" data-tooltip="%s" style="%s">%s</span>' % (escape(badge.tooltip), style, badge.text))
+        else:
+            parts.append('<span class="badge" style="%s">%s</span>' % (style, badge.text))
+    return ' '.join(parts)
+
+
 def render_user_to_html(user: _UserType, avatar=True, hover=True, interactive=True, extra_tail='', show_tails=True):
     class_add = ' avatarhover' if hover and interactive else ''
     if user is None:
-        return render_template_from_string(
-            '<span class="printuser{{class_add}}"><strong>system</strong></span>',
-            class_add=class_add
-        )
+        return SafeString('<span class="printuser%s"><strong>system</strong></span>' % class_add)
     if isinstance(user, AnonymousUser):
-        return render_template_from_string(
-            """
-            <span class="printuser{{class_add}}">
-                {% if show_avatar %}
-                    {% if interactive %}
-                        <a onclick="return false;"><img class="small" src="{{avatar}}" alt="Anonymous User"></a>
-                    {% else %}
-                        <span class="printuser-avatar"><img class="small" src="{{avatar}}" alt="Anonymous User"></span>
-                    {% endif %}
-                {% endif %}
-                {% if interactive %}
-                    <a onclick="return false;">Anonymous User</a>
-                {% else %}
-                    <span class="printuser-name">Anonymous User</span>
-                {% endif %}
-            </span>
-            """,
-            class_add=class_add,
-            show_avatar=avatar,
-            avatar=settings.ANON_AVATAR,
-            interactive=interactive
-        )
+        parts = []
+        if avatar:
+            if interactive:
+                parts.append('<a onclick="return false;"><img class="small" src="%s" alt="Anonymous User"></a>' % escape(settings.ANON_AVATAR))
+            else:
+                parts.append('<span class="printuser-avatar"><img class="small" src="%s" alt="Anonymous User"></span>' % escape(settings.ANON_AVATAR))
+        if interactive:
+            parts.append('<a onclick="return false;">Anonymous User</a>')
+        else:
+            parts.append('<span class="printuser-name">Anonymous User</span>')
+        return SafeString('<span class="printuser%s"> %s </span>' % (class_add, ' '.join(parts)))
     if user.type == 'wikidot':
         user_avatar = settings.WIKIDOT_AVATAR
         displayname = 'wd:'+user.wikidot_username
@@ -124,62 +133,39 @@ def render_user_to_html(user: _UserType, avatar=True, hover=True, interactive=Tr
         user_avatar = user.get_avatar(default=settings.DEFAULT_AVATAR)
         displayname = user.username
 
-    return render_template_from_string(
-        """
-        <span class="printuser w-user{{class_add}}" data-user-id="{{user_id}}" data-user-name="{{username}}">
-            {% if show_avatar %}
-                {% if interactive %}
-                    <a href="/-/users/{{user_id}}-{{username}}"><img class="small" src="{{avatar}}" alt="{{displayname}}"></a>
-                {% else %}
-                    <span class="printuser-avatar"><img class="small" src="{{avatar}}" alt="{{displayname}}"></span>
-                {% endif %}
-            {% endif %}
-            {% if interactive %}
-                <a class="w-user-preview-trigger" href="/-/users/{{user_id}}-{{username}}" data-user-id="{{user_id}}" data-user-name="{{username}}" aria-haspopup="dialog">{{displayname}}</a>
-            {% else %}
-                <span class="printuser-name">{{displayname}}</span>
-            {% endif %}
-            {% if show_avatar and show_tails %}
-                {% for icon in tails.icons %}
-                    <span class="icon{% if icon.tooltip %} printuser-role-tail{% endif %}" {% if icon.tooltip %}tabindex="0" data-tooltip="{{icon.tooltip}}"{% endif %}><img src="data:image/svg+xml,{{icon.icon}}"/></span>
-                {% endfor %}
-                {% for badge in tails.badges %}
-                    <span class="badge{% if badge.tooltip %} printuser-role-tail{% endif %}" {% if badge.tooltip %}tabindex="0" data-tooltip="{{badge.tooltip}}"{% endif %} style="background: {{badge.bg|safe}}; color: {{badge.text_color|safe}}; {% if badge.show_border %}border: solid 1px {{badge.text_color|safe}}{% endif %}">{{badge.text|safe}}</span>
-                {% endfor %}
-            {% endif %}
-            {{ extra_tail }}
-        </span>
-        """,
-        class_add=class_add,
-        show_avatar=avatar,
-        show_tails=show_tails,
-        interactive=interactive,
-        tails=user.name_tails,
-        avatar=user_avatar,
-        user_id=user.pk,
-        username=user.username,
-        displayname=displayname,
-        extra_tail=extra_tail
-    )
+    user_id = escape(user.pk)
+    username = escape(user.username)
+    displayname = escape(displayname)
+
+    parts = []
+    if avatar:
+        if interactive:
+            parts.append('<a href="/-/users/%s-%s"><img class="small" src="%s" alt="%s"></a>' % (user_id, username, escape(user_avatar), displayname))
+        else:
+            parts.append('<span class="printuser-avatar"><img class="small" src="%s" alt="%s"></span>' % (escape(user_avatar), displayname))
+    if interactive:
+        parts.append('<a class="w-user-preview-trigger" href="/-/users/%s-%s" data-user-id="%s" data-user-name="%s" aria-haspopup="dialog">%s</a>' % (user_id, username, user_id, username, displayname))
+    else:
+        parts.append('<span class="printuser-name">%s</span>' % displayname)
+    if avatar and show_tails:
+        tails = _render_name_tails(user.name_tails)
+        if tails:
+            parts.append(tails)
+    if extra_tail:
+        parts.append(conditional_escape(extra_tail))
+
+    return SafeString('<span class="printuser w-user%s" data-user-id="%s" data-user-name="%s"> %s </span>' % (class_add, user_id, username, ' '.join(parts)))
 
 
 def render_external_user_to_html(username: str, avatar=True, hover=True):
-    displayname = username
-    username = articles.normalize_article_name(username)
-    return render_template_from_string(
-        """
-        <span class="printuser w-user{{class_add}}" data-user-id="{{user_id}}" data-user-name="{{username}}">
-            {% if show_avatar %}
-                <a href="https://www.wikidot.com/user:info/{{username}}" target="_blank"><img class="small" src="{{avatar}}" alt="{{displayname}}"></a>
-            {% endif %}
-            <a href="https://www.wikidot.com/user:info/{{username}}" target="_blank">{{displayname}}</a></span>
-        """,
-        class_add=(' avatarhover' if hover else ''),
-        show_avatar=avatar,
-        avatar=settings.WIKIDOT_AVATAR,
-        user_id=-1,
-        username=username,
-        displayname=displayname
+    displayname = escape(username)
+    username = escape(articles.normalize_article_name(username))
+    class_add = ' avatarhover' if hover else ''
+    avatar_html = ''
+    if avatar:
+        avatar_html = '<a href="https://www.wikidot.com/user:info/%s" target="_blank"><img class="small" src="%s" alt="%s"></a> ' % (username, escape(settings.WIKIDOT_AVATAR), displayname)
+    return SafeString(
+        '<span class="printuser w-user%s" data-user-id="-1" data-user-name="%s"> %s<a href="https://www.wikidot.com/user:info/%s" target="_blank">%s</a></span>' % (class_add, username, avatar_html, username, displayname)
     )
 
 
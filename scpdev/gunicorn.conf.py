@@ -0,0 +1,19 @@
+# Gunicorn settings, used by entrypoint.sh
+import os
+
+
+wsgi_app = 'scpdev.wsgi'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '32'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '300'))
+# application is loaded once in the main process, which also runs shared_data background threads
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Pools of the main process are copied into every worker, together with connections of its background threads.
+    # They must not be used (or closed) here, since that would go through sockets of the main process.
+    # _connection_pools is private to Django's postgresql backend (added with pool support in Django 5.1, checked
+    # against 5.2); check that it still exists when upgrading Django.
+    from django.db.backends.postgresql.base import DatabaseWrapper
+    DatabaseWrapper._connection_pools.clear()
@@ -14,6 +14,8 @@ from pathlib import Path
 import os
 import mimetypes
 
+from django.core.exceptions import ImproperlyConfigured
+
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -63,6 +65,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'web.middleware.ForwardedPortMiddleware',
     'web.middleware.DropWikidotAuthMiddleware',
+    # before everything that resolves sites, so that they share one lookup (see web/identity_map.py)
+    'web.middleware.IdentityMapMiddleware',
     'web.middleware.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'web.middleware.ExtendedAnonymousMiddleware',
@@ -98,6 +102,15 @@ WSGI_APPLICATION = 'scpdev.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# Connections are either kept open by every thread for DB_CONN_MAX_AGE seconds ('none' is forever, 0 closes them
+# after each request), or, with DB_POOL_MAX_SIZE > 0, taken from a pool of each process (requires psycopg 3 with
+# psycopg_pool, see requirements.txt). Persistent connections are checked before reuse, so restarts of the database
+# don't fail requests. The expected number of connections is logged on startup (web/util/connections.py).
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '0'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '10'))
+_DB_CONN_MAX_AGE = os.environ.get('DB_CONN_MAX_AGE', '60')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -106,10 +119,45 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PG_PASSWORD', 'zaq123'),
         'HOST': os.environ.get('DB_PG_HOST', 'localhost'),
         'PORT': os.environ.get('DB_PG_PORT', '5432'),
-        'ATOMIC_REQUESTS': True
+        'ATOMIC_REQUESTS': True,
+        'CONN_MAX_AGE': None if _DB_CONN_MAX_AGE == 'none' else int(_DB_CONN_MAX_AGE),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'true') == 'true',
+        'OPTIONS': {}
     }
 }
 
+if DB_POOL_MAX_SIZE > 0:
+    try:
+        from psycopg_pool import ConnectionPool
+    except ImportError:
+        raise ImproperlyConfigured('DB_POOL_MAX_SIZE requires psycopg 3 with the pool extra: pip install "psycopg[binary,pool]"')
+
+    # pooled connections are returned to the pool after each request instead of being kept by the thread
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+        'max_size': DB_POOL_MAX_SIZE,
+        'timeout': DB_POOL_TIMEOUT,
+        'check': ConnectionPool.check_connection if DATABASES['default']['CONN_HEALTH_CHECKS'] else None
+    }
+
+if os.environ.get('DB_PG_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get('DB_PG_REPLICA_HOST'),
+        'PORT': os.environ.get('DB_PG_REPLICA_PORT', DATABASES['default']['PORT']),
+        'ATOMIC_REQUESTS': False,
+        'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+        'TEST': {'MIRROR': 'default'}
+    }
+
+DATABASE_ROUTERS = ['web.read_only.ReadOnlyRouter']
+
+# Anonymous page views run without a transaction, reading from READ_ONLY_DATABASE (see web/read_only.py)
+READ_ONLY_FAST_PATH = os.environ.get('READ_ONLY_FAST_PATH', 'true') == 'true'
+READ_ONLY_DATABASE = 'replica' if 'replica' in DATABASES else 'default'
+READ_ONLY_WRITE_GUARD = os.environ.get('READ_ONLY_WRITE_GUARD', 'true' if DEBUG else 'false') == 'true'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -136,13 +184,57 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 
+# Rendered pages are kept in Redis, which evicts least recently used keys by itself as the cache fills up.
+# Old entries are never deleted (see renderer/cache.py), so a cache that enumerates its entries to cull them won't do.
+RENDER_CACHE_URL = os.environ.get('RENDER_CACHE_URL', '')
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake'
+    },
+    # rendered page HTML, shared between all workers
+    'render': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': RENDER_CACHE_URL,
+    } if RENDER_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    # small values that all workers must agree on, like versions of process-local caches
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SHARED_CACHE_DIR', str(BASE_DIR / 'cache' / 'shared'))
     }
 }
 
+# Snapshots of data shared by all workers, such as the article catalog (see shared_data/snapshot.py)
+SHARED_DATA_DIR = os.environ.get('SHARED_DATA_DIR', str(BASE_DIR / 'cache' / 'shared_data'))
+
+RENDER_CACHE_ENABLED = bool(RENDER_CACHE_URL) and os.environ.get('RENDER_CACHE_ENABLED', 'true') == 'true'
+RENDER_CACHE_TIMEOUT = int(os.environ.get('RENDER_CACHE_TIMEOUT', str(60 * 60 * 24)))
+
+# Where page renders run: 'inline' (in the request thread) or 'threads' (in a pool of RENDER_WORKERS threads,
+# with up to RENDER_QUEUE_SIZE renders waiting for a worker). Either way a render gets RENDER_TIMEOUT seconds,
+# after that it stops fetching includes and running modules, and the page is served with an error instead.
+RENDER_EXECUTOR = os.environ.get('RENDER_EXECUTOR', 'inline')
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', '4'))
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE', '16'))
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', '30'))
+
+# Release the GIL while FTML parses and renders, so that renders in other threads can run meanwhile.
+# Callbacks into Python take the GIL back for their duration (see ftml/src/python_interface.rs).
+# 'manage.py benchmark render' compares both modes; set to false to hold the GIL for the whole render.
+FTML_RELEASE_GIL = os.environ.get('FTML_RELEASE_GIL', 'true') == 'true'
+
+if RENDER_EXECUTOR not in ('inline', 'threads'):
+    raise ImproperlyConfigured('RENDER_EXECUTOR must be either inline or threads')
+# render threads can't run in parallel (and a timed out render blocks the others) while FTML holds the GIL
+if RENDER_EXECUTOR == 'threads' and not FTML_RELEASE_GIL:
+    raise ImproperlyConfigured('RENDER_EXECUTOR=threads requires FTML_RELEASE_GIL=true')
+
+# Update search index of edited articles in the searchworker command instead of the edit request
+SEARCH_INDEX_QUEUE = os.environ.get('SEARCH_INDEX_QUEUE', 'true') == 'true'
+
 
 MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 
@@ -195,6 +287,14 @@ def parse_size(size):
 
 ARTICLE_SOURCE_LIMIT = int(os.environ.get('ARTICLE_SOURCE_LIMIT', '200000'))
 
+# How new article versions are stored: 'full' keeps the text of every version, 'delta' keeps the text of the
+# latest version only and turns the previous one into a reverse delta against it. Every
+# ARTICLE_VERSION_KEYFRAME_INTERVAL-th version is kept whole (compressed) so that old versions don't need long chains.
+# Existing history can be converted with `manage.py compactversions`.
+ARTICLE_VERSION_STORAGE = os.environ.get('ARTICLE_VERSION_STORAGE', 'full')
+ARTICLE_VERSION_COMPRESSION = os.environ.get('ARTICLE_VERSION_COMPRESSION', 'zlib')
+ARTICLE_VERSION_KEYFRAME_INTERVAL = int(os.environ.get('ARTICLE_VERSION_KEYFRAME_INTERVAL', '20'))
+
 ABSOLUTE_MEDIA_UPLOAD_LIMIT = parse_size(os.environ.get('ABSOLUTE_MEDIA_UPLOAD_LIMIT', '0'))
 MEDIA_UPLOAD_LIMIT = parse_size(os.environ.get('MEDIA_UPLOAD_LIMIT', '0'))
 
@@ -53,4 +53,12 @@ media.update_all_symlinks_in_background()
 permissions.register_role_permissions()
 
 
+from django.db import connections
+from web.util.connections import log_connections_report
+
+log_connections_report()
+# workers are forked from this process, and must not inherit its connections
+connections.close_all()
+
+
 application = get_wsgi_application()
@@ -1,7 +1,6 @@
-import logging
-import multiprocessing
+import datetime
 import threading
-import time
+from typing import Iterable, Optional, Sequence
 
 from django.db.models import Subquery, OuterRef
 
@@ -12,25 +11,36 @@ from web.controllers import articles
 from web.models.articles import ArticleLogEntry, Article
 from web.models.settings import Settings
 from web.models.site import Site, get_current_site
+from .snapshot import EncodedSection, PublishedData, Snapshot, SnapshotReader, encode_items, record_changes, start_background_reload
 
 
-BACKGROUND_RELOAD_DELAY = 60 * 15
+ENTRY_FIELDS = ('uid', 'pageId', 'title', 'canonicalUrl', 'createdAt', 'updatedAt', 'createdBy', 'updatedBy', 'authors', 'rating', 'tags', 'children', 'dependencies', 'forumThread')
 
 
-# These default values are used in dev server.
-# When running via multiprocessing, this should be replaced with Manager by calling init() before forking.
-state = None
-lock = None
+# Catalog of each site is published as a snapshot (see snapshot.py) with a section per category.
+# It is built by a thread of the main process (init() before forking) and mapped by all workers.
+# Workers report changed articles with mark_changed(); the thread patches their entries and publishes the catalog again.
+# Full rebuild only catches what events don't report (e.g. users renamed, forum threads created).
+_readers: dict[str, SnapshotReader] = {}
+_readers_lock = threading.Lock()
 
 
-def reload_once(site):
+def _snapshot_name(site: Site) -> str:
+    return 'articles-%s' % site.slug
+
+
+# Returns catalog entries of given articles (all if None), together with the articles
+def _load_entries(site, article_ids: Optional[Sequence[int]]=None) -> list[tuple[Article, dict]]:
     latest_entries_sq = ArticleLogEntry.objects.filter(
         article_id=OuterRef('article_id')
     ).order_by('-rev_number')
 
     latest_events_qs = ArticleLogEntry.objects.filter(
         pk=Subquery(latest_entries_sq.values('pk')[:1])
-    ).select_related(
+    )
+    if article_ids is not None:
+        latest_events_qs = latest_events_qs.filter(article_id__in=article_ids)
+    latest_events_qs = latest_events_qs.select_related(
         'user'
     ).prefetch_related(
         'user__roles',
@@ -43,7 +53,6 @@ def reload_once(site):
     db_articles_qs = (
         Article.objects
         .prefetch_related(
-            'votes',
             'tags',
             'tags__category',
             'authors',
@@ -53,11 +62,19 @@ def reload_once(site):
         )
         
     )
+    if article_ids is not None:
+        db_articles_qs = db_articles_qs.filter(id__in=article_ids)
+    db_articles = list(db_articles_qs)
 
     ratings_map = articles.get_all_ratings(db_articles_qs)
-    children_map = articles.get_children_map()
-    dependencies_map = articles.get_dependency_map()
-    forum_thread_map = articles.get_forum_thread_map()
+    if article_ids is None:
+        children_map = articles.get_children_map()
+        dependencies_map = articles.get_dependency_map()
+        forum_thread_map = articles.get_forum_thread_map()
+    else:
+        children_map = articles.get_children_map(article_ids)
+        dependencies_map = articles.get_dependency_map([article.full_name for article in db_articles])
+        forum_thread_map = articles.get_forum_thread_map(article_ids)
 
     _users_cache = {}
     def _get_user_json_cached(user):
@@ -67,8 +84,8 @@ def reload_once(site):
         _users_cache[user] = render_user_to_json(user)
         return _users_cache[user]
 
-    stored_articles = {}
-    for article in db_articles_qs:
+    entries = []
+    for article in db_articles:
         last_event = last_events.get(article.id)
         rating, rating_votes, popularity, rating_mode = ratings_map.get(article.id, (0, 0, 0, Settings.RatingMode.Disabled))
         
@@ -81,10 +98,7 @@ def reload_once(site):
         article_name = article.full_name
         article_key = article_name.lower()
 
-        if article.category not in stored_articles:
-            stored_articles[article.category] = []
-
-        stored_articles[article.category].append({
+        entries.append((article, {
             'uid': article.id,
             'pageId': article_name,
             'title': article.title,
@@ -104,43 +118,107 @@ def reload_once(site):
             'children': children_map.get(article_key, []),
             'dependencies': dependencies_map.get(article_key, []),
             'forumThread': forum_thread_map.get(article.id)
-        })
-        
-    return stored_articles
+        }))
 
-def background_reload():
-    global state
+    return entries
 
-    while True:
-        try:
-            site = Site.objects.get()
-            with threadvars.context():
-                threadvars.put('current_site', site)
-                logging.info('Shared worker (%s): Reloading articles for %s', threading.current_thread().ident, site.slug)
 
-                stored_articles = reload_once(site)
+# Items of every section are ordered by uid and described by uid and time of the last update, for /api/articles
+def _describe_entry(entry: dict) -> tuple[int, float]:
+    return entry['uid'], datetime.datetime.fromisoformat(entry['updatedAt']).timestamp()
 
-                logging.info('Shared worker (%s): Finished reloading articles for %s', threading.current_thread().ident, site.slug)
-            state[site.slug] = stored_articles
-            time.sleep(BACKGROUND_RELOAD_DELAY)
-        except Exception as e:
-            logging.error('Shared worker (%s): Failed to background-reload articles', threading.current_thread().ident, exc_info=e)
-            time.sleep(BACKGROUND_RELOAD_DELAY / 2)
 
+def _encode_entries(entries: Iterable[dict]) -> EncodedSection:
+    return encode_items(sorted(entries, key=lambda entry: entry['uid']), _describe_entry)
 
-def get_all_articles() -> dict[str, list]:
-    global state
 
-    site = get_current_site()
-    return state.get(site.slug, {})
+def reload_once(site):
+    stored_articles = {}
+    for article, entry in _load_entries(site):
+        stored_articles.setdefault(article.category, []).append(entry)
+    return stored_articles
 
 
-def init():
-    global state, lock
+class _Catalog(PublishedData):
+    def __init__(self, site):
+        super().__init__(_snapshot_name(site))
+        self.site = site
+        self.entries: dict[str, dict[int, dict]] = {}
+        self.category_of: dict[int, str] = {}
+        self.parent_of: dict[int, Optional[int]] = {}
+
+    def _put(self, article: Article, entry: dict):
+        self.entries.setdefault(article.category, {})[article.id] = entry
+        self.category_of[article.id] = article.category
+        self.parent_of[article.id] = article.parent_id
+
+    # Removes the entry, returns its category
+    def _remove(self, article_id: int) -> Optional[str]:
+        category = self.category_of.pop(article_id, None)
+        self.parent_of.pop(article_id, None)
+        if category is not None:
+            self.entries[category].pop(article_id, None)
+        return category
+
+    def _load_entries(self, article_ids: Optional[Sequence[int]]=None) -> list[tuple[Article, dict]]:
+        with threadvars.context():
+            threadvars.put('current_site', self.site)
+            return _load_entries(self.site, article_ids)
+
+    def reload(self):
+        self.entries = {}
+        self.category_of = {}
+        self.parent_of = {}
+        for article, entry in self._load_entries():
+            self._put(article, entry)
+        self.encoded = {category: _encode_entries(entries.values()) for category, entries in self.entries.items()}
+
+    def patch(self, article_ids: Iterable[int]):
+        article_ids = set(article_ids)
+        loaded = self._load_entries(list(article_ids))
+        # children of the old and the new parent are listed in the parent's entry
+        parent_ids = {self.parent_of.get(x) for x in article_ids} | {article.parent_id for article, _ in loaded}
+        parent_ids -= article_ids | {None}
+        if parent_ids:
+            loaded += self._load_entries(list(parent_ids))
+
+        changed_categories = set()
+        for article_id in article_ids | parent_ids:
+            changed_categories.add(self._remove(article_id))
+        for article, entry in loaded:
+            self._put(article, entry)
+            changed_categories.add(article.category)
+        changed_categories.discard(None)
+
+        for category in changed_categories:
+            entries = self.entries.get(category)
+            if entries:
+                self.encoded[category] = _encode_entries(entries.values())
+            else:
+                self.entries.pop(category, None)
+                self.encoded.pop(category, None)
+
+
+# Records that given articles were created, changed or deleted. Call after commit, so that the changes are visible
+def mark_changed(article_ids: Iterable[int]):
+    record_changes(_snapshot_name(get_current_site()), article_ids)
+
+
+def get_catalog() -> Optional[Snapshot]:
+    name = _snapshot_name(get_current_site())
+    reader = _readers.get(name)
+    if reader is None:
+        with _readers_lock:
+            reader = _readers.setdefault(name, SnapshotReader(name))
+    return reader.get()
 
-    manager = multiprocessing.Manager()
-    state = manager.dict()
-    lock = manager.RLock()
 
-    t = threading.Thread(target=background_reload, daemon=True)
-    t.start()
+def get_all_articles() -> dict[str, list]:
+    catalog = get_catalog()
+    if catalog is None:
+        return {}
+    return {category: catalog.get_items(category) for category in catalog.sections}
+
+
+def init():
+    start_background_reload(lambda: _Catalog(Site.objects.get()), 'articles')
@@ -1,55 +1,194 @@
-import logging
-import multiprocessing
-import threading
-import time
+import bisect
+import json
+from typing import Iterable, Optional
 
 from renderer.utils import render_user_to_json
 from web import threadvars
+from web.models.roles import Role, RoleBadgeJSON, get_name_tail_roles, get_banned_user_badge, get_bot_user_badge
 from web.models.users import User
+from .snapshot import PublishedData, Snapshot, SnapshotReader, encode_items, record_changes, start_background_reload
 
 
-BACKGROUND_RELOAD_DELAY = 60 * 15
+SNAPSHOT_NAME = 'users'
+# change that affects every user (e.g. roles)
+ALL_USERS = '*'
 
+_BANNED_TAIL = '@banned'
+_BOT_TAIL = '@bot'
 
-# These default values are used in dev server.
-# When running via multiprocessing, this should be replaced with Manager by calling init() before forking.
-state = None
-lock = None
 
+# User directory is published as a snapshot (see snapshot.py) with sections:
+# - users: users as returned by the API (render_user_to_json with nameTails), ordered by id;
+# - names: [lowercase username or wikidot name, user id], ordered by name, for search by prefix.
+# Name tails come from roles, and changes to roles reload the whole directory, so they are stored with every user.
+# It is built by a thread of the main process (init() before forking) and mapped by all workers.
+# Workers report changed users with mark_changed(); the thread reloads them and publishes the directory again.
+# Full rebuild only catches what signals don't report (e.g. changes made with update()).
+_reader = SnapshotReader(SNAPSHOT_NAME)
 
-def background_reload():
-    global state
 
-    while True:
-        try:
-            with threadvars.context():
-                logging.info('Shared worker (%s): Reloading users', threading.current_thread().ident)
-                all_users = User.objects.all() \
-                .prefetch_related(
-                    'roles',
-                    'roles__permissions',
-                    'roles__restrictions'
-                )
-                state['all_users'] = [render_user_to_json(user) for user in all_users]
-                logging.info('Shared worker (%s): Finished reloading users', threading.current_thread().ident)
-            time.sleep(BACKGROUND_RELOAD_DELAY)
-        except Exception as e:
-            logging.error('Shared worker (%s): Failed to background-reload users', threading.current_thread().ident, exc_info=e)
-            time.sleep(BACKGROUND_RELOAD_DELAY / 2)
+def _load_users(user_ids: Optional[Iterable[int]]=None) -> list[User]:
+    q = User.objects.prefetch_related(
+        'roles',
+        'roles__permissions',
+        'roles__restrictions'
+    )
+    if user_ids is not None:
+        q = q.filter(id__in=list(user_ids))
+    return list(q)
 
 
-def get_all_users():
-    global state
+def _get_tail_keys(user: User) -> list[str]:
+    if not user.is_active and user.type != User.UserType.Wikidot:
+        return [_BANNED_TAIL]
+    if user.type == User.UserType.Bot:
+        return [_BOT_TAIL]
+    return [role.slug for role in get_name_tail_roles(user.roles.all())]
 
-    return state.get('all_users', [])
 
+# Name tails by key, as they are shown next to the user's name: (badges or icons, tail)
+def _load_tails() -> dict[str, tuple[str, dict]]:
+    tails = {_BANNED_TAIL: get_banned_user_badge(), _BOT_TAIL: get_bot_user_badge()}
+    for role in Role.objects.exclude(inline_visual_mode=Role.InlineVisualMode.Hidden):
+        tail = role.get_name_tail()
+        if tail:
+            tails[role.slug] = tail
+    return {key: ('badges' if isinstance(tail, RoleBadgeJSON) else 'icons', tail.dump()) for key, tail in tails.items()}
+
+
+def _render_user(user: User, tails: dict[str, tuple[str, dict]]) -> dict:
+    entry = render_user_to_json(user).dump()
+    name_tails = {'badges': [], 'icons': []}
+    for key in _get_tail_keys(user):
+        if key in tails:
+            kind, tail = tails[key]
+            name_tails[kind].append(tail)
+    entry['nameTails'] = name_tails
+    return entry
+
+
+def _describe_user(entry: dict) -> tuple[int, float]:
+    return entry['id'], 0.0
+
+
+def _describe_name(item: list) -> tuple[int, float]:
+    return item[1], 0.0
+
+
+class _Directory(PublishedData):
+    def __init__(self):
+        super().__init__(SNAPSHOT_NAME)
+        self.users: dict[int, dict] = {}
+        # lowercase names users are found by
+        self.names: dict[int, set[str]] = {}
+        self.tails: dict[str, tuple[str, dict]] = {}
+
+    def _put(self, user: User):
+        self.users[user.id] = _render_user(user, self.tails)
+        self.names[user.id] = {name.lower() for name in (user.username, user.wikidot_username) if name}
+
+    def _encode_users(self):
+        users = sorted(self.users.values(), key=lambda entry: entry['id'])
+        names = sorted((name, user_id) for user_id, user_names in self.names.items() for name in user_names)
+        self.encoded['users'] = encode_items(users, _describe_user)
+        self.encoded['names'] = encode_items([list(name) for name in names], _describe_name)
+
+    def reload(self):
+        with threadvars.context():
+            self.tails = _load_tails()
+            self.users = {}
+            self.names = {}
+            for user in _load_users():
+                self._put(user)
+            self._encode_users()
+
+    def patch(self, user_ids: Iterable):
+        user_ids = set(user_ids)
+        if ALL_USERS in user_ids:
+            self.reload()
+            return
+        with threadvars.context():
+            for user_id in user_ids:
+                self.users.pop(user_id, None)
+                self.names.pop(user_id, None)
+            for user in _load_users(user_ids):
+                self._put(user)
+            self._encode_users()
+
+
+# Records that given users were created, changed or deleted. Call after commit, so that the changes are visible
+def mark_changed(user_ids: Iterable[int]):
+    record_changes(SNAPSHOT_NAME, user_ids)
 
-def init():
-    global state, lock
 
-    manager = multiprocessing.Manager()
-    state = manager.dict()
-    lock = manager.RLock()
+def get_directory() -> Optional[Snapshot]:
+    return _reader.get()
 
-    t = threading.Thread(target=background_reload, daemon=True)
-    t.start()
+
+def _name_of(entry: tuple[int, float, memoryview]) -> str:
+    return json.loads(bytes(entry[2]))[0]
+
+
+def _find_by_ids(directory: Snapshot, user_ids: Iterable[int]) -> list[dict]:
+    users = directory.get_entries('users')
+    result = []
+    for user_id in user_ids:
+        i = bisect.bisect_left(users, user_id, key=lambda x: x[0])
+        if i < len(users) and users[i][0] == user_id:
+            result.append(users.get_item(i))
+    return result
+
+
+# Users whose username or wikidot name starts with prefix (case-insensitive), ordered by that name
+def search_users(prefix: str, limit: int) -> list[dict]:
+    directory = get_directory()
+    if directory is None:
+        return []
+    prefix = prefix.lower()
+    names = directory.get_entries('names')
+    user_ids = []
+    i = bisect.bisect_left(names, prefix, key=_name_of)
+    while i < len(names) and len(user_ids) < limit:
+        name, user_id = names.get_item(i)
+        if not name.startswith(prefix):
+            break
+        if user_id not in user_ids:
+            user_ids.append(user_id)
+        i += 1
+    return _find_by_ids(directory, user_ids)
+
+
+def get_users_by_ids(user_ids: Iterable[int]) -> list[dict]:
+    directory = get_directory()
+    if directory is None:
+        return []
+    return _find_by_ids(directory, user_ids)
+
+
+# Users with given usernames or wikidot names (case-insensitive)
+def get_users_by_names(user_names: Iterable[str]) -> list[dict]:
+    directory = get_directory()
+    if directory is None:
+        return []
+    names = directory.get_entries('names')
+    user_ids = []
+    for user_name in user_names:
+        user_name = user_name.lower()
+        i = bisect.bisect_left(names, user_name, key=_name_of)
+        if i < len(names):
+            name, user_id = names.get_item(i)
+            if name == user_name and user_id not in user_ids:
+                user_ids.append(user_id)
+    return _find_by_ids(directory, user_ids)
+
+
+# All users, as they are stored in the directory (the same as other functions return)
+def get_all_users_json() -> bytes:
+    directory = get_directory()
+    if directory is None:
+        return b'[]'
+    return directory.get_json(['users'])
+
+
+def init():
+    start_background_reload(_Directory, 'users')
@@ -0,0 +1,345 @@
+# Immutable snapshots of shared data, published as files and memory-mapped by every worker.
+#
+# A snapshot consists of named sections, each of them a list of JSON objects. Every section is stored already
+# serialized (items separated by commas, without the brackets), so that a response made of several sections is
+# produced by copying bytes out of the mapping, without decoding anything. Pages of the file are shared by all
+# workers through the OS page cache.
+#
+# Each section also has a table with the position of every item and two numbers given by the publisher (an id and
+# a timestamp), so that items can be filtered and paged through without decoding them. Sections are identified by
+# digests of their data, which stay the same as long as the data does, no matter how many times it is published.
+#
+# File layout: MAGIC, 8-byte length of the index, index (JSON), then the data and the table of every section.
+# A new snapshot is written next to the old one and moved into its place, so readers always see a complete file;
+# they notice the new one on the next access and map it instead.
+#
+# Processes that change the underlying data may record changes (keys of changed items) for the process that
+# publishes the snapshot. Each record is a small file in a directory next to the snapshot, so any number of
+# processes can add them without locking; the publisher takes them in batches and publishes a patched snapshot.
+# The publisher is a thread of the main process (see background_reload), started before workers are forked.
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+
+MAGIC = b'RFSNAP2\n'
+_INDEX_LENGTH = struct.Struct('<Q')
+# offset of the item within the section, its length, id and timestamp
+_TABLE_ENTRY = struct.Struct('<QIqd')
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# how often the publisher rebuilds the data from scratch, looks for recorded changes, and retries after a failure.
+# Full rebuilds pick up changes that are not recorded (made without emitting an event, e.g. from the shell or
+# by migrations), so they are still frequent enough for those to show up soon
+BACKGROUND_RELOAD_DELAY = 60 * 15
+CHANGES_POLL_DELAY = 5
+FAILURE_RETRY_DELAY = 60 * 5
+
+
+def get_snapshot_path(name: str) -> Path:
+    return Path(settings.SHARED_DATA_DIR) / ('%s.snapshot' % name)
+
+
+class EncodedSection(NamedTuple):
+    data: bytes
+    table: bytes
+    count: int
+    digest: str
+
+
+# describe returns (id, timestamp) of an item
+def encode_items(items: Iterable, describe: Optional[Callable[[object], tuple[int, float]]]=None) -> EncodedSection:
+    data = bytearray()
+    table = bytearray()
+    count = 0
+    for item in items:
+        encoded = json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if count:
+            data += b','
+        key, stamp = describe(item) if describe else (0, 0.0)
+        table += _TABLE_ENTRY.pack(len(data), len(encoded), key, stamp)
+        data += encoded
+        count += 1
+    return EncodedSection(bytes(data), bytes(table), count, hashlib.blake2b(data, digest_size=8).hexdigest())
+
+
+def publish_snapshot(name: str, sections: dict[str, list], meta: Optional[dict]=None, describe: Optional[Callable[[object], tuple[int, float]]]=None) -> str:
+    return publish_encoded_snapshot(name, {section: encode_items(items, describe) for section, items in sections.items()}, meta)
+
+
+# Same as publish_snapshot, for sections already encoded with encode_items (e.g. kept from the previous snapshot)
+def publish_encoded_snapshot(name: str, sections: dict[str, EncodedSection], meta: Optional[dict]=None) -> str:
+    index = {'version': uuid.uuid4().hex, 'created_at': time.time(), 'meta': meta or {}, 'sections': {}}
+    chunks = []
+    offset = 0
+    for section, encoded in sections.items():
+        index['sections'][section] = [offset, len(encoded.data), encoded.count, offset + len(encoded.data), encoded.digest]
+        chunks.append(encoded.data)
+        chunks.append(encoded.table)
+        offset += len(encoded.data) + len(encoded.table)
+
+    index_data = json.dumps(index, ensure_ascii=False).encode('utf-8')
+    path = get_snapshot_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name('%s.%s.tmp' % (path.name, index['version']))
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_INDEX_LENGTH.pack(len(index_data)))
+        f.write(index_data)
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+    return index['version']
+
+
+def get_changes_path(name: str) -> Path:
+    return Path(settings.SHARED_DATA_DIR) / ('%s.changes' % name)
+
+
+def record_changes(name: str, keys: Iterable):
+    path = get_changes_path(name)
+    path.mkdir(parents=True, exist_ok=True)
+    change_id = '%d-%s' % (time.time_ns(), uuid.uuid4().hex)
+    tmp_path = path / ('%s.tmp' % change_id)
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(list(keys), f)
+    os.replace(tmp_path, path / ('%s.json' % change_id))
+
+
+# Keys of all recorded changes, and the records to pass to discard_changes once they are applied
+def read_changes(name: str) -> tuple[list, list[Path]]:
+    path = get_changes_path(name)
+    try:
+        records = sorted(x for x in path.iterdir() if x.suffix == '.json')
+    except FileNotFoundError:
+        return [], []
+    keys = []
+    for record in records:
+        try:
+            with open(record, 'r', encoding='utf-8') as f:
+                keys.extend(json.load(f))
+        except FileNotFoundError:
+            continue
+        except ValueError:
+            logging.warning('Skipping broken change record %s', record)
+    return keys, records
+
+
+def discard_changes(records: Iterable[Path]):
+    for record in records:
+        record.unlink(missing_ok=True)
+
+
+# Records the change once the current transaction is committed, so that the publisher sees it in the database.
+# Keys are taken right away (a deleted object has no id by then), and a failure to record the change must not
+# fail a request whose changes are already committed.
+def record_changes_on_commit(record: Callable[[list], None], keys: Iterable):
+    keys = list(keys)
+    transaction.on_commit(lambda: record(keys), robust=True)
+
+
+# Data as last published by this process, kept to patch it without reloading everything.
+# Subclasses fill `encoded` with sections in reload() and update them in patch().
+class PublishedData(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.encoded: dict[str, EncodedSection] = {}
+
+    def reload(self):
+        raise NotImplementedError()
+
+    # keys are the ones recorded with record_changes
+    def patch(self, keys: set):
+        raise NotImplementedError()
+
+    def publish(self):
+        publish_encoded_snapshot(self.name, self.encoded)
+
+
+def _apply_changes(data: PublishedData, title: str):
+    keys, records = read_changes(data.name)
+    if not records:
+        return
+    data.patch(set(keys))
+    data.publish()
+    discard_changes(records)
+    logging.info('Shared worker (%s): Patched %d %s', threading.current_thread().ident, len(set(keys)), title)
+
+
+# Publishes data made by create() and keeps it up to date with recorded changes. Full rebuild only catches
+# what isn't recorded, so it's done rarely, and after failures, since the data may be broken then.
+def background_reload(create: Callable[[], PublishedData], title: str):
+    data = None
+    reloaded_at = None
+    while True:
+        try:
+            if data is None or time.monotonic() - reloaded_at >= BACKGROUND_RELOAD_DELAY:
+                data = create()
+                # changes recorded by now are included in the new data, later ones are applied on top of it
+                _, records = read_changes(data.name)
+                logging.info('Shared worker (%s): Reloading %s', threading.current_thread().ident, title)
+                data.reload()
+                logging.info('Shared worker (%s): Finished reloading %s', threading.current_thread().ident, title)
+                data.publish()
+                discard_changes(records)
+                reloaded_at = time.monotonic()
+            else:
+                _apply_changes(data, title)
+            time.sleep(CHANGES_POLL_DELAY)
+        except Exception as e:
+            logging.error('Shared worker (%s): Failed to background-reload %s', threading.current_thread().ident, title, exc_info=e)
+            data = None
+            time.sleep(FAILURE_RETRY_DELAY)
+
+
+def start_background_reload(create: Callable[[], PublishedData], title: str):
+    t = threading.Thread(target=background_reload, args=(create, title), daemon=True)
+    t.start()
+
+
+# Items of a section by their position, decoded only when accessed. Sections published in order of a key can
+# be searched with bisect.
+class SectionEntries(Sequence):
+    def __init__(self, data: memoryview, table: memoryview, count: int):
+        self._data = data
+        self._table = table
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    # (id, timestamp, encoded item)
+    def __getitem__(self, i: int) -> tuple[int, float, memoryview]:
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError('Item index out of range')
+        item_offset, item_length, key, stamp = _TABLE_ENTRY.unpack_from(self._table, i * _TABLE_ENTRY.size)
+        return key, stamp, self._data[item_offset:item_offset + item_length]
+
+    def get_item(self, i: int):
+        return json.loads(bytes(self[i][2]))
+
+
+class Snapshot(object):
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError('Not a snapshot file')
+        index_start = len(MAGIC) + _INDEX_LENGTH.size
+        index_length, = _INDEX_LENGTH.unpack(view[len(MAGIC):index_start])
+        index = json.loads(bytes(view[index_start:index_start + index_length]))
+        self.version: str = index['version']
+        self.created_at: float = index['created_at']
+        self.meta: dict = index['meta']
+        self._sections: dict[str, list] = index['sections']
+        self._data = view[index_start + index_length:]
+
+    @property
+    def sections(self) -> list[str]:
+        return list(self._sections.keys())
+
+    def count(self, section: str) -> int:
+        return self._sections[section][2] if section in self._sections else 0
+
+    # Digest of the data of all given sections; changes whenever any of them does
+    def get_digest(self, sections: Iterable[str]) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        for section in sections:
+            if section in self._sections:
+                digest.update(('%s:%s;' % (section, self._sections[section][4])).encode('utf-8'))
+        return digest.hexdigest()
+
+    # Encoded items of the section, as a slice of the mapping (no copy)
+    def get_raw(self, section: str) -> memoryview:
+        if section not in self._sections:
+            return self._data[0:0]
+        offset, length, _, _, _ = self._sections[section]
+        return self._data[offset:offset + length]
+
+    def get_entries(self, section: str) -> SectionEntries:
+        if section not in self._sections:
+            return SectionEntries(self._data[0:0], self._data[0:0], 0)
+        offset, length, count, table_offset, _ = self._sections[section]
+        return SectionEntries(self._data[offset:offset + length], self._data[table_offset:table_offset + count * _TABLE_ENTRY.size], count)
+
+    # (id, timestamp, encoded item) of every item of the section, in the order they were published
+    def iter_entries(self, section: str) -> Iterator[tuple[int, float, memoryview]]:
+        if section not in self._sections:
+            return
+        offset, length, count, table_offset, _ = self._sections[section]
+        data = self._data[offset:offset + length]
+        table = self._data[table_offset:table_offset + count * _TABLE_ENTRY.size]
+        for item_offset, item_length, key, stamp in _TABLE_ENTRY.iter_unpack(table):
+            yield key, stamp, data[item_offset:item_offset + item_length]
+
+    def get_items(self, section: str) -> list:
+        raw = self.get_raw(section)
+        if not raw:
+            return []
+        return json.loads(b'[' + bytes(raw) + b']')
+
+    # JSON array of items of all given sections, made of their bytes as they are in the mapping
+    def get_json(self, sections: Iterable[str]) -> bytes:
+        return b''.join(self.iter_json(sections, chunk_size=None))
+
+    # Same as get_json, in chunks of up to chunk_size bytes (to stream a response without building it whole)
+    def iter_json(self, sections: Iterable[str], chunk_size: Optional[int]=STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        yield b'['
+        first = True
+        for section in sections:
+            raw = self.get_raw(section)
+            if not raw:
+                continue
+            if not first:
+                yield b','
+            first = False
+            step = chunk_size or len(raw)
+            for offset in range(0, len(raw), step):
+                yield bytes(raw[offset:offset + step])
+        yield b']'
+
+
+class SnapshotReader(object):
+    def __init__(self, name: str):
+        self.name = name
+        self._snapshot = None
+        self._file_key = None
+        self._lock = threading.Lock()
+
+    # Latest published snapshot, or None if there is none yet.
+    # Costs one stat() call unless the snapshot has changed.
+    def get(self) -> Optional[Snapshot]:
+        path = get_snapshot_path(self.name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_key != self._file_key:
+            with self._lock:
+                if file_key != self._file_key:
+                    with open(path, 'rb') as f:
+                        # the mapping stays valid after the file is replaced; it is unmapped when nothing uses the old snapshot
+                        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        self._snapshot = Snapshot(mapping)
+                    except ValueError:
+                        # left by an older version; treated as not published until it is replaced
+                        logging.warning('Ignoring snapshot %s of unknown format', path)
+                        self._snapshot = None
+                    self._file_key = file_key
+        return self._snapshot
@@ -11,20 +11,23 @@ from typing import Optional, Union, Sequence, Tuple, Dict
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.db import transaction
-from django.db.models import QuerySet, Sum, Avg, Count, Max, IntegerField, Q, F
+from django.db.models import QuerySet, Sum, Avg, Count, Max, Q, F
 from django.db.models.functions import Coalesce
 
 import renderer
+from web import identity_map
 from web.events import EventBase
 from web.controllers import notifications, media
-from web.models.articles import Article, ArticleLogEntry, ArticleVersion, Category, ExternalLink, Tag, TagsCategory, Vote
+from web.models.articles import Article, ArticleLogEntry, ArticleVersion, ArticleRating, Category, ExternalLink, Tag, TagsCategory, Vote
 from web.models.files import File
 from web.models.settings import Settings
-from web.models.site import get_current_site
+from web.models.site import get_current_site, get_merged_settings
 from web.models.users import User
 from web.models.forum import ForumThread, ForumPost
 from web.models.roles import Role
+from web.permissions.backends import get_permissions_fingerprint
 from web.util import lock_table
+from web.util.versioned_cache import VersionedCache
 from web.types import _UserType, _FullNameOrArticle, _FullNameOrCategory, _FullNameOrTag, _UserIdOrUser
 
 
@@ -66,6 +69,12 @@ class OnCreateArticle(AbstractArticleEvent):
     pass
 
 
+# All votes of a user were deleted; ratings of `articles` have changed
+class OnDeleteUserVotes(EventBase):
+    user: _UserType
+    articles: list[Article]
+
+
 class OnDeleteArticle(AbstractArticleEvent):
     pass
 
@@ -120,7 +129,7 @@ def get_article(full_name_or_article: _FullNameOrArticle) -> Optional[Article]:
     if type(full_name_or_article) == str:
         full_name_or_article = full_name_or_article.lower()
         category, name = get_name(full_name_or_article)
-        return Article.objects.filter(category=category, name=name).first()
+        return identity_map.get_or_load('article', (category, name), lambda: Article.objects.filter(category=category, name=name).first())
     if not isinstance(full_name_or_article, Article):
         raise ValueError('Expected str or Article')
     return full_name_or_article
@@ -154,6 +163,8 @@ def create_article(full_name: str, user: _UserType=None) -> Article:
         title=name,
     )
     article.save()
+    # may already be created on save, see web/events/article_rating.py (only loaded by the web server)
+    ArticleRating.objects.get_or_create(article=article)
     if user:
         article.authors.add(user)
     OnCreateArticle(user, article).emit()
@@ -179,12 +190,47 @@ def add_log_entry(full_name_or_article: _FullNameOrArticle, log_entry: ArticleLo
             log_entry.rev_number = max_rev_number + 1
             log_entry.save()
 
+            latest = {'latest_rev_number': log_entry.rev_number, 'last_editor_id': log_entry.user_id}
+            version_id = get_log_entry_version_id(log_entry)
+            if version_id is not None:
+                latest['latest_version_id'] = version_id
+            Article.objects.filter(pk=article.pk).update(**latest)
+            for k, v in latest.items():
+                setattr(article, k, v)
+
             OnEditArticle(log_entry.user, article, log_entry).emit()
 
             article.updated_at = log_entry.created_at
             article.save()
 
 
+# Gets id of the version that log entry has created, if any
+def get_log_entry_version_id(log_entry: ArticleLogEntry) -> Optional[int]:
+    if log_entry.type not in (ArticleLogEntry.LogEntryType.New, ArticleLogEntry.LogEntryType.Source, ArticleLogEntry.LogEntryType.Wikidot, ArticleLogEntry.LogEntryType.Revert):
+        return None
+    if 'source' in log_entry.meta:
+        return log_entry.meta['source']['version_id']
+    return log_entry.meta.get('version_id')
+
+
+# Recalculates latest version, revision number and editor of article from its history.
+# add_log_entry keeps them up to date; this is for code that writes the history directly (e.g. imports)
+def refresh_latest_version(full_name_or_article: _FullNameOrArticle):
+    article = get_article(full_name_or_article)
+    if not article:
+        raise ValueError(f'Article {full_name_or_article} does not found')
+    latest_version = ArticleVersion.objects.filter(article=article).order_by('-created_at').values_list('id', flat=True).first()
+    latest_log_entry = ArticleLogEntry.objects.filter(article=article).order_by('-rev_number').first()
+    latest = {
+        'latest_version_id': latest_version,
+        'latest_rev_number': latest_log_entry.rev_number if latest_log_entry else None,
+        'last_editor_id': latest_log_entry.user_id if latest_log_entry else None
+    }
+    Article.objects.filter(pk=article.pk).update(**latest)
+    for k, v in latest.items():
+        setattr(article, k, v)
+
+
 # Gets all log entries of article, sorted
 def get_log_entries(full_name_or_article: _FullNameOrArticle) -> QuerySet[ArticleLogEntry]:
     article = get_article(full_name_or_article)
@@ -196,6 +242,17 @@ def get_latest_log_entry(full_name_or_article: _FullNameOrArticle) -> Optional[A
     return get_log_entries(full_name_or_article).first()
 
 
+# Gets number of the latest revision of article
+def get_latest_rev_number(full_name_or_article: _FullNameOrArticle) -> Optional[int]:
+    article = get_article(full_name_or_article)
+    if article is None:
+        return None
+    if article.latest_rev_number is not None:
+        return article.latest_rev_number
+    log_entry = get_latest_log_entry(article)
+    return log_entry.rev_number if log_entry else None
+
+
 # Gets list of log entries from article, sorted, with specified bounds
 def get_log_entries_paged(full_name_or_article: _FullNameOrArticle, c_from: int, c_to: int, get_all: bool = False) -> Tuple[QuerySet[ArticleLogEntry], int]:
     log_entries = get_log_entries(full_name_or_article)
@@ -444,12 +501,15 @@ def revert_article_version(full_name_or_article: _FullNameOrArticle, rev_number:
 
     if 'source' in new_props:
         subtypes.append(ArticleLogEntry.LogEntryType.Source)
+        previous_version = get_latest_version(article)
         version = ArticleVersion(
             article=article,
             source=new_props['source'],
             rendered=None
         )
         version.save()
+        if previous_version is not None:
+            compact_version(previous_version, version)
         meta['source'] = {'version_id': version.pk}
 
     if 'title' in new_props:
@@ -483,6 +543,7 @@ def revert_article_version(full_name_or_article: _FullNameOrArticle, rev_number:
         votes_meta = _get_article_votes_meta(article)
         meta['votes'] = votes_meta
         with transaction.atomic():
+            lock_article_rating(article)
             Vote.objects.filter(article=article).delete()
             for vote in new_props['votes']['votes']:
                 try:
@@ -499,6 +560,7 @@ def revert_article_version(full_name_or_article: _FullNameOrArticle, rev_number:
                 new_vote.save()
                 new_vote.date = vote_date
                 new_vote.save()
+            refresh_article_rating(article)
 
     authors_added_meta = []
     authors_removed_meta = []
@@ -543,13 +605,16 @@ def create_article_version(full_name_or_article: _FullNameOrArticle, source: str
     article = get_article(full_name_or_article)
     if not article:
         raise ValueError(f'Article {full_name_or_article} does not found')
-    is_new = get_latest_version(article) is None
+    previous_version = get_latest_version(article)
+    is_new = previous_version is None
     version = ArticleVersion(
         article=article,
         source=source,
         rendered=None
     )
     version.save()
+    if previous_version is not None:
+        compact_version(previous_version, version)
     # either NEW or SOURCE
     if is_new:
         log = ArticleLogEntry(
@@ -571,6 +636,21 @@ def create_article_version(full_name_or_article: _FullNameOrArticle, source: str
     return version
 
 
+# Stores a version that has just stopped being the latest one according to ARTICLE_VERSION_STORAGE:
+# as a reverse delta against the version that replaced it, or compressed if it falls on a keyframe.
+# position is the number of versions of the article older than this one, if the caller knows it.
+def compact_version(version: ArticleVersion, next_version: ArticleVersion, position: Optional[int]=None):
+    if settings.ARTICLE_VERSION_STORAGE != 'delta' or version.storage != ArticleVersion.Storage.Full:
+        return
+    if position is None:
+        position = ArticleVersion.objects.filter(article_id=version.article_id, created_at__lt=version.created_at).count()
+    if position % settings.ARTICLE_VERSION_KEYFRAME_INTERVAL == 0:
+        version.store_compressed(settings.ARTICLE_VERSION_COMPRESSION)
+    else:
+        version.store_as_delta(next_version, settings.ARTICLE_VERSION_COMPRESSION)
+    version.save(update_fields=ArticleVersion.storage_fields)
+
+
 # Refreshes links based on article version.
 def refresh_article_links(article_version: ArticleVersion):
     article = article_version.article
@@ -659,9 +739,12 @@ def _get_article_votes_meta(full_name_or_article: _FullNameOrArticle):
 def delete_article_votes(full_name_or_article: _FullNameOrArticle, user: _UserType = None, log: bool = True):
     article = get_article(full_name_or_article)
 
-    # fetch existing votes
-    votes_meta = _get_article_votes_meta(article)
-    Vote.objects.filter(article=article).delete()
+    with transaction.atomic():
+        lock_article_rating(article)
+        # fetch existing votes
+        votes_meta = _get_article_votes_meta(article)
+        Vote.objects.filter(article=article).delete()
+        refresh_article_rating(article)
 
     if log:
         log_entry = ArticleLogEntry(
@@ -673,6 +756,19 @@ def delete_article_votes(full_name_or_article: _FullNameOrArticle, user: _UserTy
         add_log_entry(article, log_entry)
 
 
+# Deletes all votes of the user, on all articles
+def delete_user_votes(user: _UserType):
+    with transaction.atomic():
+        # ordered, so that two such calls lock articles in the same order
+        voted_articles = list(Article.objects.filter(votes__user=user).distinct().order_by('id'))
+        for article in voted_articles:
+            lock_article_rating(article)
+        Vote.objects.filter(user=user).delete()
+        for article in voted_articles:
+            refresh_article_rating(article)
+        OnDeleteUserVotes(user, voted_articles).emit()
+
+
 # Updates title of article
 def update_title(full_name_or_article: _FullNameOrArticle, new_title: str, user: _UserType = None):
     article = get_article(full_name_or_article)
@@ -742,6 +838,8 @@ def get_latest_version(full_name_or_article: _FullNameOrArticle) -> Optional[Art
     article = get_article(full_name_or_article)
     if article is None:
         return None
+    if article.latest_version_id is not None:
+        return article.latest_version
     latest_version = ArticleVersion.objects.filter(article=article).order_by('-created_at')[:1]
     if latest_version:
         return latest_version[0]
@@ -885,10 +983,7 @@ def get_breadcrumbs(full_name_or_article: _FullNameOrArticle) -> Sequence[Articl
 # Get page category
 def get_category(full_name_or_category: _FullNameOrCategory) -> Optional[Category]:
     if isinstance(full_name_or_category, str):
-        try:
-            return Category.objects.get(name=full_name_or_category)
-        except Category.DoesNotExist:
-            return
+        return identity_map.get_or_load('category', full_name_or_category.lower(), lambda: Category.objects.filter(name=full_name_or_category).first())
     return full_name_or_category
 
 
@@ -999,16 +1094,21 @@ def set_tags_internal(full_name_or_article: _FullNameOrArticle, tags: Sequence[T
 
 
 # Get article comment info
-# This may actually create a thread if it does not exist yet
-def get_comment_info(full_name_or_article: _FullNameOrArticle) -> tuple[int, int]:
+# This may actually create a thread if it does not exist yet; with create=False, missing thread gives (0, 0)
+def get_comment_info(full_name_or_article: _FullNameOrArticle, create: bool=True) -> tuple[int, int]:
     article = get_article(full_name_or_article)
     if not article:
         return 0, 0
-    with transaction.atomic():
-        thread, created = ForumThread.objects.get_or_create(article=article)
-        if created:
-            for author in article.authors.all():
-                notifications.subscribe_to_notifications(subscriber=author, forum_thread=thread)
+    if not create:
+        thread = ForumThread.objects.filter(article=article).first()
+        if thread is None:
+            return 0, 0
+    else:
+        with transaction.atomic():
+            thread, created = ForumThread.objects.get_or_create(article=article)
+            if created:
+                for author in article.authors.all():
+                    notifications.subscribe_to_notifications(subscriber=author, forum_thread=thread)
     post_count = ForumPost.objects.filter(thread=thread).count()
     return thread.pk, post_count
 
@@ -1019,70 +1119,69 @@ def get_rating(full_name_or_article: _FullNameOrArticle) -> tuple[int | float, i
     if not article:
         return 0, 0, 0, Settings.RatingMode.Disabled
     obj_settings = article.settings
-    if obj_settings.rating_mode == Settings.RatingMode.UpDown:
-        data = article.votes.aggregate(sum=Coalesce(Sum('rate'), 0, output_field=IntegerField()), count=Count('rate'), good=Count('rate', filter=Q(rate=1)))
-        return data['sum'] or 0, data['count'] or 0, round((data['good'] or 0) / (data['count'] or 1) * 100), obj_settings.rating_mode
-    elif obj_settings.rating_mode == Settings.RatingMode.Stars:
-        data = article.votes.aggregate(avg=Coalesce(Avg('rate'), 0.0), count=Count('rate'), good=Count('rate', filter=Q(rate__gte=3)))
-        return round(data['avg'], 1) or 0.0, data['count'] or 0, round((data['good'] or 0) / (data['count'] or 1) * 100), obj_settings.rating_mode
-    elif obj_settings.rating_mode == Settings.RatingMode.Disabled:
-        return 0, 0, 0, obj_settings.rating_mode
-    else:
+    if obj_settings.rating_mode not in (Settings.RatingMode.UpDown, Settings.RatingMode.Stars, Settings.RatingMode.Disabled):
         raise ValueError('Unsupported rate type "%s"' % obj_settings.rating_mode)
-    
+    stats = ArticleRating.objects.filter(article=article).values(*RATING_STATS.keys()).first()
+    return _get_rating_from_stats(stats or {}, obj_settings.rating_mode)
+
+
+# Vote aggregates stored in ArticleRating, per article
+RATING_STATS = {
+    'sum_rate': lambda: Coalesce(Sum('rate'), 0.0),
+    'count_rate': lambda: Count('rate'),
+    'good_updown': lambda: Count('rate', filter=Q(rate=1)),
+    'avg_rate': lambda: Coalesce(Avg('rate'), 0.0),
+    'good_stars': lambda: Count('rate', filter=Q(rate__gte=3)),
+}
+
+
+# Votes of an article must only be changed in a transaction that has called this first, and refresh_article_rating
+# after the change. This makes concurrent votes for the same article wait for each other, so that stats can't miss any.
+def lock_article_rating(article: Article):
+    ArticleRating.objects.get_or_create(article=article)
+    ArticleRating.objects.select_for_update().filter(article=article).first()
+
+
+def refresh_article_rating(article: Article):
+    stats = Vote.objects.filter(article=article).aggregate(**{k: v() for k, v in RATING_STATS.items()})
+    ArticleRating.objects.update_or_create(article=article, defaults=get_rating_fields(stats))
+
+
+# Values of all ArticleRating fields, from vote stats (keys of RATING_STATS)
+def get_rating_fields(stats: dict) -> dict:
+    votes_count = stats['count_rate']
+    return {
+        **stats,
+        'popularity_updown': round((stats['good_updown'] / (votes_count or 1)) * 100),
+        'popularity_stars': round((stats['good_stars'] / (votes_count or 1)) * 100)
+    }
+
 
 # Returns dict {article_id: (rating, votes_count, popularity, mode)}
 def get_all_ratings(articles_qs):
-    category_names = list(
-        articles_qs.values_list("category", flat=True).distinct()
-    )
-    categories_map = {
-        c.name: c for c in Category.objects.filter(name__in=category_names).select_related("_settings")
-    }
+    vote_stats = ArticleRating.objects.filter(article__in=articles_qs).values('article_id', *RATING_STATS.keys())
+    votes_map = {v['article_id']: v for v in vote_stats}
 
+    return get_ratings_from_stats(list(articles_qs), votes_map)
+
+
+def _get_rating_from_stats(votes: dict, rating_mode: Settings.RatingMode | str) -> tuple[int | float, int, int, Settings.RatingMode | str]:
+    votes_count = votes.get('count_rate', 0)
+    if rating_mode == Settings.RatingMode.UpDown:
+        return int(votes.get('sum_rate', 0)), votes_count, round((votes.get('good_updown', 0) / (votes_count or 1)) * 100), rating_mode
+    elif rating_mode == Settings.RatingMode.Stars:
+        return round(votes.get('avg_rate', 0.0), 1), votes_count, round((votes.get('good_stars', 0) / (votes_count or 1)) * 100), rating_mode
+    return 0, 0, 0, rating_mode
+
+
+# Same as get_all_ratings, but for articles whose vote stats (keys of RATING_STATS) are already known
+def get_ratings_from_stats(articles_list: Sequence[Article], votes_map: Dict[int, dict]):
     current_site = get_current_site()
-    site_settings = current_site.settings
-    default_settings = Settings.get_default_settings()
-
-    vote_stats = (
-        Vote.objects
-        .values("article_id")
-        .annotate(
-            sum_rate=Coalesce(Sum("rate"), 0.0),
-            count_rate=Count("rate"),
-            good_updown=Count("rate", filter=Q(rate=1)),
-            avg_rate=Coalesce(Avg("rate"), 0.0),
-            good_stars=Count("rate", filter=Q(rate__gte=3))
-        )
-    )
-    votes_map = {v["article_id"]: v for v in vote_stats}
 
     results = {}
-    for article in articles_qs:
-        cat = categories_map.get(article.category)
-        category_settings = getattr(cat, "_settings", None)
-        merged_settings = default_settings.merge(site_settings).merge(category_settings)
-
-        rating_mode = merged_settings.rating_mode
-        votes = votes_map.get(article.id, {})
-
-        if rating_mode == Settings.RatingMode.UpDown:
-            rating_value = votes.get("sum_rate", 0)
-            votes_count = votes.get("count_rate", 0)
-            popularity = round((votes.get("good_updown", 0) / (votes_count or 1)) * 100)
-        elif rating_mode == Settings.RatingMode.Stars:
-            rating_value = round(votes.get("avg_rate", 0.0), 1)
-            votes_count = votes.get("count_rate", 0)
-            popularity = round((votes.get("good_stars", 0) / (votes_count or 1)) * 100)
-        else:
-            rating_value = votes_count = popularity = 0
-
-        results[article.id] = (
-            rating_value,
-            votes_count,
-            popularity,
-            rating_mode,
-        )
+    for article in articles_list:
+        merged_settings = get_merged_settings(current_site, article.category)
+        results[article.id] = _get_rating_from_stats(votes_map.get(article.id, {}), merged_settings.rating_mode)
 
     return results
 
@@ -1092,6 +1191,10 @@ def get_formatted_rating(full_name_or_article: _FullNameOrArticle) -> str:
     if not article:
         return '0'
     rating, votes, _, mode = get_rating(article)
+    return format_rating(rating, votes, mode)
+
+
+def format_rating(rating: int | float, votes: int, mode: Settings.RatingMode | str) -> str:
     if mode == Settings.RatingMode.UpDown:
         return '%+d' % rating
     elif mode == Settings.RatingMode.Stars:
@@ -1112,6 +1215,15 @@ class VotedTooSoonError(RuntimeError):
 def add_vote(full_name_or_article: _FullNameOrArticle, user: _UserType, rate: int | float | None):
     article = get_article(full_name_or_article)
 
+    with transaction.atomic():
+        lock_article_rating(article)
+        old_vote, new_vote = _replace_vote(article, user, rate)
+        refresh_article_rating(article)
+
+    OnVote(user, article, old_vote, new_vote).emit()
+
+
+def _replace_vote(article: Article, user: _UserType, rate: int | float | None) -> tuple[Optional[Vote], Optional[Vote]]:
     old_vote_query = Vote.objects.filter(article=article, user=user)
     old_vote = old_vote_query.first()
     old_vote_query.delete()
@@ -1131,8 +1243,7 @@ def add_vote(full_name_or_article: _FullNameOrArticle, user: _UserType, rate: in
         new_vote = Vote(article=article, user=user, rate=rate, role=user.vote_role)
         new_vote.save()
 
-    OnVote(user, article, old_vote, new_vote).emit()
-    
+    return old_vote, new_vote
 
 
 # Set article lock status
@@ -1293,16 +1404,28 @@ def fetch_articles_by_names(original_names):
     return articles_dict
 
 
-# Get hidden categories for specific user (none -> AnonymousUser)
-def get_hidden_categories_for(user: _UserType=None) -> list[Category]:
+_hidden_categories_cache = VersionedCache('hidden_categories')
+
+
+def _compute_hidden_categories(user: _UserType) -> frozenset[str]:
+    hidden_categories = set()
+    for category in Category.objects.all():
+        if not user.has_perm('roles.view_articles', category):
+            hidden_categories.add(category.name)
+    return frozenset(hidden_categories)
+
+
+# Get names of hidden categories for specific user (none -> AnonymousUser).
+# Users with the same roles always see the same categories, so the result is shared between them
+# until roles or categories change (see web/events/permissions_cache.py)
+def get_hidden_categories_for(user: _UserType=None) -> frozenset[str]:
     if user is None:
         user = AnonymousUser()
-    all_categories = Category.objects.all()
-    hidden_categories = []
-    for category in all_categories:
-        if not user.has_perm('roles.view_articles', category):
-            hidden_categories.append(category)
-    return hidden_categories
+    return _hidden_categories_cache.get(get_permissions_fingerprint(user), lambda: _compute_hidden_categories(user))
+
+
+def invalidate_hidden_categories():
+    _hidden_categories_cache.invalidate()
 
 
 def get_authors(full_name_or_article):
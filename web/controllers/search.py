@@ -1,16 +1,21 @@
 import json
 import base64
+import datetime
+import logging
 
-from typing import Literal
+from typing import Iterable, Literal
 from uuid import uuid4
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchHeadline
+from django.utils import timezone
 
 from renderer import RenderContext, single_pass_render_text
 
 from web.controllers import articles
-from web.models import ArticleSearchIndex, Article
+from web.models import ArticleSearchIndex, Article, SearchIndexQueue
+from web.models.articles import ArticleVersion
 from web.models.users import User
 
 
@@ -161,6 +166,20 @@ def encode_cursor(cursor_type: Literal['source', 'plain'], parameters: list[dict
     return data
 
 
+def _render_search_content(article: Article, version: ArticleVersion) -> tuple[str, str]:
+    context = RenderContext(article=version.article, source_article=article)
+    content_source = article.title + '\n\n' + version.source
+    try:
+        content_plaintext = article.title + '\n\n' + single_pass_render_text(version.source, context, 'system')
+    except:
+        content_plaintext = content_source
+    return content_source, content_plaintext
+
+
+def _search_vector():
+    return SearchVector('content_plaintext', config='english') + SearchVector('content_plaintext', config='russian')
+
+
 def update_search_index(article: Article):
     version = articles.get_latest_version(article)
 
@@ -168,14 +187,111 @@ def update_search_index(article: Article):
         return
 
     search_obj, created = ArticleSearchIndex.objects.get_or_create(article=article)
-    context = RenderContext(article=version.article, source_article=article)
-    search_obj.content_source = article.title + '\n\n' + version.source
-    try:
-        search_obj.content_plaintext = article.title + '\n\n' + single_pass_render_text(version.source, context, 'system')
-    except:
-        search_obj.content_plaintext = search_obj.content_source
+    search_obj.content_source, search_obj.content_plaintext = _render_search_content(article, version)
     search_obj.save()
 
     ArticleSearchIndex.objects.filter(pk=search_obj.pk).update(
-        vector_plaintext=SearchVector('content_plaintext', config='english') + SearchVector('content_plaintext', config='russian')
+        vector_plaintext=_search_vector()
+    )
+
+
+# Queues update of the search index of given articles, to be done by the searchworker command.
+# Repeated requests for an article that is still waiting are merged into one; articles that failed to index
+# get another chance.
+# Runs in the transaction of the caller, so the request is not lost if that transaction commits.
+def enqueue_search_index(articles_to_index: Article | Iterable[Article]):
+    if isinstance(articles_to_index, Article):
+        articles_to_index = [articles_to_index]
+    if not settings.SEARCH_INDEX_QUEUE:
+        for article in articles_to_index:
+            update_search_index(article)
+        return
+    now = timezone.now()
+    SearchIndexQueue.objects.bulk_create(
+        [SearchIndexQueue(article=article, queued_at=now, requested_at=now) for article in articles_to_index],
+        update_conflicts=True,
+        unique_fields=['article'],
+        update_fields=['requested_at', 'failed_at', 'attempts']
+    )
+
+
+# Claims up to batch_size queued articles for claim_timeout seconds. Claims of workers that died expire, so their
+# articles are picked up again; so are the articles that failed to index, after the same delay.
+# Articles claimed max_attempts times without success (whether they failed or took the worker down) are marked
+# as failed instead. Returns the claimed articles and the number of articles marked as failed.
+def _claim_search_index_batch(batch_size: int, claim_timeout: int, max_attempts: int) -> tuple[list[SearchIndexQueue], int]:
+    now = timezone.now()
+    with transaction.atomic():
+        items = list(
+            SearchIndexQueue.objects
+            .select_for_update(skip_locked=True)
+            .filter(failed_at__isnull=True)
+            .filter(models.Q(claimed_until__isnull=True) | models.Q(claimed_until__lt=now))
+            .order_by('queued_at')[:batch_size]
+        )
+        failed = [item for item in items if item.attempts >= max_attempts]
+        for item in failed:
+            logging.error('Gave up indexing article %d for search after %d attempts', item.article_id, item.attempts)
+        SearchIndexQueue.objects.filter(id__in=[item.id for item in failed]).update(claimed_until=None, failed_at=now)
+        items = [item for item in items if item.attempts < max_attempts]
+        SearchIndexQueue.objects.filter(id__in=[item.id for item in items]).update(
+            claimed_until=now + datetime.timedelta(seconds=claim_timeout),
+            attempts=models.F('attempts') + 1
+        )
+    return items, len(failed)
+
+
+# Updates search index of a batch of queued articles. Returns number of articles taken from the queue
+def process_search_index_queue(batch_size: int=50, claim_timeout: int=300, max_attempts: int=5) -> int:
+    items, failed_count = _claim_search_index_batch(batch_size, claim_timeout, max_attempts)
+    if not items:
+        return failed_count
+
+    contents = {}
+    failed = set()
+    for article in Article.objects.filter(id__in=[item.article_id for item in items]).select_related('latest_version'):
+        try:
+            version = articles.get_latest_version(article)
+            # articles without versions have nothing to index
+            if version is not None:
+                contents[article.id] = _render_search_content(article, version)
+        except:
+            logging.error('Failed to index article %s for search', article.full_name, exc_info=True)
+            failed.add(article.id)
+    done = [item for item in items if item.article_id not in failed]
+
+    with transaction.atomic():
+        existing = {obj.article_id: obj for obj in ArticleSearchIndex.objects.filter(article_id__in=list(contents.keys()))}
+        created = []
+        for article_id, (content_source, content_plaintext) in contents.items():
+            obj = existing.get(article_id)
+            if obj is None:
+                obj = ArticleSearchIndex(article_id=article_id)
+                created.append(obj)
+            obj.content_source = content_source
+            obj.content_plaintext = content_plaintext
+        ArticleSearchIndex.objects.bulk_update(list(existing.values()), ['content_source', 'content_plaintext'], batch_size=100)
+        ArticleSearchIndex.objects.bulk_create(created, batch_size=100)
+        # vectors of the whole batch are computed by a single query
+        ArticleSearchIndex.objects.filter(article_id__in=list(contents.keys())).update(vector_plaintext=_search_vector())
+
+        # articles edited again while they were indexed stay in the queue, and are released right away
+        finished = models.Q(pk__in=[])
+        for item in done:
+            finished |= models.Q(id=item.id, requested_at=item.requested_at)
+        SearchIndexQueue.objects.filter(finished).delete()
+        SearchIndexQueue.objects.filter(id__in=[item.id for item in done]).update(claimed_until=None, attempts=0)
+
+    return len(items) + failed_count
+
+
+# depth and lag are of the articles waiting to be indexed; failed ones are only counted
+def get_search_index_queue_stats() -> dict:
+    waiting = models.Q(failed_at__isnull=True)
+    stats = SearchIndexQueue.objects.aggregate(
+        depth=models.Count('id', filter=waiting),
+        oldest=models.Min('queued_at', filter=waiting),
+        failed=models.Count('id', filter=~waiting)
     )
+    lag = (timezone.now() - stats['oldest']).total_seconds() if stats['oldest'] else 0.0
+    return {'depth': stats['depth'], 'lag': lag, 'failed': stats['failed']}
@@ -0,0 +1,36 @@
+from shared_data import shared_articles
+from shared_data.snapshot import record_changes_on_commit
+from web.events import on_trigger
+from web.controllers.articles import OnVote, OnDeleteUserVotes, OnCreateArticle, OnDeleteArticle, OnEditArticle
+
+
+# Entries of the shared article catalog are patched by the main process (see shared_articles.mark_changed)
+def _mark_on_commit(article):
+    if article is not None:
+        record_changes_on_commit(shared_articles.mark_changed, [article.id])
+
+
+@on_trigger(OnEditArticle)
+def mark_edited_article(e: OnEditArticle):
+    _mark_on_commit(e.article)
+
+
+@on_trigger(OnCreateArticle)
+def mark_created_article(e: OnCreateArticle):
+    _mark_on_commit(e.article)
+
+
+@on_trigger(OnDeleteArticle)
+def mark_deleted_article(e: OnDeleteArticle):
+    _mark_on_commit(e.article)
+
+
+@on_trigger(OnVote)
+def mark_voted_article(e: OnVote):
+    _mark_on_commit(e.article)
+
+
+@on_trigger(OnDeleteUserVotes)
+def mark_articles_with_deleted_votes(e: OnDeleteUserVotes):
+    if e.articles:
+        record_changes_on_commit(shared_articles.mark_changed, [article.id for article in e.articles])
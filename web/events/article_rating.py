@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save
+
+from web.models.articles import Article, ArticleRating
+
+
+# ListPages sorts and filters by ArticleRating with an inner join, so every article needs a row,
+# including ones created outside of web.controllers.articles.create_article (e.g. in the admin).
+# Articles created with bulk_create() don't send this; 'manage.py rebuildratings' adds their rows.
+def create_article_rating(instance, created, raw=False, **_kwargs):
+    if created and not raw:
+        ArticleRating.objects.get_or_create(article=instance)
+
+
+post_save.connect(create_article_rating, sender=Article, weak=False, dispatch_uid='article_rating_Article_save')
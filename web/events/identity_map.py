@@ -0,0 +1,36 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from web import identity_map
+from web.models.articles import Article, ArticleLogEntry, ArticleRating, ArticleVersion, Category, Vote
+from web.models.settings import Settings
+from web.models.site import Site
+
+
+# page variables (see modules/listpages) are built from the article and things that change with it
+def forget_page_vars(**_kwargs):
+    identity_map.forget('page_vars')
+
+
+def forget_articles(**_kwargs):
+    identity_map.forget('article')
+    identity_map.forget('page_vars')
+
+
+# settings are cached on categories and articles, so both need to be fetched again
+def forget_categories(**_kwargs):
+    identity_map.forget('sites_config')
+    identity_map.forget('category')
+    identity_map.forget('article')
+    identity_map.forget('page_vars')
+
+
+for model, handler in [(Article, forget_articles), (Category, forget_categories), (Settings, forget_categories), (Site, forget_categories)]:
+    post_save.connect(handler, sender=model, weak=False, dispatch_uid=f'identity_map_{model.__name__}_save')
+    post_delete.connect(handler, sender=model, weak=False, dispatch_uid=f'identity_map_{model.__name__}_delete')
+
+for model in [ArticleVersion, ArticleLogEntry, ArticleRating, Vote]:
+    post_save.connect(forget_page_vars, sender=model, weak=False, dispatch_uid=f'identity_map_{model.__name__}_save')
+    post_delete.connect(forget_page_vars, sender=model, weak=False, dispatch_uid=f'identity_map_{model.__name__}_delete')
+
+for field in [Article.tags, Article.authors]:
+    m2m_changed.connect(forget_page_vars, sender=field.through, weak=False, dispatch_uid=f'identity_map_{field.through.__name__}_changed')
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from web.controllers.articles import invalidate_hidden_categories
+from web.models.articles import Category
+from web.models.roles import Role, RolePermissionsOverride
+from web.permissions.matrix import invalidate_permissions_matrix
+
+
+def _invalidate():
+    invalidate_permissions_matrix()
+    invalidate_hidden_categories()
+
+
+# Compiled permissions and cached hidden categories depend on permissions of roles and their overrides in categories.
+# Changes in roles of a user don't need this: such user just gets another permissions fingerprint.
+def invalidate_permissions_cache(**_kwargs):
+    # invalidating before commit would let concurrent requests cache the old permissions under the new version
+    transaction.on_commit(_invalidate)
+
+
+for model in [Role, RolePermissionsOverride, Category]:
+    post_save.connect(invalidate_permissions_cache, sender=model, weak=False, dispatch_uid=f'permissions_cache_{model.__name__}_save')
+    post_delete.connect(invalidate_permissions_cache, sender=model, weak=False, dispatch_uid=f'permissions_cache_{model.__name__}_delete')
+
+for m2m_model in [Role.permissions.through, Role.restrictions.through, RolePermissionsOverride.permissions.through, RolePermissionsOverride.restrictions.through, Category.permissions_override.through]:
+    m2m_changed.connect(invalidate_permissions_cache, sender=m2m_model, weak=False, dispatch_uid=f'permissions_cache_{m2m_model.__name__}_m2m')
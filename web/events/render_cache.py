@@ -0,0 +1,107 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from renderer import cache as render_cache, MAX_INCLUDE_LEVEL
+from web.events import on_trigger
+from web.controllers.articles import OnVote, OnDeleteUserVotes, OnCreateArticle, OnDeleteArticle, OnEditArticle
+from web.models.articles import ArticleLogEntry, Category, ExternalLink
+from web.models.roles import Role, RolePermissionsOverride
+from web.models.settings import Settings
+from web.models.site import Site
+from web.models.users import User
+
+
+def _link_names(full_name: str) -> list[str]:
+    name = render_cache.normalize_dependency_name(full_name)
+    if ':' in name:
+        return [name]
+    return [name, f'_default:{name}']
+
+
+# Returns names of all pages that include specified pages (transitively) or link to them (directly).
+def _collect_dependents(full_names: list[str]) -> set[str]:
+    result = {render_cache.normalize_dependency_name(x) for x in full_names}
+
+    linked_names = [x for name in result for x in _link_names(name)]
+    result.update(ExternalLink.objects.filter(link_type=ExternalLink.Type.Link, link_to__in=linked_names).values_list('link_from', flat=True))
+
+    to_visit = list(result)
+    for _ in range(MAX_INCLUDE_LEVEL):
+        if not to_visit:
+            break
+        included_names = [x for name in to_visit for x in _link_names(name)]
+        includers = ExternalLink.objects.filter(link_type=ExternalLink.Type.Include, link_to__in=included_names).values_list('link_from', flat=True)
+        to_visit = []
+        for includer in includers:
+            includer = render_cache.normalize_dependency_name(includer)
+            if includer not in result:
+                result.add(includer)
+                to_visit.append(includer)
+
+    return result
+
+
+def _invalidate_on_commit(full_names: list[str]):
+    if not render_cache.is_enabled():
+        return
+    names = _collect_dependents(full_names)
+    # invalidating before commit would let concurrent renders store stale data under the new generation
+    transaction.on_commit(lambda: render_cache.invalidate(names))
+
+
+@on_trigger(OnEditArticle)
+def invalidate_edited_article(e: OnEditArticle):
+    names = [e.article.full_name]
+    if e.log_entry.type == ArticleLogEntry.LogEntryType.Name and e.log_entry.meta.get('prev_name'):
+        names.append(e.log_entry.meta['prev_name'])
+    _invalidate_on_commit(names)
+
+
+@on_trigger(OnCreateArticle)
+def invalidate_created_article(e: OnCreateArticle):
+    _invalidate_on_commit([e.fullname])
+
+
+@on_trigger(OnDeleteArticle)
+def invalidate_deleted_article(e: OnDeleteArticle):
+    _invalidate_on_commit([e.fullname])
+
+
+@on_trigger(OnVote)
+def invalidate_voted_article(e: OnVote):
+    # rating is only visible on the page itself (rate module, this|rating); includers are not affected
+    if render_cache.is_enabled():
+        name = e.fullname
+        transaction.on_commit(lambda: render_cache.invalidate([name]))
+
+
+@on_trigger(OnDeleteUserVotes)
+def invalidate_articles_with_deleted_votes(e: OnDeleteUserVotes):
+    if render_cache.is_enabled():
+        names = [article.full_name for article in e.articles]
+        transaction.on_commit(lambda: render_cache.invalidate(names))
+
+
+# Anything that changes permissions or settings may affect any page.
+def invalidate_everything(**_kwargs):
+    if render_cache.is_enabled():
+        transaction.on_commit(render_cache.invalidate_all)
+
+
+# Users are rendered into pages (name, avatar, name tails from roles), and it's not known which pages show whom
+def invalidate_saved_user(update_fields=None, **kwargs):
+    # every login updates last_login, which is not rendered
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_everything(**kwargs)
+
+
+for model in [Role, RolePermissionsOverride, Category, Settings, Site]:
+    post_save.connect(invalidate_everything, sender=model, weak=False, dispatch_uid=f'render_cache_{model.__name__}_save')
+    post_delete.connect(invalidate_everything, sender=model, weak=False, dispatch_uid=f'render_cache_{model.__name__}_delete')
+
+post_save.connect(invalidate_saved_user, sender=User, weak=False, dispatch_uid='render_cache_User_save')
+post_delete.connect(invalidate_everything, sender=User, weak=False, dispatch_uid='render_cache_User_delete')
+
+for m2m_model in [User.roles.through, Role.permissions.through, Role.restrictions.through, RolePermissionsOverride.permissions.through, RolePermissionsOverride.restrictions.through, Category.permissions_override.through]:
+    m2m_changed.connect(invalidate_everything, sender=m2m_model, weak=False, dispatch_uid=f'render_cache_{m2m_model.__name__}_m2m')
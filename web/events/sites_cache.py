@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from web.models.articles import Category
+from web.models.settings import Settings
+from web.models.site import Site, invalidate_sites_cache
+
+
+# Category settings are stored by category name, so renaming a category affects them too
+def invalidate_sites(**_kwargs):
+    transaction.on_commit(invalidate_sites_cache)
+
+
+for model in [Site, Settings, Category]:
+    post_save.connect(invalidate_sites, sender=model, weak=False, dispatch_uid=f'sites_cache_{model.__name__}_save')
+    post_delete.connect(invalidate_sites, sender=model, weak=False, dispatch_uid=f'sites_cache_{model.__name__}_delete')
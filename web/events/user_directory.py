@@ -0,0 +1,49 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from shared_data import shared_users
+from shared_data.snapshot import record_changes_on_commit
+from web.models.roles import Role
+from web.models.users import User
+
+
+# Users of the shared directory are reloaded by the main process (see shared_users.mark_changed)
+def _mark_on_commit(user_ids):
+    record_changes_on_commit(shared_users.mark_changed, user_ids)
+
+
+def mark_saved_user(instance, update_fields=None, **_kwargs):
+    # every login updates last_login, which is not in the directory
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    _mark_on_commit([instance.pk])
+
+
+def mark_deleted_user(instance, **_kwargs):
+    _mark_on_commit([instance.pk])
+
+
+def mark_user_roles(instance, action, reverse, pk_set, **_kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        _mark_on_commit([instance.pk])
+    elif pk_set is not None:
+        _mark_on_commit(pk_set)
+    else:
+        # users of the role are cleared, and it is not known who they were
+        _mark_on_commit([shared_users.ALL_USERS])
+
+
+# Roles define name tails and permissions (the editor flag) of all their users
+def mark_all_users(**_kwargs):
+    _mark_on_commit([shared_users.ALL_USERS])
+
+
+post_save.connect(mark_saved_user, sender=User, weak=False, dispatch_uid='user_directory_User_save')
+post_delete.connect(mark_deleted_user, sender=User, weak=False, dispatch_uid='user_directory_User_delete')
+m2m_changed.connect(mark_user_roles, sender=User.roles.through, weak=False, dispatch_uid='user_directory_User_roles_m2m')
+
+post_save.connect(mark_all_users, sender=Role, weak=False, dispatch_uid='user_directory_Role_save')
+post_delete.connect(mark_all_users, sender=Role, weak=False, dispatch_uid='user_directory_Role_delete')
+for m2m_model in [Role.permissions.through, Role.restrictions.through]:
+    m2m_changed.connect(mark_all_users, sender=m2m_model, weak=False, dispatch_uid=f'user_directory_{m2m_model.__name__}_m2m')
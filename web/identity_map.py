@@ -0,0 +1,74 @@
+# Request-scoped identity map.
+#
+# A single page view resolves the same article, its category and their settings many times, since every
+# controller function accepts a name and looks it up again. Within a request, lookups by key go through this
+# map instead, so that each object is fetched once and every caller gets the same instance.
+# Saving or deleting an object of a mapped type drops all mapped objects of that type (see web/events/identity_map.py),
+# so requests that change things keep seeing them as they are in the database.
+import threading
+from typing import Callable, Hashable, Optional
+
+from web import threadvars
+
+
+_MAP_KEY = 'identity_map'
+
+
+class IdentityMap(object):
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+        # number of lookups that didn't need a query
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, key: Hashable, load: Callable[[], any]):
+        with self._lock:
+            if (kind, key) in self._objects:
+                self.hits += 1
+                return self._objects[(kind, key)]
+            self.misses += 1
+        value = load()
+        with self._lock:
+            return self._objects.setdefault((kind, key), value)
+
+    def forget(self, kind: str):
+        with self._lock:
+            self._objects = {k: v for k, v in self._objects.items() if k[0] != kind}
+
+
+def get_identity_map() -> Optional[IdentityMap]:
+    return threadvars.get(_MAP_KEY)
+
+
+# Returns the object mapped to (kind, key) in the current request, loading it if needed.
+# Outside of requests (commands, background threads) this always loads.
+def get_or_load(kind: str, key: Hashable, load: Callable[[], any]):
+    identity_map = get_identity_map()
+    if identity_map is None:
+        return load()
+    return identity_map.get(kind, key, load)
+
+
+def forget(kind: str):
+    identity_map = get_identity_map()
+    if identity_map is not None:
+        identity_map.forget(kind)
+
+
+class IdentityMapContext(object):
+    def __init__(self):
+        self.identity_map = IdentityMap()
+        self._context = threadvars.context()
+
+    def __enter__(self):
+        self._context.__enter__()
+        threadvars.put(_MAP_KEY, self.identity_map)
+        return self.identity_map
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return self._context.__exit__(exc_type, exc_value, exc_traceback)
+
+
+def context():
+    return IdentityMapContext()
@@ -17,6 +17,24 @@ export function fetchAllUsers(): Promise<UserData[]> {
   return wFetch<UserData[]>('/api/users')
 }
 
+interface UsersResponse {
+  users: UserData[]
+}
+
+export function searchUsers(query: string, limit: number = 10): Promise<UserData[]> {
+  const params = new URLSearchParams()
+  params.set('q', query)
+  params.set('limit', limit.toString())
+  return wFetch<UsersResponse>(`/api/users/search?${params.toString()}`).then(x => x.users)
+}
+
+export function lookupUsers(ids: number[], names: string[] = []): Promise<UserData[]> {
+  const params = new URLSearchParams()
+  if (ids.length) params.set('ids', ids.join(','))
+  if (names.length) params.set('names', names.join(','))
+  return wFetch<UsersResponse>(`/api/users/lookup?${params.toString()}`).then(x => x.users)
+}
+
 export interface AdminSusUser {
   user: {
     id: number
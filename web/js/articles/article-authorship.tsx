@@ -2,7 +2,7 @@ import * as React from 'react'
 import { useEffect, useState } from 'react'
 import styled from 'styled-components'
 import { fetchArticle, updateArticle } from '../api/articles'
-import { fetchAllUsers, UserData } from '../api/user'
+import { searchUsers, UserData } from '../api/user'
 import AuthorshipEditorComponent from '../components/authorship-editor'
 import sleep from '../util/async-sleep'
 import useConstCallback from '../util/const-callback'
@@ -61,7 +61,6 @@ const Styles = styled.div`
 const ArticleAuthorship: React.FC<Props> = ({ user, pageId, editable, onClose }) => {
   const [originAuthors, setOriginAuthors] = useState<UserData[]>([])
   const [authors, setAuthors] = useState<UserData[]>([])
-  const [allUsers, setAllUsers] = useState<UserData[]>([])
   const [askTransferOwnership, setAskTransferOwnership] = useState(false)
   const [loading, setLoading] = useState(false)
   const [saving, setSaving] = useState(false)
@@ -71,11 +70,10 @@ const ArticleAuthorship: React.FC<Props> = ({ user, pageId, editable, onClose })
 
   useEffect(() => {
     setLoading(true)
-    Promise.all([fetchArticle(pageId), fetchAllUsers()])
-      .then(([data, allUsers]) => {
+    fetchArticle(pageId)
+      .then(data => {
         setOriginAuthors(data?.authors || [])
         setAuthors(data?.authors || [])
-        setAllUsers(allUsers)
       })
       .catch(e => {
         setFatalError(true)
@@ -202,7 +200,7 @@ const ArticleAuthorship: React.FC<Props> = ({ user, pageId, editable, onClose })
             <tr>
               <td className="w-authorship-editor-container">
                 {loading && <Loader className="loader" />}
-                <AuthorshipEditorComponent authors={authors} allUsers={allUsers} onChange={onChange} editable={editable} />
+                <AuthorshipEditorComponent authors={authors} searchUsers={searchUsers} onChange={onChange} editable={editable} />
               </td>
             </tr>
           </tbody>
@@ -10,7 +10,7 @@ interface IndexedUserData extends UserData {
 
 interface Props {
   authors: UserData[]
-  allUsers: IndexedUserData[]
+  searchUsers: (query: string) => Promise<UserData[]>
   editable?: boolean
   onChange?: (author: UserData[]) => void
 }
@@ -98,17 +98,38 @@ const UserSuggestion = styled.div`
 `
 
 // TODO: idea by perseiide - to suggest users who made срфтпуы for this article
-const AuthorshipEditorComponent: React.FC<Props> = ({ authors, allUsers, editable, onChange }) => {
+const AuthorshipEditorComponent: React.FC<Props> = ({ authors, searchUsers, editable, onChange }) => {
   const [inputValue, setInputValue] = useState('')
+  const [foundUsers, setFoundUsers] = useState<UserData[]>([])
   const [suggestionsOpen, setSuggestionsOpen] = useState(false)
   const [selectedToAdd, setSelectedToAdd] = useState<number>()
   const [authorSet, setAuthorSet] = useState<Set<UserData>>()
   const inputRef = useRef<HTMLInputElement | null>(null)
   const suggestionsRef = useRef<HTMLDivElement | null>(null)
 
+  useEffect(() => {
+    const query = inputValue.trim()
+    if (!query) {
+      setFoundUsers([])
+      return
+    }
+    let cancelled = false
+    const timeout = setTimeout(() => {
+      searchUsers(query)
+        .then(users => {
+          if (!cancelled) setFoundUsers(users)
+        })
+        .catch(() => {})
+    }, 200)
+    return () => {
+      cancelled = true
+      clearTimeout(timeout)
+    }
+  }, [inputValue])
+
   // TODO: fix seleced user filtering
   const filteredUsers = useMemo(() => {
-    return allUsers
+    return foundUsers
       .reduce((acc, user) => {
         // if (authorSet?.has(user)) return acc  // Maybe
         const idx = user.name.toLowerCase().indexOf(inputValue.toLowerCase())
@@ -116,7 +137,7 @@ const AuthorshipEditorComponent: React.FC<Props> = ({ authors, allUsers, editabl
         return acc
       }, [] as IndexedUserData[])
       .sort((a, b) => (a.index !== undefined && b.index !== undefined && a.index !== b.index ? a.index - b.index : a.name.localeCompare(b.name)))
-  }, [authorSet, inputValue])
+  }, [authorSet, foundUsers, inputValue])
 
   const onDeleteAuthor = (e: React.MouseEvent, user: UserData) => {
     e.preventDefault()
@@ -151,7 +172,7 @@ const AuthorshipEditorComponent: React.FC<Props> = ({ authors, allUsers, editabl
 
     if (!onChange) return
 
-    const user = allUsers.find(x => x.id === userId)
+    const user = foundUsers.find(x => x.id === userId)
 
     setInputValue('')
     onChange([...authors.filter(x => x.id !== user?.id), user as UserData])
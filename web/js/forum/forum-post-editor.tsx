@@ -4,7 +4,7 @@ import * as React from 'react'
 import { useEffect, useRef, useState } from 'react'
 import styled from 'styled-components'
 import { fetchForumPost, previewForumPost } from '../api/forum'
-import { fetchAllUsers } from '../api/user'
+import { lookupUsers } from '../api/user'
 import useConstCallback from '../util/const-callback'
 import Loader from '../util/loader'
 import WikidotModal from '../util/wikidot-modal'
@@ -84,6 +84,7 @@ const ForumPostEditor: React.FC<Props> = ({
   const [error, setError] = useState('')
   const [fatalError, setFatalError] = useState(false)
   const [usernameSet, setUsernameSet] = useState<Set<string>>(new Set())
+  const checkedMentionsRef = useRef<Set<string>>(new Set())
   const [mentionDecorationIds, setMentionDecorationIds] = useState<string[]>([])
 
   const editorRef = useRef<editor.IStandaloneCodeEditor | null>(null)
@@ -129,15 +130,6 @@ const ForumPostEditor: React.FC<Props> = ({
         })
     }
 
-    fetchAllUsers()
-      .then(users => {
-        setUsernameSet(new Set(users.filter(u => u.type === 'normal' || u.type === 'bot').map(u => u.username.toLowerCase())))
-      })
-      .catch(e => {
-        setFatalError(false)
-        setError(e.error || 'Ошибка связи с сервером')
-      })
-
     return () => {
       window.removeEventListener('beforeunload', handleRefresh)
       ;(window as any)._closePostEditor = undefined
@@ -148,6 +140,26 @@ const ForumPostEditor: React.FC<Props> = ({
     highlightMentions(source)
   }, [source, usernameSet])
 
+  // only mentioned users are looked up, each name once
+  useEffect(() => {
+    const mentions = Array.from(new Set(Array.from(source.matchAll(/@([\w.-]+)/g), match => match[1].toLowerCase())))
+    const unchecked = mentions.filter(name => !checkedMentionsRef.current.has(name)).slice(0, 100)
+    if (!unchecked.length) return
+    const timeout = setTimeout(() => {
+      unchecked.forEach(name => checkedMentionsRef.current.add(name))
+      lookupUsers([], unchecked)
+        .then(users => {
+          const found = users.filter(u => u.type === 'normal' || u.type === 'bot').map(u => u.username.toLowerCase())
+          if (found.length) setUsernameSet(prev => new Set([...prev, ...found]))
+        })
+        .catch(e => {
+          unchecked.forEach(name => checkedMentionsRef.current.delete(name))
+          setError(e.error || 'Ошибка связи с сервером')
+        })
+    }, 300)
+    return () => clearTimeout(timeout)
+  }, [source])
+
   const onEditorDidMount = useConstCallback((editor: editor.IStandaloneCodeEditor, monaco: Monaco) => {
     editorRef.current = editor
     monacoRef.current = monaco
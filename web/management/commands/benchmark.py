@@ -0,0 +1,303 @@
+import time
+import random
+import uuid
+import concurrent.futures
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from web import threadvars
+from web.models import Article, ArticleVersion, Site
+
+
+def _parse_int_list(value):
+    return [int(x) for x in value.split(',') if x.strip()]
+
+
+def _run_threaded(func, items, threads):
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(func, items))
+    return time.perf_counter() - started
+
+
+def benchmark_render(command, site, options):
+    from ftml import ftml
+    import renderer
+    from renderer import RenderContext
+
+    versions = list(
+        ArticleVersion.objects
+        .filter(article__in=Article.objects.order_by('id')[:options['pages']])
+        .order_by('article_id', '-created_at')
+        .distinct('article_id')
+        .select_related('article')
+    )
+    if not versions:
+        raise CommandError('No articles to render')
+
+    total_size = sum(len(x.source) for x in versions)
+    command.stdout.write('Rendering %d pages (%d KB of source), %d times each' % (len(versions), total_size // 1024, options['repeat']))
+
+    page_info = ftml.PageInfo(page='benchmark', category='_default', site=site.slug, domain=site.domain, media_domain=site.media_domain, tags=[])
+    work = [x for x in versions for _ in range(options['repeat'])]
+
+    def render_pure(version, release_gil):
+        ftml.render_html(version.source, ftml.Callbacks(), page_info, 'article', release_gil)
+
+    # full renders take the mode from FTML_RELEASE_GIL, which is overridden for the whole run
+    def render_full(version, release_gil):
+        with threadvars.context():
+            threadvars.put('current_site', site)
+            renderer.single_pass_render(version.source, RenderContext(version.article, version.article, {}, None))
+
+    func = render_full if options['callbacks'] else render_pure
+    # the same build with and without releasing the GIL, speedup is relative to one thread holding it
+    baseline = None
+    for threads in options['threads']:
+        results = []
+        for release_gil in (False, True):
+            with override_settings(FTML_RELEASE_GIL=release_gil):
+                elapsed = _run_threaded(lambda version: func(version, release_gil), work, threads)
+            throughput = len(work) / elapsed
+            if baseline is None:
+                baseline = throughput
+            results.append('%8.1f pages/s, %6.2fx' % (throughput, throughput / baseline))
+        command.stdout.write('%3d thread(s): holding GIL %s; releasing GIL %s' % (threads, results[0], results[1]))
+
+
+def benchmark_templates(command, site, options):
+    import datetime
+    from renderer.utils import render_template_from_string, render_user_to_html
+    from modules.listpages import render_date, render_pagination
+    from web.models import User
+
+    user = User.objects.filter(is_active=True).order_by('id').first()
+    if user is None:
+        raise CommandError('No users to render')
+    # name tails are cached on the user, which matches how pages render the same author many times
+    user.name_tails
+
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    calls = max(options['pages'], 1) * 100
+    cases = [
+        ('template from string', lambda: render_template_from_string('<span class="odate" data-timestamp="{{ timestamp }}">{{ serverside }}</span>', timestamp=1, serverside='now')),
+        ('printuser', lambda: render_user_to_html(user)),
+        ('date', lambda: render_date(now)),
+        ('pagination', lambda: render_pagination('/page', 5, 20)),
+    ]
+
+    command.stdout.write('%d calls per case' % calls)
+    for name, func in cases:
+        func()
+        for threads in options['threads']:
+            elapsed = _run_threaded(lambda _: func(), range(calls), threads)
+            command.stdout.write('%-22s %3d thread(s): %8.2f us/call' % (name, threads, elapsed / calls * 1000000))
+
+
+def _create_synthetic_articles(command, count):
+    from web.controllers.articles import RATING_STATS, get_rating_fields
+    from web.models import ArticleRating, Settings, Vote
+
+    category = 'benchmark-%s' % uuid.uuid4().hex[:8]
+    rating_mode = Article(name='_tmp', category=category).settings.rating_mode
+    rates = [1, 1, 1, -1] if rating_mode != Settings.RatingMode.Stars else [1, 2, 3, 4, 5]
+
+    command.stdout.write('Creating %d synthetic articles in category %s' % (count, category))
+    articles = Article.objects.bulk_create([Article(category=category, name='page-%d' % i, title='Page %d' % i) for i in range(count)], batch_size=2000)
+
+    votes = []
+    ratings = []
+    rng = random.Random(count)
+    for article in articles:
+        # votes without users don't collide on the article+user constraint
+        article_votes = [Vote(article=article, user=None, rate=rng.choice(rates)) for _ in range(rng.randint(0, 20))]
+        votes.extend(article_votes)
+        stats = {k: 0 for k in RATING_STATS}
+        if article_votes:
+            values = [x.rate for x in article_votes]
+            stats.update({
+                'sum_rate': sum(values),
+                'avg_rate': sum(values) / len(values),
+                'count_rate': len(values),
+                'good_updown': len([x for x in values if x == 1]),
+                'good_stars': len([x for x in values if x >= 3]),
+            })
+        ratings.append(ArticleRating(article=article, **get_rating_fields(stats)))
+    Vote.objects.bulk_create(votes, batch_size=5000)
+    ArticleRating.objects.bulk_create(ratings, batch_size=5000)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE %s, %s, %s' % (Article._meta.db_table, Vote._meta.db_table, ArticleRating._meta.db_table))
+
+    return category, articles[0]
+
+
+def benchmark_listpages(command, site, options):
+    from django.contrib.auth.models import AnonymousUser
+    from django.db.models import Count, Sum, Q
+    from django.db.models.functions import Coalesce
+    from modules.listpages import query_pages
+
+    # aggregates over votes, the way listings were sorted before vote stats were stored
+    def query_aggregated(category, order):
+        q = Article.objects.filter(category=category)
+        if order == 'rating':
+            q = q.annotate(rating=Coalesce(Sum('votes__rate'), 0.0)).order_by('-rating')
+        elif order == 'votes':
+            q = q.annotate(num_votes=Count('votes', distinct=True)).order_by('-num_votes')
+        else:
+            q = q.annotate(num_votes=Count('votes', distinct=True), good=Count('votes', filter=Q(votes__rate__gte=1), distinct=True)).order_by('-good')
+        return list(q.distinct()[:20])
+
+    def query_stored(category, order, article):
+        pages, *_ = query_pages(article, {'category': category, 'order': '%s desc' % order, 'perpage': '20'}, AnonymousUser())
+        return list(pages)
+
+    with transaction.atomic():
+        category, article = _create_synthetic_articles(command, options['synthetic'])
+
+        with threadvars.context():
+            threadvars.put('current_site', site)
+            for order in ['rating', 'votes', 'popularity']:
+                for name, func in [('aggregated', lambda: query_aggregated(category, order)), ('stored', lambda: query_stored(category, order, article))]:
+                    func()
+                    started = time.perf_counter()
+                    for _ in range(options['repeat']):
+                        func()
+                    elapsed = (time.perf_counter() - started) / options['repeat']
+                    command.stdout.write('order=%-10s %-10s %8.2f ms/query' % (order, name, elapsed * 1000))
+
+        # nothing of the synthetic data is kept
+        transaction.set_rollback(True)
+
+
+def benchmark_http(command, site, options):
+    import statistics
+    import threading
+    import urllib.parse
+    from django.db import close_old_connections, connections
+    from django.test import Client
+
+    paths = ['/' + urllib.parse.quote(article.full_name) for article in Article.objects.order_by('-updated_at').only('category', 'name')[:options['pages']]]
+    work = [x for x in paths for _ in range(options['repeat'])]
+    if len(work) < 2:
+        raise CommandError('Not enough articles to request')
+
+    # connection settings are read by every new connection, so changing them here affects all threads
+    db_settings = connections.settings['default']
+    original_max_age = db_settings['CONN_MAX_AGE']
+    original_pool = db_settings['OPTIONS'].get('pool')
+    modes = [('per request', 0, None), ('persistent', None, None)]
+    if original_pool:
+        modes.append(('pool', 0, original_pool))
+
+    local = threading.local()
+    latencies = []
+
+    # the test client disconnects close_old_connections from request signals, so it's called here the way
+    # the WSGI handler would; otherwise CONN_MAX_AGE and the pool never come into play and all modes are the same
+    def request(path):
+        if not hasattr(local, 'client'):
+            local.client = Client(HTTP_HOST=site.domain)
+        started = time.perf_counter()
+        close_old_connections()
+        try:
+            local.client.get(path)
+        finally:
+            close_old_connections()
+        latencies.append(time.perf_counter() - started)
+
+    command.stdout.write('Requesting %d pages, %d times each' % (len(paths), options['repeat']))
+    # first requests fill render cache and process-wide caches, which would make the first mode look slower
+    _run_threaded(request, paths, 1)
+
+    try:
+        for name, max_age, pool in modes:
+            db_settings['CONN_MAX_AGE'] = max_age
+            if pool:
+                db_settings['OPTIONS']['pool'] = pool
+            else:
+                db_settings['OPTIONS'].pop('pool', None)
+            connections.close_all()
+            for threads in options['threads']:
+                latencies.clear()
+                elapsed = _run_threaded(request, work, threads)
+                quantiles = statistics.quantiles(latencies, n=100)
+                command.stdout.write('%-12s %3d thread(s): %7.1f req/s, p50 %6.1f ms, p95 %6.1f ms' % (name, threads, len(work) / elapsed, quantiles[49] * 1000, quantiles[94] * 1000))
+    finally:
+        db_settings['CONN_MAX_AGE'] = original_max_age
+        if original_pool:
+            db_settings['OPTIONS']['pool'] = original_pool
+
+
+def benchmark_catalog(command, site, options):
+    import multiprocessing
+    from django.http import JsonResponse, HttpResponse
+    from shared_data import shared_articles
+    from shared_data.snapshot import SnapshotReader, publish_snapshot, get_snapshot_path
+    from web.controllers.articles import get_hidden_categories_for
+
+    with threadvars.context():
+        threadvars.put('current_site', site)
+        catalog = shared_articles.reload_once(site)
+        hidden_categories = get_hidden_categories_for(None)
+    total = sum(len(x) for x in catalog.values())
+    command.stdout.write('Catalog of %d articles in %d categories' % (total, len(catalog)))
+
+    # the way the catalog was shared before: a Manager dict, copied to the worker on every access
+    manager = multiprocessing.Manager()
+    state = manager.dict()
+    state[site.slug] = catalog
+
+    def respond_manager(_):
+        result = []
+        for category, entries in state.get(site.slug, {}).items():
+            if category not in hidden_categories:
+                result.extend(entries)
+        return JsonResponse(result, safe=False).content
+
+    snapshot_name = 'benchmark-articles'
+    publish_snapshot(snapshot_name, catalog)
+    reader = SnapshotReader(snapshot_name)
+
+    def respond_snapshot(_):
+        snapshot = reader.get()
+        return HttpResponse(snapshot.get_json([x for x in snapshot.sections if x not in hidden_categories]), content_type='application/json').content
+
+    try:
+        for name, func in [('manager', respond_manager), ('snapshot', respond_snapshot)]:
+            func(None)
+            for threads in options['threads']:
+                calls = options['repeat'] * threads
+                elapsed = _run_threaded(func, range(calls), threads)
+                command.stdout.write('%-8s %3d thread(s): %8.2f ms/request, %7.1f requests/s' % (name, threads, elapsed / calls * threads * 1000, calls / elapsed))
+    finally:
+        manager.shutdown()
+        get_snapshot_path(snapshot_name).unlink(missing_ok=True)
+
+
+SUITES = {
+    'render': benchmark_render,
+    'templates': benchmark_templates,
+    'listpages': benchmark_listpages,
+    'http': benchmark_http,
+    'catalog': benchmark_catalog,
+}
+
+
+class Command(BaseCommand):
+    help = 'Runs performance benchmarks against the current database.\nAvailable suites: %s' % ', '.join(SUITES.keys())
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=SUITES.keys(), help='Benchmark to run')
+        parser.add_argument('--threads', type=_parse_int_list, default=[1, 2, 4, 8], help='Comma-separated list of thread counts')
+        parser.add_argument('--pages', type=int, default=200, help='Number of pages to use')
+        parser.add_argument('--repeat', type=int, default=3, help='How many times to process each page')
+        parser.add_argument('--callbacks', action='store_true', help='Render with the real callbacks (database, modules) instead of no-op ones')
+        parser.add_argument('--synthetic', type=int, default=50000, help='Number of synthetic articles to create (and remove) for database benchmarks')
+
+    def handle(self, *args, **options):
+        site = Site.objects.get()
+        SUITES[options['suite']](self, site, options)
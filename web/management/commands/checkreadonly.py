@@ -0,0 +1,43 @@
+import urllib.parse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from tqdm import tqdm
+
+from web.models import Article, Site
+from web.read_only import WriteInReadOnlyRequestError, get_violation_count
+
+
+class Command(BaseCommand):
+    help = 'Opens pages as an anonymous visitor and checks that they are served without writing to the database.\nRun this after changing anything that article views or modules do'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=200, help='Number of most recently updated pages to open')
+
+    def handle(self, *args, **options):
+        if not settings.READ_ONLY_FAST_PATH:
+            raise CommandError('READ_ONLY_FAST_PATH is disabled, page views are not read-only')
+
+        site = Site.objects.get()
+        client = Client(HTTP_HOST=site.domain)
+        paths = ['/' + urllib.parse.quote(article.full_name) for article in Article.objects.order_by('-updated_at').only('category', 'name')[:options['pages']]]
+
+        failed = []
+        # cached pages would skip modules, which are the most likely to write
+        with override_settings(READ_ONLY_WRITE_GUARD=True, RENDER_CACHE_ENABLED=False):
+            for path in tqdm(paths):
+                violations = get_violation_count()
+                try:
+                    client.get(path)
+                except WriteInReadOnlyRequestError as e:
+                    failed.append((path, str(e)))
+                    continue
+                if get_violation_count() != violations:
+                    failed.append((path, 'write query in a module or include (see log)'))
+
+        for path, error in failed:
+            self.stderr.write('%s: %s' % (path, error))
+        if failed:
+            raise CommandError('%d of %d pages wrote to the database' % (len(failed), len(paths)))
+        self.stdout.write('Checked %d pages: no writes' % len(paths))
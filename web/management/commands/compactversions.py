@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Func, Sum, IntegerField
+from django.db.models.functions import Coalesce
+from tqdm import tqdm
+
+from web.models import Article, ArticleVersion
+from web.util.text_delta import apply_delta, decode_delta
+
+
+class OctetLength(Func):
+    function = 'octet_length'
+    output_field = IntegerField()
+
+
+def get_stored_size() -> int:
+    sizes = ArticleVersion.objects.aggregate(
+        source=Coalesce(Sum(OctetLength('stored_source')), 0),
+        data=Coalesce(Sum(OctetLength('stored_data')), 0)
+    )
+    return sizes['source'] + sizes['data']
+
+
+def get_table_size() -> int:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_total_relation_size(%s)', [ArticleVersion._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+def _format_size(size: int) -> str:
+    return '%.1f MB' % (size / 1024 / 1024)
+
+
+class Command(BaseCommand):
+    help = 'Converts stored history of articles to the given storage mode (see ARTICLE_VERSION_STORAGE).\nThe latest version of each article is always kept as full text'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--storage', choices=['delta', 'full'], default='delta', help='Storage mode to convert to')
+        parser.add_argument('--compression', choices=['none', 'zlib', 'zstd'], default=settings.ARTICLE_VERSION_COMPRESSION, help='Compression of deltas and keyframes')
+        parser.add_argument('--keyframe-interval', type=int, default=settings.ARTICLE_VERSION_KEYFRAME_INTERVAL, help='Every N-th version is stored whole')
+
+    def handle(self, *args, **options):
+        if options['keyframe_interval'] < 1:
+            raise CommandError('Keyframe interval must be positive')
+
+        stored_before = get_stored_size()
+        table_before = get_table_size()
+
+        for article in tqdm(Article.objects.order_by('id')):
+            self.convert_article(article, options)
+
+        stored_after = get_stored_size()
+        table_after = get_table_size()
+        self.stdout.write('Stored history: %s -> %s' % (_format_size(stored_before), _format_size(stored_after)))
+        self.stdout.write('Table size on disk: %s -> %s (freed space is reclaimed by VACUUM FULL)' % (_format_size(table_before), _format_size(table_after)))
+
+    @transaction.atomic
+    def convert_article(self, article, options):
+        versions = list(ArticleVersion.objects.filter(article=article).select_for_update().order_by('created_at'))
+        if not versions:
+            return
+
+        # decode newest first, so that every delta finds its base already decoded
+        by_id = {version.pk: version for version in versions}
+        for version in reversed(versions):
+            if version.base_id in by_id:
+                version.base = by_id[version.base_id]
+            version.source
+
+        for position, version in enumerate(versions):
+            source = version.source
+            is_latest = position == len(versions) - 1
+            if options['storage'] == 'full' or is_latest:
+                version.store_full()
+            elif position % options['keyframe_interval'] == 0:
+                version.store_compressed(options['compression'])
+            else:
+                next_version = versions[position + 1]
+                version.store_as_delta(next_version, options['compression'])
+                if apply_delta(next_version.source, decode_delta(version.stored_data)) != source:
+                    raise CommandError('Delta of version %d of %s does not reproduce its source' % (version.pk, article.full_name))
+
+        ArticleVersion.objects.bulk_update(versions, ArticleVersion.storage_fields, batch_size=100)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from web.controllers.articles import RATING_STATS, get_rating_fields
+from web.models import Article, ArticleRating, Vote
+
+
+class Command(BaseCommand):
+    help = 'Recalculates stored vote stats of all articles from their votes.\nNormally they are kept up to date on every vote; this repairs them after votes were changed directly in the database'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        empty_stats = {k: 0 for k in RATING_STATS}
+        actual = {article_id: empty_stats for article_id in Article.objects.values_list('id', flat=True)}
+        for stats in Vote.objects.values('article_id').annotate(**{k: v() for k, v in RATING_STATS.items()}).order_by():
+            actual[stats.pop('article_id')] = stats
+        stored = {x.article_id: x for x in ArticleRating.objects.select_for_update()}
+
+        to_create = []
+        to_update = []
+        for article_id, stats in actual.items():
+            fields = get_rating_fields(stats)
+            rating = stored.get(article_id)
+            if rating is None:
+                to_create.append(ArticleRating(article_id=article_id, **fields))
+            elif any(getattr(rating, k) != v for k, v in fields.items()):
+                for k, v in fields.items():
+                    setattr(rating, k, v)
+                to_update.append(rating)
+
+        ArticleRating.objects.bulk_create(to_create, batch_size=1000)
+        ArticleRating.objects.bulk_update(to_update, list(get_rating_fields(empty_stats).keys()), batch_size=1000)
+
+        self.stdout.write('Checked %d articles: %d missing, %d outdated' % (len(actual), len(to_create), len(to_update)))
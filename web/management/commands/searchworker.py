@@ -0,0 +1,54 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from web import threadvars
+from web.controllers.search import process_search_index_queue, get_search_index_queue_stats
+from web.models import Site
+
+
+class Command(BaseCommand):
+    help = 'Updates search index of articles queued by edits (see SEARCH_INDEX_QUEUE).\nRuns until stopped, unless --once or --stats is given'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Articles indexed per batch')
+        parser.add_argument('--claim-timeout', type=int, default=300, help='Seconds after which articles of a batch that was not finished are indexed again')
+        parser.add_argument('--max-attempts', type=int, default=5, help='Times an article is tried before it is marked as failed (it is tried again when edited)')
+        parser.add_argument('--poll-interval', type=float, default=2, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--stats-interval', type=float, default=60, help='Seconds between reports of queue depth and lag')
+        parser.add_argument('--once', action='store_true', help='Process the queue until it is empty and exit')
+        parser.add_argument('--stats', action='store_true', help='Print queue depth and lag and exit')
+
+    def _report(self):
+        stats = get_search_index_queue_stats()
+        logging.info('Search index queue: %d article(s), oldest waits for %.1fs, %d failed', stats['depth'], stats['lag'], stats['failed'])
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be positive')
+        if options['max_attempts'] < 1:
+            raise CommandError('Max attempts must be positive')
+
+        if options['stats']:
+            stats = get_search_index_queue_stats()
+            self.stdout.write('depth=%d lag=%.1f failed=%d' % (stats['depth'], stats['lag'], stats['failed']))
+            return
+
+        site = Site.objects.get()
+        reported_at = 0
+        while True:
+            close_old_connections()
+            with threadvars.context():
+                threadvars.put('current_site', site)
+                processed = process_search_index_queue(options['batch_size'], options['claim_timeout'], options['max_attempts'])
+            if processed:
+                logging.info('Search index queue: indexed a batch of %d article(s)', processed)
+            if time.monotonic() - reported_at >= options['stats_interval']:
+                self._report()
+                reported_at = time.monotonic()
+            if not processed:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
@@ -1,13 +1,12 @@
 from django.conf import settings
-from django.db.models import Q
 from django.http import HttpResponseRedirect
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth import get_user_model
 from django.shortcuts import render
 
-from web.models.site import Site
+from web.models.site import get_site_by_host, get_site_domains
 from web.models.users import ExtendedAnonymousUser
-from web import threadvars
+from web import threadvars, identity_map
 
 import logging
 import django.middleware.csrf
@@ -62,21 +61,20 @@ class MediaHostMiddleware(object):
             raw_host = request.get_host()
             if ':' not in raw_host and 'SERVER_PORT' in request.META:
                 raw_host += ':' + request.META['SERVER_PORT']
-                possible_sites = Site.objects.filter(Q(domain=raw_host) | Q(media_domain=raw_host))
+                site = get_site_by_host(raw_host)
             else:
-                possible_sites = []
-            if not possible_sites:
+                site = None
+            if site is None:
                 # find site by domain
                 raw_host = request.get_host().split(':')[0]
-                possible_sites = Site.objects.filter(Q(domain=raw_host) | Q(media_domain=raw_host))
-                if not possible_sites:
-                    if Site.objects.exists():
+                site = get_site_by_host(raw_host)
+                if site is None:
+                    if get_site_domains():
                         logging.warning('This domain (\'%s\') is not configured' % raw_host)
                         raise PermissionDenied()
                     else:
                         return render(request, 'no_site.html')
 
-            site = possible_sites[0]
             threadvars.put('current_site', site)
 
             is_media_host = request.get_host().split(':')[0] == site.media_domain
@@ -118,7 +116,7 @@ class CsrfViewMiddleware(django.middleware.csrf.CsrfViewMiddleware):
 
     @property
     def csrf_trusted_origins_hosts(self):
-        return [site.domain for site in Site.objects.all()]
+        return get_site_domains()
 
     @property
     def allowed_origins_exact(self):
@@ -178,6 +176,20 @@ class SpyRequestMiddleware(object):
             return self.get_response(request)
 
 
+class IdentityMapMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with identity_map.context() as objects:
+            response = self.get_response(request)
+            if objects.hits:
+                logging.debug('%s: identity map saved %d queries (%d made)', request.path, objects.hits, objects.misses)
+            if settings.DEBUG:
+                response['X-Identity-Map'] = 'hits=%d, misses=%d' % (objects.hits, objects.misses)
+            return response
+
+
 # TODO: Handle this shit properly
 class ExtendedAnonymousMiddleware:
     def __init__(self, get_response):
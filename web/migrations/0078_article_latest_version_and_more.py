@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-18
+
+import auto_prefetch
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_latest_version(apps, schema_editor):
+    Article = apps.get_model('web', 'Article')
+    ArticleVersion = apps.get_model('web', 'ArticleVersion')
+    ArticleLogEntry = apps.get_model('web', 'ArticleLogEntry')
+    db_alias = schema_editor.connection.alias
+
+    latest_version = ArticleVersion.objects.using(db_alias).filter(article=OuterRef('pk')).order_by('-created_at').values('id')[:1]
+    latest_log_entry = ArticleLogEntry.objects.using(db_alias).filter(article=OuterRef('pk')).order_by('-rev_number')
+    Article.objects.using(db_alias).update(
+        latest_version=Subquery(latest_version),
+        latest_rev_number=Subquery(latest_log_entry.values('rev_number')[:1]),
+        last_editor=Subquery(latest_log_entry.values('user')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0077_forumreaction_is_hidden_from_picker'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='latest_version',
+            field=auto_prefetch.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='web.articleversion', verbose_name='Текущая версия'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='latest_rev_number',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Номер последней правки'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='last_editor',
+            field=auto_prefetch.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор последней правки'),
+        ),
+        migrations.RunPython(fill_latest_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-18
+
+import auto_prefetch
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0078_article_latest_version_and_more'),
+    ]
+
+    operations = [
+        # the column stays the same, only the field is renamed
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name='articleversion',
+                    old_name='source',
+                    new_name='stored_source',
+                ),
+                migrations.AlterField(
+                    model_name='articleversion',
+                    name='stored_source',
+                    field=models.TextField(blank=True, db_column='source', verbose_name='Исходник'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='articleversion',
+            name='stored_data',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Сжатый исходник или разница'),
+        ),
+        migrations.AddField(
+            model_name='articleversion',
+            name='storage',
+            field=models.TextField(choices=[('full', 'Полный текст'), ('compressed', 'Сжатый текст'), ('delta', 'Разница с базовой версией')], default='full', verbose_name='Способ хранения'),
+        ),
+        migrations.AddField(
+            model_name='articleversion',
+            name='base',
+            field=auto_prefetch.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='web.articleversion', verbose_name='Базовая версия'),
+        ),
+    ]
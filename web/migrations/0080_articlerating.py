@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-18
+
+import auto_prefetch
+import django.db.models.deletion
+import django.db.models.manager
+from django.db import migrations, models
+from django.db.models import Avg, Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_ratings(apps, schema_editor):
+    ArticleRating = apps.get_model('web', 'ArticleRating')
+    Vote = apps.get_model('web', 'Vote')
+    db_alias = schema_editor.connection.alias
+
+    stats = Vote.objects.using(db_alias).values('article_id').annotate(
+        sum_rate=Coalesce(Sum('rate'), 0.0),
+        count_rate=Count('rate'),
+        good_updown=Count('rate', filter=Q(rate=1)),
+        avg_rate=Coalesce(Avg('rate'), 0.0),
+        good_stars=Count('rate', filter=Q(rate__gte=3)),
+    ).order_by()
+    ArticleRating.objects.using(db_alias).bulk_create([ArticleRating(**x) for x in stats], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0079_articleversion_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleRating',
+            fields=[
+                ('article', auto_prefetch.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to='web.article', verbose_name='Статья')),
+                ('sum_rate', models.FloatField(default=0, verbose_name='Сумма оценок')),
+                ('avg_rate', models.FloatField(default=0, verbose_name='Средняя оценка')),
+                ('count_rate', models.PositiveIntegerField(default=0, verbose_name='Количество оценок')),
+                ('good_updown', models.PositiveIntegerField(default=0, verbose_name='Количество положительных оценок')),
+                ('good_stars', models.PositiveIntegerField(default=0, verbose_name='Количество оценок от 3 звёзд')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг статьи',
+                'verbose_name_plural': 'Рейтинги статей',
+                'abstract': False,
+                'base_manager_name': 'prefetch_manager',
+                'indexes': [models.Index(fields=['sum_rate'], name='web_article_sum_rat_9bbf60_idx'), models.Index(fields=['avg_rate'], name='web_article_avg_rat_5f2db1_idx'), models.Index(fields=['count_rate'], name='web_article_count_r_a109ab_idx')],
+            },
+            managers=[
+                ('objects', django.db.models.manager.Manager()),
+                ('prefetch_manager', django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
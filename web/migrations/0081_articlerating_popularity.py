@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-18
+
+from django.db import migrations, models
+
+
+def fill_popularity(apps, schema_editor):
+    Article = apps.get_model('web', 'Article')
+    ArticleRating = apps.get_model('web', 'ArticleRating')
+    db_alias = schema_editor.connection.alias
+
+    ratings = list(ArticleRating.objects.using(db_alias).filter(count_rate__gt=0))
+    for rating in ratings:
+        rating.popularity_updown = round(rating.good_updown / rating.count_rate * 100)
+        rating.popularity_stars = round(rating.good_stars / rating.count_rate * 100)
+    ArticleRating.objects.using(db_alias).bulk_update(ratings, ['popularity_updown', 'popularity_stars'], batch_size=1000)
+
+    # articles that were never voted for get an empty row, so that every article has one
+    missing = Article.objects.using(db_alias).filter(rating_stats__isnull=True).values_list('id', flat=True)
+    ArticleRating.objects.using(db_alias).bulk_create([ArticleRating(article_id=x) for x in missing], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0080_articlerating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='articlerating',
+            name='popularity_updown',
+            field=models.PositiveIntegerField(default=0, verbose_name='Популярность (голосование за/против)'),
+        ),
+        migrations.AddField(
+            model_name='articlerating',
+            name='popularity_stars',
+            field=models.PositiveIntegerField(default=0, verbose_name='Популярность (звёзды)'),
+        ),
+        migrations.AddIndex(
+            model_name='articlerating',
+            index=models.Index(fields=['popularity_updown'], name='web_article_popular_6ca937_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='articlerating',
+            index=models.Index(fields=['popularity_stars'], name='web_article_popular_9b0a60_idx'),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
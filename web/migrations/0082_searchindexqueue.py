@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-18
+
+import auto_prefetch
+import django.db.models.deletion
+import django.db.models.manager
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0081_articlerating_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queued_at', models.DateTimeField(verbose_name='Время постановки в очередь')),
+                ('requested_at', models.DateTimeField(verbose_name='Время последнего запроса')),
+                ('claimed_until', models.DateTimeField(null=True, verbose_name='Обрабатывается до')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Число попыток')),
+                ('article', auto_prefetch.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='web.article', verbose_name='Статья')),
+            ],
+            options={
+                'verbose_name': 'Очередь индексации поиска',
+                'verbose_name_plural': 'Очередь индексации поиска',
+                'abstract': False,
+                'base_manager_name': 'prefetch_manager',
+                'indexes': [models.Index(fields=['queued_at'], name='web_searchi_queued__1816ee_idx')],
+            },
+            managers=[
+                ('objects', django.db.models.manager.Manager()),
+                ('prefetch_manager', django.db.models.manager.Manager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18
+
+import auto_prefetch
+import django.db.models.deletion
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0082_searchindexqueue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='articleversion',
+            name='base',
+            field=auto_prefetch.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='web.articleversion', verbose_name='Базовая версия'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0083_articleversion_base_restrict'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchindexqueue',
+            name='failed_at',
+            field=models.DateTimeField(null=True, verbose_name='Индексация прекращена'),
+        ),
+    ]
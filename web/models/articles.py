@@ -6,6 +6,7 @@ __all__ = [
     'ArticleVersion',
     'ArticleLogEntry',
     'Vote',
+    'ArticleRating',
     'ExternalLink'
 ]
 
@@ -20,11 +21,12 @@ from django.core.validators import RegexValidator
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from web import identity_map
 from web.fields import CITextField
 from web.util import uuid4_str
+from web.util.text_delta import make_delta, apply_delta, compress, decompress, encode_delta, decode_delta
 from .roles import Role, PermissionsOverrideMixin, RolePermissionsOverrideMixin
-from .settings import Settings
-from .site import get_current_site
+from .site import get_current_site, get_merged_settings
 
 
 User = get_user_model()
@@ -119,17 +121,15 @@ class Category(auto_prefetch.Model, RolePermissionsOverrideMixin):
     # if neither is set, falls back to defaults defined in Settings class.
     @cached_property
     def settings(self):
-        category_settings = Settings.objects.filter(category=self).first()
-        site_settings = get_current_site().settings
-        return Settings.get_default_settings().merge(site_settings).merge(category_settings)
+        return get_merged_settings(get_current_site(), self.name)
     
     @staticmethod
     def get_or_default_category(category):
-        cat = Category.objects.filter(name=category)
+        cat = identity_map.get_or_load('category', category.lower(), lambda: Category.objects.filter(name=category).first())
         if not cat:
             return Category(name=category)
         else:
-            return cat[0]
+            return cat
 
 
 class Article(auto_prefetch.Model, PermissionsOverrideMixin):
@@ -140,8 +140,6 @@ class Article(auto_prefetch.Model, PermissionsOverrideMixin):
         constraints = [models.UniqueConstraint(fields=['category', 'name'], name='%(app_label)s_%(class)s_unique')]
         indexes = [models.Index(fields=['category']), models.Index(fields=['name']), models.Index(fields=['complete_full_name']), models.Index(fields=['created_at']), models.Index(fields=['updated_at'])]
 
-    roles_override_pipeline = ['category_as_object']
-
     category = CITextField('Категория', default='_default')
     name = CITextField('Имя')
     complete_full_name = models.GeneratedField(
@@ -164,13 +162,15 @@ class Article(auto_prefetch.Model, PermissionsOverrideMixin):
 
     media_name = models.TextField('Название папки с файлами в ФС-хранилище', unique=True, default=uuid4_str)
 
+    # denormalized from versions and log entries, written with .update() by add_log_entry and refresh_latest_version
+    latest_version = auto_prefetch.ForeignKey('ArticleVersion', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='Текущая версия')
+    latest_rev_number = models.PositiveIntegerField('Номер последней правки', null=True, blank=True)
+    last_editor = auto_prefetch.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='Автор последней правки')
+
+    # same as settings of category_as_object, but doesn't fetch the category
     @cached_property
     def settings(self):
-        if self.category_as_object:
-            return self.category_as_object.settings
-        else:
-            site_settings = get_current_site().settings
-            return Settings.get_default_settings().merge(site_settings)
+        return get_merged_settings(get_current_site(), self.category)
 
     @property
     def full_name(self) -> str:
@@ -184,11 +184,22 @@ class Article(auto_prefetch.Model, PermissionsOverrideMixin):
     
     @cached_property
     def category_as_object(self) -> Optional[Category]:
-        return Category.objects.filter(name=self.category).first()
+        return identity_map.get_or_load('category', self.category.lower(), lambda: Category.objects.filter(name=self.category).first())
 
     def __str__(self) -> str:
         return f'{self.title} ({self.full_name})'
     
+    # same as overriding through category_as_object, but doesn't fetch the category
+    def override_role(self, user_obj, perms: set, role=None):
+        if not role:
+            return perms
+        from web.permissions.matrix import get_permissions_matrix
+        matrix = get_permissions_matrix(user_obj)
+        category_id = matrix.category_ids.get(self.category.lower())
+        if category_id is None:
+            return perms
+        return matrix.override_role(Category, category_id, perms, role)
+
     def override_perms(self, user_obj, perms: set, roles=[]):
         if self.locked:
             if 'roles.lock_articles' not in perms:
@@ -206,8 +217,18 @@ class ArticleVersion(auto_prefetch.Model):
 
         indexes = [models.Index(fields=['article', 'created_at'])]
 
+    class Storage(models.TextChoices):
+        Full = ('full', 'Полный текст')
+        Compressed = ('compressed', 'Сжатый текст')
+        Delta = ('delta', 'Разница с базовой версией')
+
     article = auto_prefetch.ForeignKey(Article, on_delete=models.CASCADE, verbose_name='Статья', related_name='versions')
-    source = models.TextField('Исходник')
+    # use `source` to read and write the text, these store it in the way `storage` says
+    stored_source = models.TextField('Исходник', db_column='source', blank=True)
+    stored_data = models.BinaryField('Сжатый исходник или разница', null=True, blank=True)
+    storage = models.TextField('Способ хранения', choices=Storage.choices, default=Storage.Full)
+    # a delta can't be decoded without its base, so a base can only be deleted together with its article
+    base = auto_prefetch.ForeignKey('self', on_delete=models.RESTRICT, null=True, blank=True, related_name='+', verbose_name='Базовая версия')
     ast = models.JSONField('AST-дерево статьи', blank=True, null=True)
     rendered = models.TextField('Рендер статьи', blank=True, null=True)
     created_at = models.DateTimeField('Время создания', auto_now_add=True)
@@ -215,6 +236,70 @@ class ArticleVersion(auto_prefetch.Model):
     def __str__(self) -> str:
         return f'{self.created_at.strftime('%Y-%m-%d, %H:%M:%S')} - {self.article}'
 
+    @property
+    def source(self) -> str:
+        decoded = self.__dict__.get('_decoded_source')
+        if decoded is None:
+            decoded = self._decode_source()
+        return decoded
+
+    @source.setter
+    def source(self, value: str):
+        self.stored_source = value
+        self.stored_data = None
+        self.storage = ArticleVersion.Storage.Full
+        self.base = None
+        self._decoded_source = value
+
+    def _decode_source(self) -> str:
+        if self.storage == ArticleVersion.Storage.Full:
+            decoded = self.stored_source
+        elif self.storage == ArticleVersion.Storage.Compressed:
+            decoded = decompress(self.stored_data).decode('utf-8')
+        else:
+            # deltas point to newer versions; walk to the nearest one that has the text, then apply deltas back.
+            # newer versions of the article are fetched at once, as that's where the chain almost always goes
+            known = None
+            chain = [self]
+            while chain[-1].storage == ArticleVersion.Storage.Delta and '_decoded_source' not in chain[-1].__dict__:
+                current = chain[-1]
+                if ArticleVersion.base.is_cached(current):
+                    chain.append(current.base)
+                    continue
+                if known is None:
+                    newer = ArticleVersion.objects\
+                        .filter(article_id=self.article_id, created_at__gte=self.created_at)\
+                        .exclude(pk=self.pk)\
+                        .order_by('created_at')[:64]
+                    known = {version.pk: version for version in newer}
+                chain.append(known[current.base_id] if current.base_id in known else ArticleVersion.objects.get(pk=current.base_id))
+            decoded = chain[-1].source
+            for version in reversed(chain[:-1]):
+                decoded = apply_delta(decoded, decode_delta(version.stored_data))
+                version._decoded_source = decoded
+        self._decoded_source = decoded
+        return decoded
+
+    # These change how the text is stored, without changing the text. Caller saves the version.
+    def store_full(self):
+        self.source = self.source
+
+    def store_compressed(self, compression: str):
+        source = self.source
+        self.stored_data = compress(source.encode('utf-8'), compression)
+        self.stored_source = ''
+        self.storage = ArticleVersion.Storage.Compressed
+        self.base = None
+
+    def store_as_delta(self, base: 'ArticleVersion', compression: str):
+        source = self.source
+        self.stored_data = encode_delta(make_delta(base.source, source), compression)
+        self.stored_source = ''
+        self.storage = ArticleVersion.Storage.Delta
+        self.base = base
+
+    storage_fields = ['stored_source', 'stored_data', 'storage', 'base']
+
 
 class ArticleLogEntry(auto_prefetch.Model):
     class Meta(auto_prefetch.Model.Meta):
@@ -268,6 +353,36 @@ class Vote(auto_prefetch.Model):
         return f'{self.article}: {self.user} - {self.rate}'
 
 
+# Vote stats of an article, kept up to date by web.controllers.articles whenever votes change.
+# Stats for every rating mode are stored, as the mode depends on settings that may change independently.
+# Every article has one, so that ListPages can sort and filter by these with an inner join.
+class ArticleRating(auto_prefetch.Model):
+    class Meta(auto_prefetch.Model.Meta):
+        verbose_name = 'Рейтинг статьи'
+        verbose_name_plural = 'Рейтинги статей'
+
+        indexes = [
+            models.Index(fields=['sum_rate']),
+            models.Index(fields=['avg_rate']),
+            models.Index(fields=['count_rate']),
+            models.Index(fields=['popularity_updown']),
+            models.Index(fields=['popularity_stars'])
+        ]
+
+    article = auto_prefetch.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True, verbose_name='Статья', related_name='rating_stats')
+    sum_rate = models.FloatField('Сумма оценок', default=0)
+    avg_rate = models.FloatField('Средняя оценка', default=0)
+    count_rate = models.PositiveIntegerField('Количество оценок', default=0)
+    good_updown = models.PositiveIntegerField('Количество положительных оценок', default=0)
+    good_stars = models.PositiveIntegerField('Количество оценок от 3 звёзд', default=0)
+    # percentage of good votes, for each rating mode
+    popularity_updown = models.PositiveIntegerField('Популярность (голосование за/против)', default=0)
+    popularity_stars = models.PositiveIntegerField('Популярность (звёзды)', default=0)
+
+    def __str__(self) -> str:
+        return f'{self.article}: {self.sum_rate} ({self.count_rate})'
+
+
 class ExternalLink(auto_prefetch.Model):
     class Meta(auto_prefetch.Model.Meta):
         verbose_name = 'Связь'
@@ -207,6 +207,62 @@ class RolePermissionsOverride(auto_prefetch.Model):
     restrictions = models.ManyToManyField(Permission, related_name='override_role_restrictions_set', blank=True)
 
 
+# Same as ordering visual roles by index and keeping only the first one of each (mode, category) pair.
+# Works on already fetched roles, so that tails of many users can be built from one prefetch query.
+def get_name_tail_roles(roles):
+    visual_roles = sorted([role for role in roles if role.inline_visual_mode != Role.InlineVisualMode.Hidden], key=lambda role: role.index)
+    seen_categories = set()
+    result = []
+
+    for role in visual_roles:
+        if role.category_id is not None:
+            typed_category = (role.inline_visual_mode, role.category_id)
+            if typed_category in seen_categories:
+                continue
+            seen_categories.add(typed_category)
+        result.append(role)
+
+    return result
+
+
+def get_banned_user_badge():
+    return RoleBadgeJSON(
+        text='БАН',
+        bg='#000000',
+        text_color="#FFFFFF",
+        show_border=False,
+        tooltip='Пользователь заблокирован'
+    )
+
+
+def get_bot_user_badge():
+    return RoleBadgeJSON(
+        text='БОТ',
+        bg='#77A',    #a1abca    #737d9b    #4463bf
+        text_color='#FFFFFF',
+        show_border=False,
+        tooltip='Машинный болван'
+    )
+
+
+def get_name_tails(roles):
+    badges = []
+    icons = []
+
+    for role in get_name_tail_roles(roles):
+        tail = role.get_name_tail()
+        if tail:
+            if isinstance(tail, RoleBadgeJSON):
+                badges.append(tail)
+            else:
+                icons.append(tail)
+
+    return {
+        'badges': badges,
+        'icons': icons
+    }
+
+
 class RolesMixin(models.Model):
     class Meta:
         abstract = True
@@ -249,47 +305,15 @@ class RolesMixin(models.Model):
     def name_tails(self):
         if not self.is_active and not self.type == self.UserType.Wikidot: # type: ignore
             return {
-                'badges': [RoleBadgeJSON(
-                    text='БАН',
-                    bg='#000000',
-                    text_color="#FFFFFF",
-                    show_border=False,
-                    tooltip='Пользователь заблокирован'
-                )],
+                'badges': [get_banned_user_badge()],
                 'icons': []
             }
         elif self.type == self.UserType.Bot: # type: ignore
             return {
-                'badges': [RoleBadgeJSON(
-                    text='БОТ',
-                    bg='#77A',    #a1abca    #737d9b    #4463bf
-                    text_color='#FFFFFF',
-                    show_border=False,
-                    tooltip='Машинный болван'
-                )],
+                'badges': [get_bot_user_badge()],
                 'icons': []
             }
-        visual_roles = self.roles.all() \
-        .exclude(inline_visual_mode=Role.InlineVisualMode.Hidden) \
-        .annotate(typed_category=models.functions.ConcatPair(models.F('inline_visual_mode'), models.F('category_id'), output_field=models.CharField())).order_by('typed_category', 'index')
-        catigorized_candidates = visual_roles.exclude(category__isnull=True).distinct('typed_category')
-        uncatigorized_candidates = visual_roles.filter(category__isnull=True)
-        candidates = catigorized_candidates.union(uncatigorized_candidates).order_by('index')
-        badges = []
-        icons = []
-
-        for role in candidates:
-            tail = role.get_name_tail()
-            if tail:
-                if isinstance(tail, RoleBadgeJSON):
-                    badges.append(tail)
-                else:
-                    icons.append(tail)
-        
-        return {
-            'badges': badges,
-            'icons': icons
-        }
+        return get_name_tails(self.roles.all())
     
     
     @cached_property
@@ -373,16 +397,8 @@ class RolePermissionsOverrideMixin(models.Model, PermissionsOverrideMixin):
     def override_role(self, user_obj, perms: set, role=None):
         if not role or not self.pk:
             return perms
-        for perm_override in self.permissions_override.all().filter(role=role):
-            for perm in perm_override.permissions.all():
-                codename = f'roles.{perm.codename}'
-                perms.add(codename)
-            for perm in perm_override.restrictions.all():
-                codename = f'roles.{perm.codename}'
-                if codename in perms:
-                    perms.remove(codename)
-            break
-        return perms
+        from web.permissions.matrix import get_permissions_matrix
+        return get_permissions_matrix(user_obj).override_role(self.__class__, self.pk, perms, role)
     
 
 class ProtectSensitiveAdmin(admin.ModelAdmin):
@@ -1,5 +1,6 @@
 __all__ = [
-    'ArticleSearchIndex'
+    'ArticleSearchIndex',
+    'SearchIndexQueue'
 ]
 
 import auto_prefetch
@@ -37,3 +38,26 @@ class ArticleSearchIndex(auto_prefetch.Model):
 
     def __str__(self):
         return f"Index ({str(self.article)})"
+
+
+# Articles whose search index is to be updated by the searchworker command, one row per article.
+# queued_at is when the article started to wait (for lag), requested_at is the latest edit since then.
+class SearchIndexQueue(auto_prefetch.Model):
+    class Meta(auto_prefetch.Model.Meta):
+        verbose_name = "Очередь индексации поиска"
+        verbose_name_plural = "Очередь индексации поиска"
+
+        indexes = [
+            models.Index(fields=['queued_at']),
+        ]
+
+    article = auto_prefetch.OneToOneField(Article, on_delete=models.CASCADE, verbose_name="Статья")
+    queued_at = models.DateTimeField(verbose_name="Время постановки в очередь")
+    requested_at = models.DateTimeField(verbose_name="Время последнего запроса")
+    claimed_until = models.DateTimeField(null=True, verbose_name="Обрабатывается до")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Число попыток")
+    # set when the article failed to index too many times; it's not retried until it's queued again
+    failed_at = models.DateTimeField(null=True, verbose_name="Индексация прекращена")
+
+    def __str__(self):
+        return f"Queued index ({str(self.article)})"
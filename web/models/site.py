@@ -1,6 +1,10 @@
 __all__ = [
     'Site',
-    'get_current_site'
+    'get_current_site',
+    'get_site_by_host',
+    'get_site_domains',
+    'get_merged_settings',
+    'invalidate_sites_cache'
 ]
 
 from functools import cached_property
@@ -9,7 +13,8 @@ from typing import Literal, Optional, overload
 from solo.models import SingletonModel
 from django.db import models
 
-from web import threadvars
+from web import threadvars, identity_map
+from web.util.versioned_cache import VersionedCache
 from .settings import Settings
 
 
@@ -34,7 +39,7 @@ class Site(SingletonModel):
 
     @cached_property
     def settings(self):
-        return Settings.objects.filter(site=self).first() or Settings.get_default_settings()
+        return _get_sites_config().site_settings.get(self.pk) or Settings.get_default_settings()
 
     def __str__(self) -> str:
         return f'{self.title} ({self.domain})'
@@ -51,3 +56,65 @@ def get_current_site(required: bool=True) -> Optional[Site]:
     if site is None and required:
         raise ValueError('There is no current site while it was required')
     return site
+
+
+# Sites and settings are needed by every request (host routing, CSRF origins, rating modes) and only change
+# through the admin, so all of them are loaded at once and kept in every worker until something changes
+# (see web/events/sites_cache.py).
+class SitesConfig(object):
+    def __init__(self):
+        sites = list(Site.objects.order_by('pk'))
+        self.domains = [site.domain for site in sites]
+        self.sites_by_host: dict[str, Site] = {}
+        for site in sites:
+            self.sites_by_host.setdefault(site.domain, site)
+        for site in sites:
+            self.sites_by_host.setdefault(site.media_domain, site)
+
+        self.site_settings: dict[int, Settings] = {}
+        # lowercase category name -> settings of that category
+        self.category_settings: dict[str, Settings] = {}
+        for row in Settings.objects.select_related('category'):
+            if row.site_id is not None:
+                self.site_settings[row.site_id] = row
+            elif row.category_id is not None:
+                self.category_settings[row.category.name.lower()] = row
+
+        self._merged: dict[tuple[int, Optional[str]], Settings] = {}
+
+    def get_merged_settings(self, site: Site, category: Optional[str]) -> Settings:
+        key = (site.pk, category.lower() if category is not None else None)
+        merged = self._merged.get(key)
+        if merged is None:
+            merged = Settings.get_default_settings().merge(self.site_settings.get(site.pk) or Settings.get_default_settings())
+            if key[1] is not None:
+                merged = merged.merge(self.category_settings.get(key[1]))
+            self._merged[key] = merged
+        return merged
+
+
+_sites_cache = VersionedCache('sites')
+
+
+def _get_sites_config() -> SitesConfig:
+    # the version of the shared cache is checked once per request
+    return identity_map.get_or_load('sites_config', None, lambda: _sites_cache.get('config', SitesConfig))
+
+
+# Finds the site that serves this host, either as the domain of articles or of files
+def get_site_by_host(host: str) -> Optional[Site]:
+    return _get_sites_config().sites_by_host.get(host)
+
+
+def get_site_domains() -> list[str]:
+    return _get_sites_config().domains
+
+
+# Default settings, overridden by site settings and then by settings of the category (if any).
+# Returned object is shared, it must not be changed.
+def get_merged_settings(site: Site, category: Optional[str]=None) -> Settings:
+    return _get_sites_config().get_merged_settings(site, category)
+
+
+def invalidate_sites_cache():
+    _sites_cache.invalidate()
@@ -2,6 +2,30 @@ from django.contrib.auth.backends import BaseBackend
 
 from web.models.roles import Role, PermissionsOverrideMixin
 from web.permissions import _ROLE_PERMISSIONS_REPR_CACHE
+from web.permissions.matrix import get_permissions_matrix
+
+
+def get_user_roles(user_obj) -> list[Role]:
+    roles_cache = getattr(user_obj, '_roles_cache', None)
+    if roles_cache is None:
+        roles_cache = [Role.get_or_create_default_role()]
+        if not user_obj.is_anonymous:
+            roles_cache.append(Role.get_or_create_registered_role())
+            roles_cache.extend(user_obj.roles.all().order_by('-index'))
+        user_obj._roles_cache = roles_cache
+    return roles_cache
+
+
+# Gets a string that is identical for all users that are guaranteed to have the same permissions.
+# This is used as a part of cache keys for anything that depends on who is looking at it.
+def get_permissions_fingerprint(user_obj) -> str:
+    if user_obj is None or user_obj.is_anonymous:
+        return 'anonymous'
+    if not user_obj.is_active:
+        return 'inactive'
+    if user_obj.is_superuser:
+        return 'superuser'
+    return 'roles:%s' % ','.join(sorted(str(role.pk) for role in get_user_roles(user_obj)))
 
 
 class RolesBackend(BaseBackend):
@@ -10,24 +34,17 @@ class RolesBackend(BaseBackend):
         if not user_obj.is_active and not user_obj.is_anonymous:
             return set()
 
-        roles_cache = getattr(user_obj, '_roles_cache', None)
-        if roles_cache is None:
-            roles_cache = [Role.get_or_create_default_role()]
-            if not user_obj.is_anonymous:
-                roles_cache.append(Role.get_or_create_registered_role())
-                roles_cache.extend(user_obj.roles.all().order_by('-index'))
-            user_obj._roles_cache = roles_cache
+        roles_cache = get_user_roles(user_obj)
+        matrix = get_permissions_matrix(user_obj)
 
         perms = set()
         has_override = isinstance(obj, PermissionsOverrideMixin)
 
         for role in roles_cache:
-            role_perms = {f'roles.{p.codename}' for p in role.permissions.all()}
-            role_restricts = {f'roles.{p.codename}' for p in role.restrictions.all()}
-            role_final = role_perms - role_restricts
+            role_final = matrix.get_role_permissions(role)
 
             if has_override:
-                role_final = obj.override_role(user_obj, role_final, role)
+                role_final = obj.override_role(user_obj, set(role_final), role)
 
             perms.update(role_final)
 
@@ -38,20 +55,21 @@ class RolesBackend(BaseBackend):
     
     def has_perm(self, user_obj, perm, obj: PermissionsOverrideMixin=None):
         is_cachable = obj is None or (obj.pk if hasattr(obj, 'pk') else (hasattr(obj, '__hash__') and obj.__hash__ is not None))
-        if is_cachable and hasattr(user_obj, '_roles_perms_cache') and (obj, perm) in user_obj._roles_perms_cache:
-            return user_obj._roles_perms_cache[(obj, perm)]
-        else:
-            user_obj._roles_perms_cache = {}
+        perms_cache = getattr(user_obj, '_roles_perms_cache', None)
+        if perms_cache is None:
+            perms_cache = user_obj._roles_perms_cache = {}
+        if is_cachable and (obj, perm) in perms_cache:
+            return perms_cache[(obj, perm)]
         all_perms = self.get_all_permissions(user_obj, obj)
         if perm in _ROLE_PERMISSIONS_REPR_CACHE:
             for role_perm in _ROLE_PERMISSIONS_REPR_CACHE[perm]:
                 if role_perm in all_perms:
                     if is_cachable:
-                        user_obj._roles_perms_cache[(obj, perm)] = True
+                        perms_cache[(obj, perm)] = True
                     return True
         result = perm in all_perms
         if is_cachable:
-            user_obj._roles_perms_cache[(obj, perm)] = result
+            perms_cache[(obj, perm)] = result
         return result
     
     def has_module_perms(self, user_obj, app_label):
@@ -0,0 +1,92 @@
+# Permissions of all roles and all role overrides, compiled into plain sets.
+#
+# Checking a permission used to go through permissions and restrictions of every role of the user (and of
+# every override on the object) in the database. These change only through the admin, so they are compiled
+# once per process and shared by all requests, until something changes them (see web/events/permissions_cache.py).
+# Overrides that are computed from fields of the object itself (locked articles, hidden forum sections,
+# authors of threads) are not stored anywhere and stay in override_perms of the models.
+from typing import Optional
+
+from django.apps import apps
+
+from web.models.roles import Role, RolePermissionsOverride, RolePermissionsOverrideMixin
+from web.util.versioned_cache import VersionedCache
+
+
+def _codenames(permissions) -> frozenset[str]:
+    return frozenset(f'roles.{p.codename}' for p in permissions)
+
+
+def get_role_permissions_from_db(role: Role) -> frozenset[str]:
+    return _codenames(role.permissions.all()) - _codenames(role.restrictions.all())
+
+
+class PermissionsMatrix(object):
+    def __init__(self):
+        # role id -> permissions minus restrictions
+        self.role_permissions: dict[int, frozenset[str]] = {}
+        # (model label, object id) -> role id -> (added permissions, removed permissions)
+        self.overrides: dict[tuple[str, int], dict[int, tuple[frozenset[str], frozenset[str]]]] = {}
+        # lowercase category name -> category id, so that articles don't need to fetch their category
+        self.category_ids: dict[str, int] = {}
+
+    def get_role_permissions(self, role: Role) -> frozenset[str]:
+        perms = self.role_permissions.get(role.pk)
+        if perms is None:
+            # created after the matrix was compiled, in a transaction that is not committed yet
+            perms = get_role_permissions_from_db(role)
+        return perms
+
+    def override_role(self, model, obj_id: int, perms: set, role: Role) -> set:
+        override = self.overrides.get((model._meta.label, obj_id), {}).get(role.pk)
+        if override is None:
+            return perms
+        added, removed = override
+        return (perms | added) - removed
+
+
+def compile_permissions_matrix() -> PermissionsMatrix:
+    from web.models.articles import Category
+
+    matrix = PermissionsMatrix()
+
+    for role in Role.objects.prefetch_related('permissions', 'restrictions'):
+        matrix.role_permissions[role.pk] = _codenames(role.permissions.all()) - _codenames(role.restrictions.all())
+
+    role_overrides = {}
+    for override in RolePermissionsOverride.objects.prefetch_related('permissions', 'restrictions').order_by('id'):
+        role_overrides[override.pk] = (override.role_id, _codenames(override.permissions.all()), _codenames(override.restrictions.all()))
+
+    for model in apps.get_models():
+        if not issubclass(model, RolePermissionsOverrideMixin):
+            continue
+        field = model._meta.get_field('permissions_override')
+        through = field.remote_field.through
+        links = through.objects.values_list(f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id').order_by(f'{field.m2m_reverse_field_name()}_id')
+        for obj_id, override_id in links:
+            role_id, added, removed = role_overrides[override_id]
+            # only the first override of a role is applied, same as it always was
+            matrix.overrides.setdefault((model._meta.label, obj_id), {}).setdefault(role_id, (added, removed))
+
+    for name, category_id in Category.objects.values_list('name', 'id'):
+        matrix.category_ids[name.lower()] = category_id
+
+    return matrix
+
+
+_matrix_cache = VersionedCache('permissions_matrix')
+
+
+# The matrix is remembered on the user object, so that all checks within one request use the same one
+# and the shared cache is asked for the version only once.
+def get_permissions_matrix(user_obj=None) -> PermissionsMatrix:
+    matrix: Optional[PermissionsMatrix] = getattr(user_obj, '_permissions_matrix', None)
+    if matrix is None:
+        matrix = _matrix_cache.get('matrix', compile_permissions_matrix)
+        if user_obj is not None:
+            user_obj._permissions_matrix = matrix
+    return matrix
+
+
+def invalidate_permissions_matrix():
+    _matrix_cache.invalidate()
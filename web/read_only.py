@@ -0,0 +1,123 @@
+# Read-only requests.
+#
+# Anonymous page views are the bulk of the traffic and never change anything, so with READ_ONLY_FAST_PATH they
+# don't get the transaction that ATOMIC_REQUESTS opens for every other view, and their queries can go to a read
+# replica (READ_ONLY_DATABASE). With READ_ONLY_WRITE_GUARD (on with DEBUG), any write query made by such request
+# raises an error, which is how accidental writes on this path are found (see web/tests/test_read_only.py and the
+# checkreadonly command).
+import logging
+import threading
+from contextlib import contextmanager, ExitStack
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from web import threadvars
+
+
+_DATABASE_KEY = 'read_only_database'
+_GUARD_KEY = 'read_only_guard'
+
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'CREATE', 'ALTER', 'DROP', 'TRUNCATE')
+
+
+class WriteInReadOnlyRequestError(Exception):
+    pass
+
+
+def is_read_only_request(request) -> bool:
+    return settings.READ_ONLY_FAST_PATH and request.method in ('GET', 'HEAD') and request.user.is_anonymous
+
+
+def _is_write(sql: str) -> bool:
+    statement = sql.lstrip().upper()
+    return statement.startswith(_WRITE_STATEMENTS) or (statement.startswith('SELECT') and ' FOR UPDATE' in statement)
+
+
+_violations = 0
+_violations_lock = threading.Lock()
+
+
+# Number of writes caught so far. Modules report their errors in the page instead of raising,
+# so the exception alone is not enough to tell whether a request tried to write.
+def get_violation_count() -> int:
+    return _violations
+
+
+def _write_guard(execute, sql, params, many, context):
+    global _violations
+    if threadvars.get(_GUARD_KEY) and _is_write(sql):
+        with _violations_lock:
+            _violations += 1
+        logging.error('Write query in a read-only request: %s', sql)
+        raise WriteInReadOnlyRequestError('Write query in a read-only request: %s' % sql)
+    return execute(sql, params, many, context)
+
+
+# Everything inside reads from READ_ONLY_DATABASE and, with READ_ONLY_WRITE_GUARD, must not write.
+@contextmanager
+def read_only():
+    with threadvars.context():
+        threadvars.put(_DATABASE_KEY, settings.READ_ONLY_DATABASE)
+        if settings.READ_ONLY_WRITE_GUARD:
+            threadvars.put(_GUARD_KEY, True)
+        with guard_writes():
+            yield
+
+
+# Installs the write guard on connections of this thread if the current context is guarded.
+# Connections are per thread, so threads that work for a read-only request (see renderer.executor) need this too.
+@contextmanager
+def guard_writes():
+    with ExitStack() as stack:
+        if threadvars.get(_GUARD_KEY):
+            for alias in {DEFAULT_DB_ALIAS, settings.READ_ONLY_DATABASE}:
+                stack.enter_context(connections[alias].execute_wrapper(_write_guard))
+        yield
+
+
+# Everything inside reads from the primary database and may write, even within read_only().
+# Values that outlive the request (process-wide caches) must be loaded like this, since a replica may lag behind.
+@contextmanager
+def primary():
+    with threadvars.context():
+        threadvars.put(_DATABASE_KEY, None)
+        threadvars.put(_GUARD_KEY, False)
+        yield
+
+
+def get_read_database() -> str:
+    return threadvars.get(_DATABASE_KEY) or DEFAULT_DB_ALIAS
+
+
+# WAL position of the primary database, or None if reads never go to a replica.
+# Everything committed before the call is visible on a replica that has replayed up to this position.
+def get_primary_position() -> Optional[str]:
+    if settings.READ_ONLY_DATABASE == DEFAULT_DB_ALIAS:
+        return None
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute('SELECT pg_current_wal_lsn()::text')
+        return cursor.fetchone()[0]
+
+
+# Whether database `alias` has replayed everything up to all of `positions` (see get_primary_position)
+def has_replayed(alias: str, positions: list[str]) -> bool:
+    if alias == DEFAULT_DB_ALIAS or not positions:
+        return True
+    with connections[alias].cursor() as cursor:
+        # the replay position is NULL on a database that is not a standby
+        cursor.execute('SELECT COALESCE(pg_last_wal_replay_lsn() >= ALL(%s::pg_lsn[]), true)', [positions])
+        return cursor.fetchone()[0]
+
+
+class ReadOnlyRouter(object):
+    def db_for_read(self, model, **hints):
+        return get_read_database()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    # replica holds the same rows as the primary database
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
@@ -250,6 +250,7 @@ def run(base_path):
             revisions = list(reversed(meta['revisions']))
 
             last_source_version = None
+            source_versions_count = 0
 
             with py7zr.SevenZipFile(fn_7z) as z:
                 all_file_names = ['%d.txt' % x['revision'] for x in revisions if 'S' in x['flags'] or 'N' in x['flags']]
@@ -280,7 +281,10 @@ def run(base_path):
                             rendered=None,
                         )
                         version.save()
+                        if last_source_version is not None:
+                            articles.compact_version(last_source_version, version, source_versions_count - 1)
                         last_source_version = version
+                        source_versions_count += 1
                         log.meta = {'version_id': version.id}
                         if 'N' in revision['flags']:
                             log.type = ArticleLogEntry.LogEntryType.New
@@ -295,6 +299,9 @@ def run(base_path):
                             logging.info('Added: %d/%d (revisions: %d/%d)' % (total_cnt, total_pages, total_cnt_rev, total_revisions))
                             t = time.time()
 
+            # history was written directly, bypassing add_log_entry
+            articles.refresh_latest_version(article)
+
             if last_source_version:
                 # to-do reenable once this stops hanging up forever
                 articles.refresh_article_links(last_source_version)
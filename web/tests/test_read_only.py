@@ -0,0 +1,54 @@
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from web import threadvars
+from web.controllers import articles
+from web.models import Site
+from web.models.forum import ForumThread
+from web.read_only import get_violation_count
+
+
+PAGE_SOURCE = '''
+[[module Rate]]
+
+[[module ListPages category="_default" order="rating" perPage="5"]]
+%%title_linked%% %%rating%% %%created_by%%
+[[/module]]
+
+[[module CountPages category="_default"]]
+%%count%%
+[[/module]]
+'''
+
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+# Anonymous page views are served as read-only requests (see web/read_only.py);
+# checkreadonly does the same over the pages of a real database.
+# TransactionTestCase, so that the view runs outside of a transaction like it does in production.
+@override_settings(READ_ONLY_FAST_PATH=True, READ_ONLY_WRITE_GUARD=True, RENDER_CACHE_ENABLED=False, RENDER_EXECUTOR='inline')
+class ReadOnlyPageViewTest(TransactionTestCase):
+    def setUp(self):
+        self.site = Site.objects.create(slug='test', title='Test', headline='Test', domain='testserver', media_domain='media.testserver')
+        with threadvars.context():
+            threadvars.put('current_site', self.site)
+            for name, source in [('other-page', 'Other page'), ('test-page', PAGE_SOURCE)]:
+                articles.create_article(name)
+                articles.create_article_version(name, source)
+
+    def test_anonymous_view_does_not_write(self):
+        threads = ForumThread.objects.count()
+        violations = get_violation_count()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/test-page', HTTP_HOST=self.site.domain)
+
+        self.assertEqual(response.status_code, 200)
+        # listed by ListPages
+        self.assertContains(response, 'other-page')
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].lstrip().upper().startswith(_WRITE_STATEMENTS)]
+        self.assertEqual(writes, [])
+        # modules report errors in the page, including the write guard's, so count what the guard caught too
+        self.assertEqual(get_violation_count(), violations)
+        self.assertEqual(ForumThread.objects.count(), threads)
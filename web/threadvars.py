@@ -44,6 +44,15 @@ def get(key, default=None):
         return default
 
 
+# Values of the current thread, for passing them to another thread. Values themselves are not copied.
+def snapshot():
+    with _CONTEXTS_LOCK:
+        t = threading.current_thread().ident
+        if t in _CONTEXTS:
+            return {k: v for k, v in _CONTEXTS[t].items() if k != '__parent'}
+        return dict()
+
+
 def put(key, value):
     with _CONTEXTS_LOCK:
         t = threading.current_thread().ident
@@ -45,7 +45,10 @@ def make_reactive(routes: list[str]):
 
 api_patterns = [
     path('users', users.AllUsersView.as_view()),
+    path('users/search', users.SearchUsersView.as_view()),
+    path('users/lookup', users.LookupUsersView.as_view()),
     path('admin/sus', users.AdminSusActivityApiView.as_view()),
+    path('admin/search-queue', search.SearchQueueStatsView.as_view()),
     path('articles', articles.AllArticlesView.as_view()),
     path('articles/new', articles.CreateView.as_view()),
     path('articles/<str:full_name>/version', articles.FetchVersionView.as_view()),
@@ -0,0 +1,58 @@
+import logging
+import os
+
+from django.conf import settings
+from django.db import connections
+
+
+# Threads of the main process that keep their own connection for as long as they live (shared_data workers)
+BACKGROUND_THREADS = 2
+
+
+def get_web_workers() -> int:
+    return int(os.environ.get('GUNICORN_WORKERS', '1'))
+
+
+# Upper bound of database connections opened by the server with the current settings
+def get_expected_connections() -> dict[str, int]:
+    threads_per_worker = 1
+    if settings.RENDER_EXECUTOR == 'threads':
+        threads_per_worker += settings.RENDER_WORKERS
+
+    result = {}
+    for alias, db_settings in settings.DATABASES.items():
+        pool = db_settings.get('OPTIONS', {}).get('pool')
+        if pool:
+            per_worker = min(pool['max_size'], threads_per_worker)
+        else:
+            per_worker = threads_per_worker
+        result[alias] = get_web_workers() * per_worker + (BACKGROUND_THREADS if alias == 'default' else 0)
+    return result
+
+
+def log_connections_report():
+    for alias, count in get_expected_connections().items():
+        db_settings = settings.DATABASES[alias]
+        pool = db_settings.get('OPTIONS', {}).get('pool')
+        if pool:
+            mode = 'pool of %d-%d per worker' % (pool['min_size'], pool['max_size'])
+        elif db_settings.get('CONN_MAX_AGE') is None:
+            mode = 'persistent, kept forever'
+        elif db_settings.get('CONN_MAX_AGE'):
+            mode = 'persistent for %ds' % db_settings['CONN_MAX_AGE']
+        else:
+            mode = 'new connection per request'
+        logging.info('Database \'%s\': up to %d connections (%d web workers, %s)', alias, count, get_web_workers(), mode)
+        max_connections = _get_max_connections(alias)
+        if max_connections is not None and count > max_connections:
+            logging.warning('Database \'%s\' allows only %d connections, requests will fail under load', alias, max_connections)
+
+
+def _get_max_connections(alias: str):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SHOW max_connections')
+            return int(cursor.fetchone()[0])
+    except Exception:
+        logging.warning('Could not read max_connections of database \'%s\'', alias, exc_info=True)
+        return None
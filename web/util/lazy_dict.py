@@ -6,10 +6,13 @@ class LazyDict(Mapping):
     def __init__(self, *args, **kw):
         self._raw_dict = dict(*args, **kw)
         self._values_dict = dict()
+        self._parent = None
 
     def __getitem__(self, key):
         if key in self._values_dict:
             return self._values_dict[key]
+        if key not in self._raw_dict and self._parent is not None:
+            return self._parent[key]
         func = self._raw_dict.__getitem__(key)
         v = func() if callable(func) else func
         self._values_dict[key] = v
@@ -23,8 +26,22 @@ class LazyDict(Mapping):
             pass
         return value
 
+    def __contains__(self, key):
+        return key in self._raw_dict or (self._parent is not None and key in self._parent)
+
     def __iter__(self):
-        return iter(self._raw_dict)
+        if self._parent is None:
+            return iter(self._raw_dict)
+        return iter(self._raw_dict.keys() | set(self._parent))
 
     def __len__(self):
-        return len(self._raw_dict)
\ No newline at end of file
+        if self._parent is None:
+            return len(self._raw_dict)
+        return len(self._raw_dict.keys() | set(self._parent))
+
+    # Returns a dict that reads missing keys from this one. Values computed through it are shared,
+    # while keys set on it are not visible here.
+    def overlay(self) -> 'LazyDict':
+        child = LazyDict()
+        child._parent = self
+        return child
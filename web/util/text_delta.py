@@ -0,0 +1,83 @@
+__all__ = [
+    'make_delta',
+    'apply_delta',
+    'compress',
+    'decompress',
+    'encode_delta',
+    'decode_delta'
+]
+
+import difflib
+import json
+import zlib
+
+
+# Delta is a list of operations that build the target text out of the base text:
+# [start, end] copies base lines start:end, a string is inserted as is.
+# Lines keep their line endings, so joining them gives back the exact text.
+def make_delta(base: str, target: str) -> list:
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    delta = []
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j1 != j2:
+            inserted = ''.join(target_lines[j1:j2])
+            if delta and isinstance(delta[-1], str):
+                delta[-1] += inserted
+            else:
+                delta.append(inserted)
+    return delta
+
+
+def apply_delta(base: str, delta: list) -> str:
+    base_lines = base.splitlines(keepends=True)
+    result = []
+    for op in delta:
+        if isinstance(op, str):
+            result.append(op)
+        else:
+            result.extend(base_lines[op[0]:op[1]])
+    return ''.join(result)
+
+
+def _zstd():
+    try:
+        import pyzstd
+    except ImportError:
+        raise ValueError('zstd compression requires pyzstd package')
+    return pyzstd
+
+
+# Compressed data starts with a byte that tells how it was compressed, so that data written with
+# different settings can be read back regardless of the current ones
+def compress(data: bytes, method: str) -> bytes:
+    if method == 'none':
+        return b'n' + data
+    if method == 'zlib':
+        return b'z' + zlib.compress(data, 9)
+    if method == 'zstd':
+        return b's' + _zstd().compress(data, 19)
+    raise ValueError('Unknown compression method: %s' % method)
+
+
+def decompress(data: bytes) -> bytes:
+    data = bytes(data)
+    method, payload = data[:1], data[1:]
+    if method == b'n':
+        return payload
+    if method == b'z':
+        return zlib.decompress(payload)
+    if method == b's':
+        return _zstd().decompress(payload)
+    raise ValueError('Unknown compression method: %r' % method)
+
+
+def encode_delta(delta: list, method: str) -> bytes:
+    return compress(json.dumps(delta, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), method)
+
+
+def decode_delta(data: bytes) -> list:
+    return json.loads(decompress(data).decode('utf-8'))
@@ -0,0 +1,59 @@
+# Process-local cache of values that are expensive to compute but rarely change, for all workers at once.
+#
+# Values themselves stay in the memory of each worker, but every cache has a version token in the shared
+# cache. Invalidating the cache in one worker replaces the token, and every other worker drops its values
+# the next time it reads from the cache, so no worker serves stale values after the change is committed.
+import threading
+import uuid
+from typing import Callable, Hashable
+
+from django.core.cache import caches
+
+from web import read_only
+
+
+def get_shared_cache():
+    return caches['shared']
+
+
+class VersionedCache(object):
+    def __init__(self, name: str):
+        self.name = name
+        self._values = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _version_key(self) -> str:
+        return 'versioned-cache:%s' % self.name
+
+    def _get_version(self) -> str:
+        cache = get_shared_cache()
+        version = cache.get(self._version_key())
+        if version is None:
+            # missing token (first start, eviction) must not match values computed against an older one
+            cache.add(self._version_key(), uuid.uuid4().hex, None)
+            version = cache.get(self._version_key()) or uuid.uuid4().hex
+        return version
+
+    def get(self, key: Hashable, compute: Callable[[], any]):
+        version = self._get_version()
+        with self._lock:
+            if self._version != version:
+                self._values = {}
+                self._version = version
+            if key in self._values:
+                return self._values[key]
+        # values are shared with all requests, so they are never loaded from a replica that may lag behind
+        with read_only.primary():
+            value = compute()
+        with self._lock:
+            # the cache could have been invalidated while computing; the value may already be stale then
+            if self._version == version:
+                self._values[key] = value
+        return value
+
+    def invalidate(self):
+        get_shared_cache().set(self._version_key(), uuid.uuid4().hex, None)
+        with self._lock:
+            self._values = {}
+            self._version = None
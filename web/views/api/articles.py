@@ -1,10 +1,15 @@
+import datetime
 import logging
 from django.conf import settings
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 
 from modules.sitechanges import log_entry_default_comment
 from shared_data import shared_articles
-from . import APIView, APIError, takes_json
+from shared_data.snapshot import STREAM_CHUNK_SIZE
+from . import APIView, APIError, takes_json, takes_url_params
 
 from web.controllers import articles, notifications
 
@@ -14,21 +19,126 @@ from renderer.parser import RenderContext
 
 import json
 
-from web.controllers.search import update_search_index
+from web.controllers.search import enqueue_search_index
 from web.models.articles import Category, ExternalLink, Article
 
 from modules import rate, ModuleError
 
 
 class AllArticlesView(APIView):
-    def get(self, request: HttpRequest):
-        result = []
+    MAX_LIMIT = 1000
+
+    # Without parameters, returns all articles as an array. With cursor or limit, returns a page of them:
+    # {"results": [...], "cursor": <cursor of the next page, or null>}.
+    # since (ISO date or unix time) leaves only articles updated at that time or later,
+    # fields (comma-separated) leaves only given fields of every article.
+    @takes_url_params
+    def get(self, request: HttpRequest, *, cursor: str=None, limit: int=None, since: str=None, fields: str=None):
+        paginated = cursor is not None or limit is not None
+        catalog = shared_articles.get_catalog()
+        if catalog is None:
+            # not published yet; the response still has the shape that was asked for
+            if paginated:
+                self._parse_cursor(cursor)
+                return self.render_json(200, {'results': [], 'cursor': None})
+            return self.render_json(200, [])
         hidden_categories = articles.get_hidden_categories_for(request.user)
-        for category, entries in shared_articles.get_all_articles().items():
-            if category in hidden_categories:
+        # pages go through categories in this order, see _iter_page
+        visible_categories = sorted(category for category in catalog.sections if category not in hidden_categories)
+
+        # the same for every catalog with the same visible articles, even if it has been published again since
+        etag = quote_etag(catalog.get_digest(visible_categories))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        if paginated or since is not None or fields is not None:
+            position = self._parse_cursor(cursor)
+            limit = min(max(limit or self.MAX_LIMIT, 1), self.MAX_LIMIT) if paginated else None
+            content = self._iter_page(catalog, visible_categories, position, limit, self._parse_since(since), self._parse_fields(fields))
+        else:
+            # entries are already serialized in the catalog, they are only copied into the response
+            content = catalog.iter_json(visible_categories)
+        response = StreamingHttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    @staticmethod
+    def _parse_cursor(cursor: str | None) -> tuple[str, int] | None:
+        if not cursor:
+            return None
+        category, _, uid = cursor.rpartition(':')
+        try:
+            return category, int(uid)
+        except ValueError:
+            raise APIError('Некорректный курсор')
+
+    @staticmethod
+    def _parse_since(since: str | None) -> float | None:
+        if not since:
+            return None
+        try:
+            return float(since)
+        except ValueError:
+            pass
+        try:
+            since = datetime.datetime.fromisoformat(since)
+        except ValueError:
+            raise APIError('Некорректная дата в параметре since')
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since.timestamp()
+
+    @staticmethod
+    def _parse_fields(fields: str | None) -> list[str] | None:
+        if not fields:
+            return None
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in shared_articles.ENTRY_FIELDS]
+        if unknown:
+            raise APIError('Неизвестные поля: %s' % ', '.join(unknown))
+        return fields
+
+    # Items of every category are ordered by uid, so a page continues right after (category, uid) of the previous one
+    # and pages stay consistent while the catalog changes.
+    @staticmethod
+    def _iter_page(catalog, categories: list[str], position: tuple[str, int] | None, limit: int | None, since: float | None, fields: list[str] | None):
+        buffer = bytearray(b'{"results":[' if limit is not None else b'[')
+        count = 0
+        last_position = None
+        next_position = None
+        for category in categories:
+            if position is not None and category < position[0]:
                 continue
-            result.extend(entries)
-        return self.render_json(200, result)
+            for uid, updated_at, item in catalog.iter_entries(category):
+                if position is not None and category == position[0] and uid <= position[1]:
+                    continue
+                if since is not None and updated_at < since:
+                    continue
+                if limit is not None and count == limit:
+                    next_position = last_position
+                    break
+                if count:
+                    buffer += b','
+                if fields is not None:
+                    entry = json.loads(bytes(item))
+                    buffer += json.dumps({field: entry.get(field) for field in fields}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                else:
+                    buffer += item
+                count += 1
+                last_position = (category, uid)
+                if len(buffer) >= STREAM_CHUNK_SIZE:
+                    yield bytes(buffer)
+                    buffer.clear()
+            if next_position is not None:
+                break
+        if limit is not None:
+            next_cursor = '%s:%d' % next_position if next_position is not None else None
+            buffer += b'],"cursor":' + json.dumps(next_cursor, ensure_ascii=False).encode('utf-8') + b'}'
+        else:
+            buffer += b']'
+        yield bytes(buffer)
 
 
 class ArticleView(APIView):
@@ -74,6 +184,7 @@ class CreateView(ArticleView):
         if data.get('parent') is not None:
             articles.set_parent(article, articles.normalize_article_name(data['parent']), request.user)
 
+        enqueue_search_index(article)
         notifications.subscribe_to_notifications(subscriber=request.user, article=article)
 
         return self.render_json(201, {'status': 'ok', 'pageId': full_name})
@@ -182,7 +293,7 @@ class FetchOrUpdateView(ArticleView):
 
 
         article.refresh_from_db()
-        update_search_index(article)
+        enqueue_search_index(article)
         return self.render_article(article)
 
     def delete(self, request: HttpRequest, full_name: str) -> HttpResponse:
@@ -253,7 +364,7 @@ class FetchOrRevertLogView(APIView):
         articles.refresh_article_links(version)
 
         article.refresh_from_db()
-        update_search_index(article)
+        enqueue_search_index(article)
         return self.render_json(200, {"pageId": article.full_name})
 
 
@@ -1,7 +1,7 @@
 from django.http import HttpRequest
 
 from renderer.utils import render_user_to_json
-from . import APIView
+from . import APIView, APIError
 
 from web.controllers import search, articles
 
@@ -108,4 +108,11 @@ class SearchView(APIView):
         while i != -1:
             positions.append(i)
             i = s.find(p, i + 1)
-        return positions
\ No newline at end of file
+        return positions
+
+
+class SearchQueueStatsView(APIView):
+    def get(self, request: HttpRequest):
+        if not request.user.has_perm('roles.view_sensitive_info'):
+            raise APIError('Недостаточно прав', 403)
+        return self.render_json(200, search.get_search_index_queue_stats())
@@ -1,14 +1,46 @@
-from django.http import HttpRequest
+from django.http import HttpRequest, HttpResponse
 
 from shared_data import shared_users
-from . import APIView, APIError
+from . import APIView, APIError, takes_url_params
 
 from web.models import ActionLogEntry
 
 
 class AllUsersView(APIView):
     def get(self, request: HttpRequest):
-        return self.render_json(200, shared_users.get_all_users())
+        # entries are already serialized in the directory, they are only copied into the response
+        return HttpResponse(shared_users.get_all_users_json(), content_type='application/json')
+
+
+class SearchUsersView(APIView):
+    MAX_LIMIT = 50
+
+    @takes_url_params
+    def get(self, request: HttpRequest, *, q: str='', limit: int=10):
+        q = q.strip().lstrip('@')
+        if not q:
+            return self.render_json(200, {'users': []})
+        limit = min(max(limit, 1), self.MAX_LIMIT)
+        return self.render_json(200, {'users': shared_users.search_users(q, limit)})
+
+
+class LookupUsersView(APIView):
+    MAX_USERS = 100
+
+    @takes_url_params
+    def get(self, request: HttpRequest, *, ids: str='', names: str=''):
+        try:
+            user_ids = [int(x) for x in ids.split(',') if x.strip()]
+        except ValueError:
+            raise APIError('Некорректный список ID пользователей')
+        user_names = [x.strip() for x in names.split(',') if x.strip()]
+        if len(user_ids) + len(user_names) > self.MAX_USERS:
+            raise APIError('Слишком много пользователей в запросе')
+
+        users = shared_users.get_users_by_ids(user_ids)
+        found_ids = {user['id'] for user in users}
+        users += [user for user in shared_users.get_users_by_names(user_names) if user['id'] not in found_ids]
+        return self.render_json(200, {'users': users})
 
 
 class AdminSusActivityApiView(APIView):
@@ -9,10 +9,13 @@ from django.conf import settings
 from django.views.generic.base import TemplateResponseMixin, ContextMixin, View
 from django.template.loader import render_to_string
 from django.http import HttpResponseRedirect
+from django.db import transaction
+from django.utils.decorators import method_decorator
 
 from web.models.site import get_current_site
 from web.models.articles import Article, Category
 from web.models.notifications import UserNotificationMapping
+from web import read_only
 from web.controllers import articles, notifications
 from web.util.css import normalize_computed_style
 
@@ -55,7 +58,8 @@ class ArticleView(TemplateResponseMixin, ContextMixin, View):
         nav = articles.get_article(name)
         if nav:
             context = RenderContext(article, nav, path_params, self.request.user)
-            return single_pass_render(articles.get_latest_source(nav), context), context.computed_style
+            # navigation is the same for almost every visitor, and path params only matter if it has modules
+            return single_pass_render(articles.get_latest_source(nav), context, cache_deps=[nav.full_name]), context.computed_style
         return '', ''
 
     @staticmethod
@@ -95,13 +99,14 @@ class ArticleView(TemplateResponseMixin, ContextMixin, View):
             source = template_source.replace('%%content%%', articles.get_latest_source(article))
             source = apply_template(source, lambda param: self.get_this_page_params(path_params, param, {'canonical_url': canonical_url}))
             context = RenderContext(article, article, path_params, self.request.user)
-            content, excerpt, image = single_pass_render_with_excerpt(source, context)
+            cache_deps = [article.full_name, '%s:_template' % article.category]
+            content, excerpt, image = single_pass_render_with_excerpt(source, context, cache_deps=cache_deps)
             redirect_to = context.redirect_to
             title = context.title
             status = context.status
             computed_style = context.computed_style
 
-            rev_number = articles.get_latest_log_entry(article).rev_number
+            rev_number = articles.get_latest_rev_number(article)
             updated_at = article.updated_at
             if context.og_image:
                 image = context.og_image
@@ -170,11 +175,14 @@ class ArticleView(TemplateResponseMixin, ContextMixin, View):
             status = 403
             article = None
         
-        comment_thread_id, comment_count = articles.get_comment_info(article)
+        comment_thread_id, comment_count = articles.get_comment_info(article, create=False)
         breadcrumbs = [{'url': '/' + articles.get_full_name(x), 'title': x.title} for x in
                        articles.get_breadcrumbs(article)]
 
         if article is not None and path_params.get('comments') == 'show':
+            # comments thread is only created when someone actually opens it
+            with read_only.primary():
+                comment_thread_id, _ = articles.get_comment_info(article)
             return {'redirect_to': '/forum/t-%d/%s' % (comment_thread_id, articles.normalize_article_name(article.display_name))}
 
         # this is needed for parser debug logging so that page content is always the last printed
@@ -275,6 +283,19 @@ class ArticleView(TemplateResponseMixin, ContextMixin, View):
 
         return context
 
+    # ATOMIC_REQUESTS is applied here instead, so that read-only requests can skip it
+    @method_decorator(transaction.non_atomic_requests)
+    def dispatch(self, request, *args, **kwargs):
+        if read_only.is_read_only_request(request):
+            with read_only.read_only():
+                response = super().dispatch(request, *args, **kwargs)
+                # templates are rendered after the view returns, and they read from the database too
+                if hasattr(response, 'render'):
+                    response.render()
+                return response
+        with transaction.atomic():
+            return super().dispatch(request, *args, **kwargs)
+
     def get(self, request, *args, **kwargs):
         path = request.META['RAW_PATH'][1:]
         context = self.get_context_data(path=path)
@@ -9,7 +9,7 @@ from django.contrib.admin import site
 from django.contrib import messages
 from django.forms import Form
 
-from web.models.articles import Vote
+from web.controllers import articles
 
 
 User = get_user_model()
@@ -49,7 +49,7 @@ class ResetUserVotesView(FormView):
         if not user:
             messages.error(self.request, "Пользователь не существует")
         else:
-            Vote.objects.filter(user=user).delete()
+            articles.delete_user_votes(user)
 
         LogEntry.objects.log_action(
             user_id=self.request.user.pk,